@@ -0,0 +1,168 @@
+import os
+import sys
+import time
+import json
+import socket
+import subprocess
+import threading
+from io import BytesIO
+from pathlib import Path
+
+SRC_PATH = Path(__file__).resolve().parent.parent / 'src'
+sys.path.insert(0, str( SRC_PATH ))
+
+import cv2
+import grpc
+import numpy as np
+from PIL import Image
+import ocr_service_pb2 as service_pb
+import ocr_service_pb2_grpc as service_grpc
+
+# Latency of KeepAlive, GetSupportedLanguages and MotionDetection while MangaOCR is saturated with
+# recognitions, on the threaded server and on the grpc.aio server (ASYNC_SERVER).
+# Run "gen_grpc_service" first, then: python benchmarks/async_server_benchmark.py [concurrent_recognitions]
+
+# The scheduler queue holds more requests than the threaded server has threads (10); with the default
+# queue size, requests beyond it are rejected before they can take every thread.
+MODES = {
+    'threads': { 'ASYNC_SERVER': 'false', 'FRAME_CACHE_SIZE': '0', 'ENGINE_QUEUE_SIZE': '16' },
+    'asyncio': { 'ASYNC_SERVER': 'true', 'FRAME_CACHE_SIZE': '0', 'ENGINE_QUEUE_SIZE': '16' },
+}
+PROBES = 50
+TIMEOUT_SECONDS = 300
+
+
+def free_port() -> str:
+    with socket.socket() as sock:
+        sock.bind( ( '127.0.0.1', 0 ) )
+        return str( sock.getsockname()[1] )
+
+
+def encode_png( image: np.ndarray ) -> bytes:
+    buffer = BytesIO()
+    Image.fromarray( image ).save( buffer, format='PNG' )
+    return buffer.getvalue()
+
+
+def make_page() -> bytes:
+    page = np.full( ( 1080, 1920, 3 ), 255, dtype=np.uint8 )
+    for idx in range( 12 ):
+        cv2.putText( page, 'TEXT LINE ' * 4, ( 40, 80 + idx * 80 ), cv2.FONT_HERSHEY_SIMPLEX, 1.5, ( 0, 0, 0 ), 3 )
+    return encode_png( page )
+
+
+def start_service( settings: dict ) -> tuple[ subprocess.Popen, str ]:
+
+    process = subprocess.Popen(
+        [ sys.executable, '-u', 'py_ocr_service.py', free_port() ],
+        cwd= SRC_PATH,
+        env= { **os.environ, **settings },
+        stdout= subprocess.PIPE,
+        stderr= subprocess.DEVNULL,
+        text= True
+    )
+
+    for line in process.stdout:
+        if line.startswith('[INFO-JSON]'):
+            break
+    else:
+        raise RuntimeError('The service exited before listening')
+
+    server_address = json.loads( line.partition(':')[2] )['server_address'].replace( '0.0.0.0', '127.0.0.1' )
+
+    return process, server_address
+
+
+def probe( stub: service_grpc.OCRServiceStub, frame: bytes ) -> dict[ str, float ]:
+
+    calls = {
+        'KeepAlive': lambda: stub.KeepAlive(
+            service_pb.KeepAliveRequest( keep_alive= True, timeout_seconds= 60 )
+        ),
+        'GetSupportedLanguages': lambda: stub.GetSupportedLanguages(
+            service_pb.GetSupportedLanguagesRequest( ocr_engine= 'MangaOCR' )
+        ),
+        'MotionDetection': lambda: stub.MotionDetection(
+            service_pb.MotionDetectionRequest(
+                stream_id= 'async_server_benchmark',
+                frame= frame,
+                threshold_min= 10,
+                threshold_max= 100,
+                stream_length= 4
+            )
+        ),
+    }
+
+    latencies = {}
+
+    for name, call in calls.items():
+        start = time.perf_counter()
+        call()
+        latencies[ name ] = time.perf_counter() - start
+
+    return latencies
+
+
+def measure( settings: dict, page: bytes, frame: bytes, concurrency: int ) -> dict[ str, np.ndarray ]:
+
+    process, server_address = start_service( settings )
+
+    try:
+        with grpc.insecure_channel( server_address ) as channel:
+            stub = service_grpc.OCRServiceStub( channel )
+
+            # Loads the model before the load starts
+            stub.RecognizeBytes(
+                service_pb.RecognizeBytesRequest( id= 'warm-up', image_bytes= page, ocr_engine= 'MangaOCR' ),
+                timeout= TIMEOUT_SECONDS,
+                wait_for_ready= True
+            )
+
+            running = threading.Event()
+            running.set()
+
+            def recognize_loop( idx: int ):
+                while running.is_set():
+                    try:
+                        stub.RecognizeBytes(
+                            service_pb.RecognizeBytesRequest( id= f'load-{idx}', image_bytes= page, ocr_engine= 'MangaOCR' ),
+                            timeout= TIMEOUT_SECONDS
+                        )
+                    except grpc.RpcError:
+                        time.sleep( 0.01 ) # Rejected by a full queue
+
+            load = [ threading.Thread( target= recognize_loop, args= ( idx, ), daemon= True ) for idx in range( concurrency ) ]
+            for thread in load:
+                thread.start()
+
+            time.sleep( 1 )
+
+            probes = [ probe( stub, frame ) for _ in range( PROBES ) ]
+
+            running.clear()
+            for thread in load:
+                thread.join()
+
+    finally:
+        process.kill()
+        process.wait()
+
+    return { name: np.array( [ latencies[ name ] for latencies in probes ] ) for name in probes[0] }
+
+
+def main():
+    concurrency = int( sys.argv[1] ) if len(sys.argv) > 1 else 16
+    page = make_page()
+    frame = encode_png( np.zeros( ( 720, 1280, 3 ), dtype=np.uint8 ) )
+
+    print(f'{concurrency} concurrent MangaOCR recognitions')
+
+    for mode, settings in MODES.items():
+        print(f'{mode}:')
+
+        for name, latencies in measure( settings, page, frame, concurrency ).items():
+            print(f'  {name:<22} p50 {np.median(latencies) * 1000:8.1f} ms   p95 {np.percentile(latencies, 95) * 1000:8.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
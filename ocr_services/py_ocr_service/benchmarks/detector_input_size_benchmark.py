@@ -0,0 +1,81 @@
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str( Path(__file__).resolve().parent.parent / 'src' ))
+
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+from manga_ocr_service.comic_text_detector import ComicTextDetector
+
+# Detection latency and block count for each detector input size, and for the adaptive selection
+# (tiled above TILING_THRESHOLD), on captures from a small dialogue box up to a 4K screenshot.
+# Run "gen_grpc_service" first, then from src/:
+#   python ../benchmarks/detector_input_size_benchmark.py [captures_dir]
+
+INPUT_SIZES = [ 512, 768, 1024, 1536 ]
+TILING_THRESHOLD = 2560
+CAPTURES = {
+    'dialogue 800x200': ( 200, 800 ),
+    'window 1280x720': ( 720, 1280 ),
+    'screen 1920x1080': ( 1080, 1920 ),
+    '4K 3840x2160': ( 2160, 3840 ),
+}
+REPEATS = 5
+
+
+def make_capture( height: int, width: int ) -> np.ndarray:
+    capture = np.full( ( height, width, 3 ), 255, dtype=np.uint8 )
+    scale = max( 0.6, height / 400 )
+    for idx in range( max( 1, height // int( 60 * scale ) - 1 ) ):
+        cv2.putText(
+            capture, 'TEXT LINE ' * 3, ( int( 20 * scale ), int( 50 * scale ) + idx * int( 60 * scale ) ),
+            cv2.FONT_HERSHEY_SIMPLEX, scale, ( 0, 0, 0 ), max( 1, int( 2 * scale ) )
+        )
+    return capture
+
+
+def load_captures( directory: str | None ) -> dict[ str, np.ndarray ]:
+    if not directory:
+        return { name: make_capture( *shape ) for name, shape in CAPTURES.items() }
+    paths = sorted( path for path in Path(directory).iterdir() if path.suffix.lower() in ( '.png', '.jpg', '.jpeg' ) )
+    return { path.name: np.array( Image.open(path).convert('RGB') ) for path in paths }
+
+
+def timed( detector: ComicTextDetector, capture: np.ndarray, input_size: int | None ) -> tuple[ int, float ]:
+    blocks = detector.detect( capture, input_size= input_size )
+    start = time.perf_counter()
+    for _ in range( REPEATS ):
+        detector.detect( capture, input_size= input_size )
+    return len(blocks), ( time.perf_counter() - start ) / REPEATS
+
+
+def main():
+    captures = load_captures( sys.argv[1] if len(sys.argv) > 1 else None )
+
+    detector = ComicTextDetector( input_sizes= INPUT_SIZES, tiling_threshold= TILING_THRESHOLD )
+    detector.warm_up()
+
+    print(f'torch threads: {torch.get_num_threads()}, input sizes: {detector.input_sizes}')
+
+    for name, capture in captures.items():
+        print(f'{name}:')
+
+        for input_size in detector.input_sizes:
+            blocks, latency = timed( detector, capture, input_size )
+            print(f'  {input_size:>8}  {latency * 1000:8.2f} ms  {blocks:3} blocks')
+
+        if max( capture.shape[:2] ) > TILING_THRESHOLD:
+            tiles = detector.tile_layout( capture.shape[1], capture.shape[0] )
+            selection = f'{len(tiles)} tiles of {detector.tile_size} at {detector.tile_input_size()}'
+        else:
+            selection = str( detector.select_input_size( capture ) )
+
+        blocks, latency = timed( detector, capture, None )
+        print(f'  adaptive  {latency * 1000:8.2f} ms  {blocks:3} blocks  ({selection})')
+
+
+if __name__ == '__main__':
+    main()
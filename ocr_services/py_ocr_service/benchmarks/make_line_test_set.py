@@ -0,0 +1,113 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+# Renders the labelled line crops listed in line_test_set.tsv, written for the recognition benchmarks,
+# into a directory with the labels.tsv they read. Rendering is deterministic for a given font and Pillow
+# version, so results should name the font, e.g. IPAexGothic (ipaexg.ttf, IPA Font License).
+#   python benchmarks/make_line_test_set.py path/to/font.ttf [output_dir]
+
+MANIFEST_PATH = Path(__file__).resolve().parent / 'line_test_set.tsv'
+OUTPUT_PATH = Path(__file__).resolve().parent / 'line_test_set'
+
+# Drawn rotated in vertical text
+ROTATED_CHARS = set( 'ー〜…「」（）' )
+# Drawn in the upper right of their cell in vertical text
+CORNER_CHARS = set( '、。' )
+MARGIN = 0.4 # In characters
+
+
+def read_manifest() -> list[ dict ]:
+    entries = []
+    for row in MANIFEST_PATH.read_text( encoding='utf8' ).splitlines():
+        if not row or row.startswith('#'):
+            continue
+        file_name, direction, size, background, text = row.split('\t')
+        entries.append({
+            'file_name': file_name,
+            'direction': direction,
+            'size': int( size ),
+            'background': background,
+            'text': text,
+        })
+    return entries
+
+
+def draw_char( font: ImageFont.FreeTypeFont, char: str, size: int ) -> Image.Image:
+    cell = Image.new( 'L', ( size, size ), 0 )
+    ImageDraw.Draw( cell ).text( ( size / 2, size / 2 ), char, fill= 255, font= font, anchor= 'mm' )
+    return cell
+
+
+def render_mask( font: ImageFont.FreeTypeFont, text: str, size: int, direction: str ) -> Image.Image:
+
+    margin = round( size * MARGIN )
+
+    if direction == 'horizontal':
+        width = round( font.getlength( text ) ) + 2 * margin
+        mask = Image.new( 'L', ( width, size + 2 * margin ), 0 )
+        ImageDraw.Draw( mask ).text( ( margin, margin + size / 2 ), text, fill= 255, font= font, anchor= 'lm' )
+        return mask
+
+    mask = Image.new( 'L', ( size + 2 * margin, len(text) * size + 2 * margin ), 0 )
+
+    for idx, char in enumerate( text ):
+        cell = draw_char( font, char, size )
+
+        if char in ROTATED_CHARS:
+            cell = cell.transpose( Image.Transpose.ROTATE_270 )
+
+        offset = ( round( size * 0.55 ), -round( size * 0.55 ) ) if char in CORNER_CHARS else ( 0, 0 )
+        mask.paste( 255, ( margin + offset[0], margin + idx * size + offset[1] ), cell )
+
+    return mask
+
+
+def render( font_path: str, entry: dict, seed: int ) -> Image.Image:
+
+    font = ImageFont.truetype( font_path, entry['size'] )
+    mask = np.asarray( render_mask( font, entry['text'], entry['size'], entry['direction'] ) ) / 255
+    rng = np.random.default_rng( seed )
+
+    height, width = mask.shape
+
+    if entry['background'] == 'tone':
+        # Screentone dots
+        y, x = np.mgrid[ :height, :width ]
+        background = np.where( ( x % 6 < 2 ) & ( y % 6 < 2 ), 170, 235 )[ ..., None ].repeat( 3, axis=2 )
+        ink = np.zeros( 3 )
+    elif entry['background'] == 'color':
+        background = np.broadcast_to( rng.integers( 150, 256, 3 ), ( height, width, 3 ) )
+        ink = rng.integers( 0, 90, 3 )
+    else:
+        background = np.full( ( height, width, 3 ), 255 )
+        ink = np.zeros( 3 )
+
+    image = background * ( 1 - mask[ ..., None ] ) + ink * mask[ ..., None ]
+    image += rng.normal( 0, 4, image.shape )
+
+    return Image.fromarray( image.clip( 0, 255 ).astype( np.uint8 ) )
+
+
+def main():
+    font_path = sys.argv[1]
+    output_path = Path( sys.argv[2] ) if len(sys.argv) > 2 else OUTPUT_PATH
+    output_path.mkdir( parents= True, exist_ok= True )
+
+    entries = read_manifest()
+
+    for seed, entry in enumerate( entries ):
+        render( font_path, entry, seed ).save( output_path / entry['file_name'] )
+
+    ( output_path / 'labels.tsv' ).write_text(
+        ''.join( f'{entry["file_name"]}\t{entry["text"]}\n' for entry in entries ),
+        encoding='utf8'
+    )
+
+    print(f'{len(entries)} lines in {output_path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str( Path(__file__).resolve().parent.parent / 'src' ))
+
+import cv2
+import numpy as np
+from motion_detection_service.motion_detection_service import MotionDetectionService
+
+# Compares the previous list + np.stack/np.median background with the ring buffer modes.
+# Run "gen_grpc_service" first, then: python benchmarks/motion_detection_benchmark.py
+
+RESOLUTIONS = {
+    '1080p': ( 1080, 1920 ),
+    '4K': ( 2160, 3840 ),
+}
+STREAM_LENGTH = 8
+FRAMES = 40
+
+
+def make_frames( height: int, width: int, count: int ) -> list[ np.ndarray ]:
+    rng = np.random.default_rng(0)
+    base = rng.integers( 0, 256, ( height, width, 3 ), dtype=np.uint8 )
+    frames = []
+    for idx in range(count):
+        frame = base.copy()
+        y = ( idx * 37 ) % ( height - 200 )
+        frame[ y : y + 200, 100 : 900 ] = 255
+        frames.append( frame )
+    return frames
+
+
+def median_image( images: list[ np.ndarray ] ) -> np.ndarray:
+    stacked_images = np.stack( images, axis=0 )
+    return np.median( stacked_images, axis=0 ).astype(np.uint8)
+
+
+def legacy_detect( service: MotionDetectionService, history: list, frame: np.ndarray ):
+    next_frame = service.preprocessFrame( frame )
+
+    if history:
+        background_frame = median_image( history )
+        frame_difference = service.frameDiff( background_frame, next_frame )
+        _, frame_th = cv2.threshold( frame_difference, 30, 255, cv2.THRESH_BINARY )
+        frame_difference.sum()
+        cv2.countNonZero( frame_th )
+
+    history.append( next_frame )
+
+    while len(history) > STREAM_LENGTH:
+        history.pop(0)
+
+
+def run( label: str, frames: list[ np.ndarray ], detect ) -> float:
+    # The first stream_length frames only fill the history
+    for frame in frames[ :STREAM_LENGTH ]:
+        detect( frame )
+
+    start = time.perf_counter()
+    for frame in frames[ STREAM_LENGTH: ]:
+        detect( frame )
+    elapsed = ( time.perf_counter() - start ) / ( len(frames) - STREAM_LENGTH )
+
+    print(f'  {label:<16} {elapsed * 1000:8.2f} ms/frame')
+    return elapsed
+
+
+def main():
+    for name, ( height, width ) in RESOLUTIONS.items():
+        print(f'{name} ({width}x{height}), stream_length={STREAM_LENGTH}')
+
+        frames = make_frames( height, width, FRAMES )
+        service = MotionDetectionService()
+
+        history = []
+        run( 'legacy median', frames, lambda frame: legacy_detect( service, history, frame ) )
+
+        for mode in ( 'median', 'running_average' ):
+            stream_id = f'{name}-{mode}'
+            run(
+                mode,
+                frames,
+                lambda frame: service.detect(
+                    stream_id,
+                    frame,
+                    threshold_min= 30,
+                    threshold_max= 255,
+                    stream_length= STREAM_LENGTH,
+                    background_mode= mode
+                )
+            )
+            service.deleteStream( stream_id )
+
+
+if __name__ == '__main__':
+    main()
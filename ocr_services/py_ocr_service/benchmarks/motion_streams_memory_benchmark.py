@@ -0,0 +1,66 @@
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str( Path(__file__).resolve().parent.parent / 'src' ))
+
+import numpy as np
+from motion_detection_service.motion_detection_service import MotionDetectionService
+
+# Memory held by MotionDetectionService as capture sources come and go over a long session:
+# each source sends a burst of 1080p frames under a new stream_id and never closes it.
+# "unbounded" disables eviction, like the former class-level streams dict.
+# Run "gen_grpc_service" first, then from src/: python ../benchmarks/motion_streams_memory_benchmark.py [sources]
+
+SETTINGS = {
+    'unbounded': { 'MOTION_STREAM_IDLE_SECONDS': '1e9', 'MOTION_STREAMS_MEMORY_MB': '1000000' },
+    'idle 0.5 s': { 'MOTION_STREAM_IDLE_SECONDS': '0.5', 'MOTION_STREAMS_MEMORY_MB': '1000000' },
+    'budget 64 MB': { 'MOTION_STREAM_IDLE_SECONDS': '1e9', 'MOTION_STREAMS_MEMORY_MB': '64' },
+}
+FRAMES_PER_SOURCE = 6
+STREAM_LENGTH = 5
+
+
+def run( label: str, settings: dict, sources: int, frame: np.ndarray ):
+
+    os.environ.update( settings )
+    service = MotionDetectionService()
+
+    peak_bytes = 0
+    start = time.perf_counter()
+
+    for source in range( sources ):
+        for _ in range( FRAMES_PER_SOURCE ):
+            service.detect(
+                f'source-{source}',
+                frame,
+                threshold_min= 30,
+                threshold_max= 255,
+                stream_length= STREAM_LENGTH
+            )
+
+        peak_bytes = max( peak_bytes, service.memoryUsage()['bytes'] )
+        time.sleep( 0.01 )
+
+    elapsed = time.perf_counter() - start
+    usage = service.memoryUsage()
+
+    print(
+        f'  {label:<14} {usage["streams"]:5} streams  {usage["bytes"] / 2**20:9.1f} MB at the end'
+        f'  {peak_bytes / 2**20:9.1f} MB peak  {elapsed * 1000 / ( sources * FRAMES_PER_SOURCE ):6.2f} ms/frame'
+    )
+
+
+def main():
+    sources = int( sys.argv[1] ) if len(sys.argv) > 1 else 200
+    frame = np.random.default_rng(0).integers( 0, 256, ( 1080, 1920, 3 ), dtype=np.uint8 )
+
+    print(f'{sources} sources, {FRAMES_PER_SOURCE} frames each, stream_length={STREAM_LENGTH}')
+
+    for label, settings in SETTINGS.items():
+        run( label, settings, sources, frame )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str( Path(__file__).resolve().parent.parent / 'src' ))
+
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+from manga_ocr import MangaOcr
+import manga_ocr
+from manga_ocr_service.onnx_backend import OnnxMangaOcr
+from manga_ocr_service.comic_text_detector import ComicTextDetector
+
+# Parity and latency of the ONNX Runtime backend against the torch models.
+# Recognition is compared on line crops, detection on pages.
+# Run "gen_grpc_service" first, then from src/:
+#   python ../benchmarks/onnx_backend_benchmark.py [lines_dir] [pages_dir]
+
+MODEL = 'kha-white/manga-ocr-base'
+REPEATS = 5
+
+
+def load_images( directory: str | None, default: list[ np.ndarray ] ) -> list[ np.ndarray ]:
+    if not directory:
+        return default
+    paths = sorted( path for path in Path(directory).iterdir() if path.suffix.lower() in ( '.png', '.jpg', '.jpeg' ) )
+    return [ np.array( Image.open(path).convert('RGB') ) for path in paths ]
+
+
+def make_page() -> np.ndarray:
+    page = np.full( ( 1600, 1100, 3 ), 255, dtype=np.uint8 )
+    for idx in range(12):
+        cv2.putText( page, 'TEXT ' * 4, ( 80, 120 + idx * 110 ), cv2.FONT_HERSHEY_SIMPLEX, 2, ( 0, 0, 0 ), 4 )
+    return page
+
+
+def timed( function, *args ) -> tuple[ object, float ]:
+    result = function( *args )
+    start = time.perf_counter()
+    for _ in range( REPEATS ):
+        function( *args )
+    return result, ( time.perf_counter() - start ) / REPEATS
+
+
+def compare_recognizers( lines: list[ np.ndarray ] ):
+    torch_ocr = MangaOcr( MODEL )
+    onnx_ocr = OnnxMangaOcr( MODEL )
+
+    matches = 0
+    torch_total = 0
+    onnx_total = 0
+
+    for line in lines:
+        image = Image.fromarray( line )
+        torch_text, torch_time = timed( torch_ocr, image )
+        onnx_text, onnx_time = timed( onnx_ocr, image )
+
+        matches += torch_text == onnx_text
+        torch_total += torch_time
+        onnx_total += onnx_time
+
+        if torch_text != onnx_text:
+            print(f'  mismatch: torch "{torch_text}" / onnx "{onnx_text}"')
+
+    print(f'Recognition, {len(lines)} lines: {matches}/{len(lines)} identical')
+    print(f'  torch {torch_total / len(lines) * 1000:8.2f} ms/line')
+    print(f'  onnx  {onnx_total / len(lines) * 1000:8.2f} ms/line')
+
+
+def compare_detectors( pages: list[ np.ndarray ] ):
+    torch_detector = ComicTextDetector()
+    onnx_detector = ComicTextDetector( backend= 'ONNX' )
+
+    torch_total = 0
+    onnx_total = 0
+
+    for page in pages:
+        torch_blocks, torch_time = timed( torch_detector.detect, page )
+        onnx_blocks, onnx_time = timed( onnx_detector.detect, page )
+
+        torch_total += torch_time
+        onnx_total += onnx_time
+
+        same_blocks = [ np.array( block.coordinates ).tolist() for block in torch_blocks ] == \
+            [ np.array( block.coordinates ).tolist() for block in onnx_blocks ]
+        print(f'  page: {len(torch_blocks)} / {len(onnx_blocks)} blocks, identical boxes: {same_blocks}')
+
+    # Raw network outputs, before thresholds can hide small differences
+    width, height = onnx_detector.text_detector.input_size
+    img_in = torch.from_numpy( np.random.default_rng(0).random( ( 1, 3, height, width ), dtype=np.float32 ) )
+    with torch.no_grad():
+        torch_outputs = torch_detector.text_detector.net( img_in )
+    onnx_outputs = onnx_detector.text_detector.net( img_in )
+    max_difference = max(
+        float( ( torch_output - onnx_output ).abs().max() )
+        for torch_output, onnx_output in zip( torch_outputs, onnx_outputs )
+    )
+
+    print(f'Detection, {len(pages)} pages, max output difference: {max_difference:.2e}')
+    print(f'  torch {torch_total / len(pages) * 1000:8.2f} ms/page')
+    print(f'  onnx  {onnx_total / len(pages) * 1000:8.2f} ms/page')
+
+
+def main():
+    example_line = np.array( Image.open( Path( manga_ocr.__file__ ).parent / 'assets/example.jpg' ).convert('RGB') )
+
+    lines = load_images( sys.argv[1] if len(sys.argv) > 1 else None, [ example_line ] )
+    pages = load_images( sys.argv[2] if len(sys.argv) > 2 else None, [ make_page() ] )
+
+    print(f'torch threads: {torch.get_num_threads()}')
+    compare_recognizers( lines )
+    compare_detectors( pages )
+
+
+if __name__ == '__main__':
+    main()
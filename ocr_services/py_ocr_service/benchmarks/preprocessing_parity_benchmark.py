@@ -0,0 +1,115 @@
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str( Path(__file__).resolve().parent.parent / 'src' ))
+
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+from manga_ocr import MangaOcr
+import manga_ocr
+from manga_ocr_service.recognition_workers import preprocess_line_images, to_line_grayscale
+
+# Parity and latency of the array preprocessing in recognition_workers against MangaOcr's own
+# (PIL grayscale, then its ViTImageProcessor), on line crops: pixel values, then generated tokens.
+# Crops are given both in color and as the grayscale crops MangaOcrService.crop_lines hands over.
+# Run "gen_grpc_service" first, then from src/:
+#   python ../benchmarks/preprocessing_parity_benchmark.py [lines_dir]
+
+MODEL = 'kha-white/manga-ocr-base'
+REPEATS = 20
+
+
+def load_lines( directory: str | None ) -> dict[ str, np.ndarray ]:
+
+    example_path = Path( manga_ocr.__file__ ).parent / 'assets/example.jpg'
+    paths = [ example_path ]
+
+    if directory:
+        paths = sorted( path for path in Path(directory).iterdir() if path.suffix.lower() in ( '.png', '.jpg', '.jpeg' ) )
+
+    return { path.name: np.array( Image.open(path).convert('RGB') ) for path in paths }
+
+
+def with_resized_copies( lines: dict[ str, np.ndarray ] ) -> dict[ str, np.ndarray ]:
+    # Shrunk and enlarged along each axis, the cases where resampling filters disagree the most
+    name, line = next( iter( lines.items() ) )
+    height, width = line.shape[:2]
+
+    copies = dict( lines )
+    for scale_x, scale_y in ( ( 0.3, 1 ), ( 1, 0.3 ), ( 3, 1 ), ( 1, 3 ), ( 0.15, 2.5 ) ):
+        size = ( max( 8, round( width * scale_x ) ), max( 8, round( height * scale_y ) ) )
+        copies[ f'{name} {size[0]}x{size[1]}' ] = cv2.resize( line, size, interpolation= cv2.INTER_CUBIC )
+
+    return copies
+
+
+def processor_pixel_values( processor, line: np.ndarray ) -> np.ndarray:
+    image = Image.fromarray( line ).convert('L').convert('RGB')
+    return processor( image, return_tensors='np' ).pixel_values
+
+
+@torch.inference_mode()
+def generate( manga_ocr: MangaOcr, pixel_values: np.ndarray ) -> list[ int ]:
+    token_ids = manga_ocr.model.generate( torch.from_numpy( pixel_values ), max_length= 300 )
+    return token_ids[0].tolist()
+
+
+def timed( function, *args ) -> float:
+    function( *args )
+    start = time.perf_counter()
+    for _ in range( REPEATS ):
+        function( *args )
+    return ( time.perf_counter() - start ) / REPEATS
+
+
+def main():
+    lines = with_resized_copies( load_lines( sys.argv[1] if len(sys.argv) > 1 else None ) )
+
+    manga_ocr = MangaOcr( MODEL )
+    processor = manga_ocr.processor
+
+    pixel_matches = { 'color crop': 0, 'gray crop': 0 }
+    token_matches = { 'color crop': 0, 'gray crop': 0 }
+    processor_total = 0
+    arrays_total = 0
+
+    for name, line in lines.items():
+
+        reference = processor_pixel_values( processor, line )
+        reference_tokens = generate( manga_ocr, reference )
+
+        inputs = {
+            'color crop': line,
+            'gray crop': to_line_grayscale( line ),
+        }
+
+        for input_name, line_image in inputs.items():
+            pixel_values = preprocess_line_images( processor, [ line_image ] ).numpy()
+            max_difference = float( np.abs( pixel_values - reference ).max() )
+
+            pixel_matches[ input_name ] += max_difference == 0
+
+            tokens_match = generate( manga_ocr, pixel_values ) == reference_tokens
+            token_matches[ input_name ] += tokens_match
+
+            if max_difference or not tokens_match:
+                print(f'  {name}, {input_name}: max pixel difference {max_difference:.2e}, identical tokens: {tokens_match}')
+
+        processor_total += timed( processor_pixel_values, processor, line )
+        arrays_total += timed( preprocess_line_images, processor, [ inputs['gray crop'] ] )
+
+    print(f'{len(lines)} lines')
+    for input_name in pixel_matches:
+        print(
+            f'  {input_name:<13} identical pixel values {pixel_matches[ input_name ]}/{len(lines)}'
+            f'   identical tokens {token_matches[ input_name ]}/{len(lines)}'
+        )
+    print(f'  processor {processor_total / len(lines) * 1000:8.3f} ms/line')
+    print(f'  arrays    {arrays_total / len(lines) * 1000:8.3f} ms/line')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+import io
+import sys
+import time
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str( Path(__file__).resolve().parent.parent / 'src' ))
+
+import torch
+from PIL import Image
+from manga_ocr import MangaOcr
+import manga_ocr
+from manga_ocr_service.quantization import load_quantized_model
+
+# Accuracy and latency of the INT8 recognition model against the fp32 one.
+# The test set is a directory of line crops with a labels.tsv ("file name<TAB>text");
+# without labels, the fp32 output is taken as the reference.
+# By default, the fixed labelled set of line_test_set.tsv, rendered by make_line_test_set.py.
+# Run "gen_grpc_service" first, then: python benchmarks/quantization_benchmark.py [test_set_dir]
+
+MODEL = 'kha-white/manga-ocr-base'
+REPEATS = 3
+TEST_SET_PATH = Path(__file__).resolve().parent / 'line_test_set'
+
+
+def load_test_set( directory: str | None ) -> list[ tuple[ Image.Image, str | None ] ]:
+
+    if not directory and ( TEST_SET_PATH / 'labels.tsv' ).exists():
+        directory = TEST_SET_PATH
+
+    if not directory:
+        print(f'{TEST_SET_PATH.name} has not been rendered with make_line_test_set.py, using the manga_ocr example')
+        example_path = Path( manga_ocr.__file__ ).parent / 'assets/example.jpg'
+        return [ ( Image.open( example_path ), None ) ]
+
+    labels = {}
+    labels_path = Path(directory) / 'labels.tsv'
+    if labels_path.exists():
+        for row in labels_path.read_text( encoding='utf8' ).splitlines():
+            file_name, _, text = row.partition('\t')
+            labels[ file_name ] = text
+
+    paths = sorted( path for path in Path(directory).iterdir() if path.suffix.lower() in ( '.png', '.jpg', '.jpeg' ) )
+    return [ ( Image.open(path), labels.get( path.name ) ) for path in paths ]
+
+
+def edit_distance( a: str, b: str ) -> int:
+    previous = list( range( len(b) + 1 ) )
+    for i, char_a in enumerate( a, 1 ):
+        current = [ i ]
+        for j, char_b in enumerate( b, 1 ):
+            current.append( min( previous[j] + 1, current[j - 1] + 1, previous[j - 1] + ( char_a != char_b ) ) )
+        previous = current
+    return previous[-1]
+
+
+def model_size( model: torch.nn.Module ) -> int:
+    buffer = io.BytesIO()
+    torch.save( model.state_dict(), buffer )
+    return buffer.getbuffer().nbytes
+
+
+def run( ocr: MangaOcr, test_set ) -> tuple[ list[ str ], float ]:
+
+    texts = []
+    elapsed = 0
+
+    for image, _ in test_set:
+        texts.append( ocr( image ) )
+        start = time.perf_counter()
+        for _ in range( REPEATS ):
+            ocr( image )
+        elapsed += ( time.perf_counter() - start ) / REPEATS
+
+    return texts, elapsed / len(test_set)
+
+
+def report( label: str, texts: list[ str ], references: list[ str ], latency: float, size: int ):
+
+    errors = sum( edit_distance( text, reference ) for text, reference in zip( texts, references ) )
+    characters = sum( len(reference) for reference in references )
+    exact = sum( text == reference for text, reference in zip( texts, references ) )
+    cer = f'{errors / characters * 100:6.2f}%' if characters else '     -'
+
+    print(f'  {label:<6} CER {cer}  exact {exact}/{len(texts)}  {latency * 1000:8.2f} ms/line  {size / 2**20:7.1f} MiB')
+
+
+def main():
+    test_set = load_test_set( sys.argv[1] if len(sys.argv) > 1 else None )
+    labels = [ text for _, text in test_set ]
+
+    print(f'{len(test_set)} lines, torch threads: {torch.get_num_threads()}')
+
+    ocr = MangaOcr( MODEL, force_cpu= True )
+    fp32_texts, fp32_latency = run( ocr, test_set )
+    fp32_size = model_size( ocr.model )
+
+    with tempfile.TemporaryDirectory() as directory:
+        ocr.model = load_quantized_model( ocr.model, Path(directory) / 'manga_ocr_int8.pt' )
+
+    int8_texts, int8_latency = run( ocr, test_set )
+
+    # Unlabeled lines are scored against the fp32 output
+    if any( label is None for label in labels ):
+        print('  fp32 output is the reference for unlabeled lines')
+    references = [ label if label is not None else text for label, text in zip( labels, fp32_texts ) ]
+
+    report( 'fp32', fp32_texts, references, fp32_latency, fp32_size )
+    report( 'int8', int8_texts, references, int8_latency, model_size( ocr.model ) )
+
+
+if __name__ == '__main__':
+    main()
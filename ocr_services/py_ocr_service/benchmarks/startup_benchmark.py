@@ -0,0 +1,104 @@
+import os
+import sys
+import time
+import json
+import socket
+import subprocess
+from io import BytesIO
+from pathlib import Path
+
+SRC_PATH = Path(__file__).resolve().parent.parent / 'src'
+sys.path.insert(0, str( SRC_PATH ))
+
+import grpc
+import numpy as np
+from PIL import Image
+import ocr_service_pb2 as service_pb
+import ocr_service_pb2_grpc as service_grpc
+
+# Time from launching the service to the [INFO-JSON] line, and to the first MotionDetection response,
+# with engines loaded on first use and with MangaOCR preloaded before the server starts.
+# Run "gen_grpc_service" first, then: python benchmarks/startup_benchmark.py [runs]
+
+MODES = {
+    'lazy': { 'PRELOAD_ENGINES': '' },
+    'preload MangaOCR': { 'PRELOAD_ENGINES': 'MangaOCR' },
+    'preload MangaOCR + warm-up': { 'PRELOAD_ENGINES': 'MangaOCR', 'WARM_UP': 'true' },
+}
+TIMEOUT_SECONDS = 300
+
+
+def free_port() -> str:
+    with socket.socket() as sock:
+        sock.bind( ( '127.0.0.1', 0 ) )
+        return str( sock.getsockname()[1] )
+
+
+def make_frame() -> bytes:
+    buffer = BytesIO()
+    Image.fromarray( np.zeros( ( 720, 1280, 3 ), dtype=np.uint8 ) ).save( buffer, format='PNG' )
+    return buffer.getvalue()
+
+
+def measure( settings: dict, frame: bytes ) -> tuple[ float, float ]:
+
+    port = free_port()
+    start = time.perf_counter()
+
+    process = subprocess.Popen(
+        [ sys.executable, '-u', 'py_ocr_service.py', port ],
+        cwd= SRC_PATH,
+        env= { **os.environ, **settings },
+        stdout= subprocess.PIPE,
+        stderr= subprocess.DEVNULL,
+        text= True
+    )
+
+    try:
+        for line in process.stdout:
+            if line.startswith('[INFO-JSON]'):
+                break
+        else:
+            raise RuntimeError('The service exited before listening')
+
+        listening = time.perf_counter() - start
+        server_address = json.loads( line.partition(':')[2] )['server_address'].replace( '0.0.0.0', '127.0.0.1' )
+
+        with grpc.insecure_channel( server_address ) as channel:
+            stub = service_grpc.OCRServiceStub( channel )
+            stub.MotionDetection(
+                service_pb.MotionDetectionRequest(
+                    stream_id= 'startup_benchmark',
+                    frame= frame,
+                    threshold_min= 10,
+                    threshold_max= 100,
+                    stream_length= 4
+                ),
+                timeout= TIMEOUT_SECONDS,
+                wait_for_ready= True
+            )
+
+        first_response = time.perf_counter() - start
+
+    finally:
+        process.kill()
+        process.wait()
+
+    return listening, first_response
+
+
+def main():
+    runs = int( sys.argv[1] ) if len(sys.argv) > 1 else 3
+    frame = make_frame()
+
+    for mode, settings in MODES.items():
+        results = [ measure( settings, frame ) for _ in range( runs ) ]
+
+        listening = np.median( [ result[0] for result in results ] )
+        first_response = np.median( [ result[1] for result in results ] )
+
+        print(f'{mode:<18} [INFO-JSON] {listening * 1000:8.1f} ms   first MotionDetection {first_response * 1000:8.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
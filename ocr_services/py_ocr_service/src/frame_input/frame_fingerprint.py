@@ -0,0 +1,99 @@
+import hashlib
+import threading
+from collections import deque
+from typing import Deque, Dict, Tuple
+import cv2
+import numpy as np
+from PIL import Image
+from ocr_service_pb2 import RecognizeDefaultResponse
+from .frame_input import resize_to_grayscale
+
+
+class FrameFingerprint:
+
+    # A digest of every pixel when frames must match exactly,
+    # a small grayscale thumbnail when some difference is tolerated
+
+    def __init__( self, size: Tuple[int, int], digest: bytes = None, thumbnail: np.ndarray = None, generation: int = 0 ):
+        self.size = size # width, height
+        self.digest = digest
+        self.thumbnail = thumbnail
+        self.generation = generation # Of the cache when it was taken
+
+
+class FrameResponseCache:
+
+    # Latest frames of each engine with the responses they got.
+    # Cleared when a model is installed, as the same frame could get different results.
+
+    thumbnail_size = 160 # Long side
+
+    def __init__( self, max_frames: int = 4, tolerance: float = 0 ):
+        self.max_frames = max_frames
+        self.tolerance = tolerance # Mean absolute difference between thumbnails, 0-255
+        self.frames: Dict[ str, Deque[ Tuple[ FrameFingerprint, RecognizeDefaultResponse ] ] ] = {}
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def fingerprint( self, image: Image.Image | np.ndarray ) -> FrameFingerprint:
+
+        if isinstance( image, np.ndarray ):
+            size = ( image.shape[1], image.shape[0] )
+        else:
+            size = image.size
+
+        if self.tolerance <= 0:
+            digest = hashlib.blake2b( digest_size= 16 )
+            if isinstance( image, np.ndarray ):
+                digest.update( np.ascontiguousarray( image ).data )
+            else:
+                digest.update( image.tobytes() )
+            return FrameFingerprint( size, digest= digest.digest(), generation= self.generation )
+
+        return FrameFingerprint( size, thumbnail= self.thumbnail( image, size ), generation= self.generation )
+
+    def thumbnail( self, image: Image.Image | np.ndarray, size: Tuple[int, int] ) -> np.ndarray:
+
+        width, height = size
+        scale = self.thumbnail_size / max( width, height )
+        thumbnail_size = ( max( 1, round( width * scale ) ), max( 1, round( height * scale ) ) )
+
+        return resize_to_grayscale( image, thumbnail_size )
+
+    def matches( self, fingerprint_a: FrameFingerprint, fingerprint_b: FrameFingerprint ) -> bool:
+
+        if fingerprint_a.size != fingerprint_b.size:
+            return False
+
+        if fingerprint_a.digest is not None or fingerprint_b.digest is not None:
+            return fingerprint_a.digest == fingerprint_b.digest
+
+        difference = cv2.absdiff( fingerprint_a.thumbnail, fingerprint_b.thumbnail )
+        return float( difference.mean() ) <= self.tolerance
+
+    def get( self, engine: str, fingerprint: FrameFingerprint ) -> RecognizeDefaultResponse | None:
+
+        with self.lock:
+            for cached_fingerprint, response in reversed( self.frames.get( engine, () ) ):
+                if self.matches( cached_fingerprint, fingerprint ):
+                    return response
+
+        return None
+
+    def put( self, engine: str, fingerprint: FrameFingerprint, response: RecognizeDefaultResponse ):
+
+        if self.max_frames <= 0:
+            return
+
+        with self.lock:
+            # Recognized before the cache was cleared, maybe with the previous model
+            if fingerprint.generation != self.generation:
+                return
+
+            frames = self.frames.setdefault( engine, deque( maxlen= self.max_frames ) )
+            frames.append( ( fingerprint, response ) )
+
+    def clear( self ):
+        with self.lock:
+            self.frames.clear()
+            self.generation += 1
@@ -0,0 +1,209 @@
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+import cv2
+import numpy as np
+from PIL import Image
+from ocr_service_pb2 import RawImage
+
+PIXEL_FORMAT_CHANNELS = {
+    'BGRA': 4,
+    'RGBA': 4,
+    'BGR': 3,
+    'RGB': 3,
+    'GRAY': 1,
+}
+
+# Formats the OCR pipeline can't take as they are (it expects RGB or RGBA like PIL gives)
+RGB_CONVERSIONS = {
+    'BGRA': cv2.COLOR_BGRA2RGB,
+    'BGR': cv2.COLOR_BGR2RGB,
+    'GRAY': cv2.COLOR_GRAY2RGB,
+}
+
+GRAY_CONVERSIONS = {
+    'RGB': cv2.COLOR_RGB2GRAY,
+    'RGBA': cv2.COLOR_RGBA2GRAY,
+    'BGR': cv2.COLOR_BGR2GRAY,
+    'BGRA': cv2.COLOR_BGRA2GRAY,
+}
+
+
+# An uncompressed frame that doesn't match its buffer; answered with INVALID_ARGUMENT
+class InvalidFrameError(ValueError):
+    pass
+
+
+def to_grayscale( image: Image.Image | np.ndarray, pixel_format: str = '' ) -> np.ndarray:
+
+    # Arrays are RGB or RGBA, by their number of channels, unless pixel_format says otherwise
+    if isinstance( image, Image.Image ):
+        return np.asarray( image.convert('L') )
+
+    if image.ndim == 2: # Already grayscale
+        return image
+
+    if not pixel_format:
+        pixel_format = 'RGBA' if image.shape[2] == 4 else 'RGB'
+
+    return cv2.cvtColor( image, GRAY_CONVERSIONS.get( pixel_format, cv2.COLOR_RGB2GRAY ) )
+
+def resize_to_grayscale(
+    image: Image.Image | np.ndarray,
+    size: Tuple[int, int], # width, height
+    pixel_format: str = ''
+) -> np.ndarray:
+
+    # Arrays are resized first, so the color conversion only touches the smaller image
+    if isinstance( image, Image.Image ):
+        image = to_grayscale( image )
+
+    resized = cv2.resize( image, size, interpolation= cv2.INTER_AREA )
+
+    return to_grayscale( resized, pixel_format )
+
+def array_from_buffer(
+    buffer,
+    width: int,
+    height: int,
+    stride: int = 0,
+    pixel_format: str = 'BGRA',
+    offset: int = 0
+) -> np.ndarray:
+
+    # Wraps the pixels as a NumPy view, no copy
+    channels = PIXEL_FORMAT_CHANNELS.get( pixel_format )
+
+    if not channels:
+        raise InvalidFrameError(f'Unsupported pixel format: {pixel_format}')
+
+    if width <= 0 or height <= 0:
+        raise InvalidFrameError(f'Invalid frame size: {width}x{height}')
+
+    row_size = width * channels
+    stride = stride or row_size
+
+    if stride < row_size:
+        raise InvalidFrameError(f'Stride {stride} is smaller than a row of {row_size} bytes')
+
+    if offset + stride * ( height - 1 ) + row_size > len( memoryview(buffer) ):
+        raise InvalidFrameError('Frame buffer is smaller than the frame geometry')
+
+    if channels == 1:
+        shape = ( height, width )
+        strides = ( stride, 1 )
+    else:
+        shape = ( height, width, channels )
+        strides = ( stride, channels, 1 )
+
+    # Through frombuffer the view holds a buffer export, so shared memory can't be unmapped under it
+    return np.ndarray(
+        shape,
+        dtype= np.uint8,
+        buffer= np.frombuffer( buffer, dtype=np.uint8 ),
+        offset= offset,
+        strides= strides
+    )
+
+def raw_image_to_array( raw_image: RawImage ) -> np.ndarray:
+    return array_from_buffer(
+        raw_image.data,
+        width= raw_image.width,
+        height= raw_image.height,
+        stride= raw_image.stride,
+        pixel_format= raw_image.pixel_format or 'BGRA',
+    )
+
+
+class FramePool:
+
+    # Reusable frame buffers, so converting a frame doesn't allocate a new one every request.
+    # Buffers must be released once the request no longer needs them.
+    # The free buffers are capped in total bytes; the shapes used least recently are dropped first,
+    # so window resizes and other capture sizes don't keep their buffers for the life of the process.
+
+    def __init__( self, max_buffers_per_shape: int = 2, max_bytes: int = 128 * 1024 * 1024 ):
+        self.max_buffers_per_shape = max_buffers_per_shape
+        self.max_bytes = max_bytes
+        self.free_buffers: OrderedDict[ Tuple, List[ np.ndarray ] ] = OrderedDict() # Least recently used first
+        self.free_bytes = 0
+        self.pooled_buffers: Dict[ int, weakref.ref ] = {}
+        self.lock = threading.Lock()
+
+    def acquire( self, shape: Tuple, dtype= np.uint8 ) -> np.ndarray:
+
+        key = ( tuple(shape), np.dtype(dtype).str )
+
+        with self.lock:
+            free_buffers = self.free_buffers.get( key )
+            if free_buffers:
+                self.free_buffers.move_to_end( key )
+                buffer = free_buffers.pop()
+                self.free_bytes -= buffer.nbytes
+                return buffer
+
+        buffer = np.empty( shape, dtype=dtype )
+        buffer_id = id(buffer)
+
+        with self.lock:
+            # Forget buffers that are dropped without being released
+            self.pooled_buffers[ buffer_id ] = weakref.ref(
+                buffer,
+                lambda _: self.pooled_buffers.pop( buffer_id, None )
+            )
+
+        return buffer
+
+    def release( self, buffer: np.ndarray ):
+
+        key = ( buffer.shape, buffer.dtype.str )
+
+        with self.lock:
+
+            # Arrays that don't come from the pool are ignored
+            pooled_buffer = self.pooled_buffers.get( id(buffer) )
+            if pooled_buffer is None or pooled_buffer() is not buffer:
+                return
+
+            free_buffers = self.free_buffers.setdefault( key, [] )
+            self.free_buffers.move_to_end( key )
+
+            if len(free_buffers) < self.max_buffers_per_shape and not any( free is buffer for free in free_buffers ):
+                free_buffers.append( buffer )
+                self.free_bytes += buffer.nbytes
+
+            self.evict()
+
+    def evict( self ):
+
+        # Called with the lock held
+        while self.free_bytes > self.max_bytes and self.free_buffers:
+            oldest_key, oldest_buffers = next( iter( self.free_buffers.items() ) )
+
+            if not oldest_buffers:
+                del self.free_buffers[ oldest_key ]
+                continue
+
+            self.free_bytes -= oldest_buffers.pop().nbytes
+
+        # Shapes without free buffers aren't kept around either
+        for key in [ key for key, free_buffers in self.free_buffers.items() if not free_buffers ]:
+            del self.free_buffers[ key ]
+
+    def to_rgb( self, image: np.ndarray, pixel_format: str, copy: bool = False ) -> np.ndarray:
+
+        # Returns the same view when no conversion or copy is needed, a pooled buffer otherwise
+        conversion = RGB_CONVERSIONS.get( pixel_format )
+
+        if conversion is None:
+            if not copy:
+                return image
+
+            owned_image = self.acquire( image.shape )
+            np.copyto( owned_image, image )
+            return owned_image
+
+        rgb_image = self.acquire( ( image.shape[0], image.shape[1], 3 ) )
+
+        return cv2.cvtColor( image, conversion, dst= rgb_image )
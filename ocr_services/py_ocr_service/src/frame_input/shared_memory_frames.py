@@ -0,0 +1,209 @@
+import sys
+import secrets
+import threading
+from collections import OrderedDict
+from typing import Callable, List, TypeVar
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+from ocr_service_pb2 import SharedMemoryFrame
+from .frame_input import array_from_buffer, InvalidFrameError, PIXEL_FORMAT_CHANNELS
+
+T = TypeVar('T')
+
+
+def attach_segment( name: str ) -> shared_memory.SharedMemory:
+
+    # The segment belongs to the client; attaching must not make this process unlink it on exit
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory( name=name, track=False )
+
+    segment = shared_memory.SharedMemory( name=name )
+
+    if sys.platform != 'win32':
+        resource_tracker.unregister( segment._name, 'shared_memory' )
+
+    return segment
+
+
+class AttachedSegment:
+
+    __slots__ = ( 'segment', 'generation', 'readers', 'detached' )
+
+    def __init__( self, segment: shared_memory.SharedMemory, generation: int ):
+        self.segment = segment
+        self.generation = generation # What it was attached for
+        self.readers = 0
+        self.detached = False
+
+
+class SharedMemoryFrameReader:
+
+    # Keeps the client's segments attached, so reading a frame only creates a view into its slot.
+    # The view is only valid until the client writes to that slot again, and only handed to a callback:
+    # it's released right after, so that segments can be closed once no request is reading them.
+    # Only the most recently used segments stay attached.
+
+    def __init__( self, max_segments: int = 8 ):
+        self.max_segments = max_segments
+        # Least recently used first
+        self.segments: OrderedDict[ str, AttachedSegment ] = OrderedDict()
+        # Detached, but still referenced by a view that outlived its read, like one in the traceback of an error
+        self.closing: List[ shared_memory.SharedMemory ] = []
+        self.lock = threading.Lock()
+
+    def read( self, frame: SharedMemoryFrame, use: Callable[ [ np.ndarray ], T ] ) -> T:
+
+        # "use" must not keep the view; converting or copying it is what it's for
+        pixel_format = frame.pixel_format or 'BGRA'
+        channels = PIXEL_FORMAT_CHANNELS.get( pixel_format )
+
+        if not channels:
+            raise InvalidFrameError(f'Unsupported pixel format: {pixel_format}')
+
+        if frame.width <= 0 or frame.height <= 0:
+            raise InvalidFrameError(f'Invalid frame size: {frame.width}x{frame.height}')
+
+        row_size = frame.width * channels
+        stride = frame.stride or row_size
+        frame_size = stride * ( frame.height - 1 ) + row_size
+
+        if stride < row_size:
+            raise InvalidFrameError(f'Stride {stride} is smaller than a row of {row_size} bytes')
+
+        # Otherwise it would read into the next slot
+        if frame.slot_index < 0 or frame_size > frame.slot_size:
+            raise InvalidFrameError(f'Frame of {frame_size} bytes does not fit slot {frame.slot_index} of {frame.slot_size} bytes')
+
+        offset = frame.slot_index * frame.slot_size
+
+        attached = self.acquire( frame.segment_name, offset + frame.slot_size, frame.segment_generation )
+
+        try:
+            if offset + frame.slot_size > attached.segment.size:
+                raise InvalidFrameError(f'Slot {frame.slot_index} is past the end of a segment of {attached.segment.size} bytes')
+
+            slot = attached.segment.buf[ offset : offset + frame.slot_size ]
+
+            try:
+                return use( array_from_buffer(
+                    slot,
+                    width= frame.width,
+                    height= frame.height,
+                    stride= stride,
+                    pixel_format= pixel_format
+                ))
+            finally:
+                slot.release()
+
+        finally:
+            self.release( attached )
+
+    def acquire( self, name: str, min_size: int = 0, generation: int = 0 ) -> AttachedSegment:
+
+        with self.lock:
+
+            attached = self.segments.get( name )
+
+            # A client that restarts or grows its ring recreates the segment, so the old mapping is stale
+            if attached and ( attached.generation != generation or attached.segment.size < min_size ):
+                self.detach_segment( name )
+                attached = None
+
+            if not attached:
+                try:
+                    attached = AttachedSegment( attach_segment( name ), generation )
+                except ( OSError, ValueError ) as error:
+                    raise InvalidFrameError(f'Shared memory segment {name} is not available: {error}')
+
+                self.segments[ name ] = attached
+
+            self.segments.move_to_end( name )
+            attached.readers += 1
+
+            while len(self.segments) > self.max_segments:
+                self.detach_segment( next( iter( self.segments ) ) )
+
+            return attached
+
+    def release( self, attached: AttachedSegment ):
+        with self.lock:
+            attached.readers -= 1
+            if attached.detached and attached.readers == 0:
+                self.close_segments( attached.segment )
+
+    def close( self ):
+        with self.lock:
+            for name in list( self.segments ):
+                self.detach_segment( name )
+
+            self.close_segments()
+
+    def detach_segment( self, name: str ):
+
+        # Called with the lock held; segments being read are closed by their last reader
+        attached = self.segments.pop( name, None )
+
+        if not attached:
+            return
+
+        attached.detached = True
+
+        if attached.readers == 0:
+            self.close_segments( attached.segment )
+
+    def close_segments( self, *segments: shared_memory.SharedMemory ):
+
+        # Called with the lock held. The ones still referenced by a view are retried on the next call.
+        closing, self.closing = [ *self.closing, *segments ], []
+
+        for segment in closing:
+            try:
+                segment.close()
+            except BufferError:
+                self.closing.append( segment )
+
+
+class SharedMemoryFrameWriter:
+
+    # Client side of the handoff: a ring of equally sized frame slots in one segment
+
+    def __init__( self, name: str, slot_size: int, slot_count: int = 3 ):
+        self.slot_size = slot_size
+        self.slot_count = slot_count
+        self.next_slot = 0
+        # Tells the reader apart from an earlier segment with the same name
+        self.generation = secrets.randbits( 63 )
+        self.segment = shared_memory.SharedMemory(
+            name= name,
+            create= True,
+            size= slot_size * slot_count
+        )
+
+    def write( self, frame: np.ndarray, pixel_format: str = 'BGRA' ) -> SharedMemoryFrame:
+
+        frame = np.ascontiguousarray( frame )
+
+        if frame.nbytes > self.slot_size:
+            raise ValueError(f'Frame of {frame.nbytes} bytes does not fit a slot of {self.slot_size} bytes')
+
+        slot_index = self.next_slot
+        self.next_slot = ( self.next_slot + 1 ) % self.slot_count
+
+        offset = slot_index * self.slot_size
+        slot = np.ndarray( frame.shape, dtype=np.uint8, buffer=self.segment.buf, offset=offset )
+        np.copyto( slot, frame )
+
+        return SharedMemoryFrame(
+            segment_name= self.segment.name,
+            slot_index= slot_index,
+            slot_size= self.slot_size,
+            width= frame.shape[1],
+            height= frame.shape[0],
+            stride= frame.strides[0],
+            pixel_format= pixel_format,
+            segment_generation= self.generation
+        )
+
+    def close( self ):
+        self.segment.close()
+        self.segment.unlink()
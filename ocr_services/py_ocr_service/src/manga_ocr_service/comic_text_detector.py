@@ -1,8 +1,11 @@
+import copy
 import numpy as np
 import cv2
-from typing import List
+import torch
+from typing import Dict, List, Tuple
 
-from comic_text_detector.inference import TextDetector
+from comic_text_detector.inference import TextDetector, preprocess_img, postprocess_yolo, postprocess_mask
+from comic_text_detector.utils.textblock import group_output
 
 class TextLine:
     coordinates = []
@@ -27,21 +30,132 @@ class TextBlock:
 
 class ComicTextDetector:
 
-    text_detector: TextDetector = None
+    text_detector: TextDetector = None # Default input size
+    text_detectors: Dict[ int, TextDetector ] # By input size, all sharing the same network
+    input_sizes: List[ int ]
+
+    # Images with more edge pixels than this get the next larger input size
+    dense_text_threshold = 0.12
+
+    # Images with a longer side than tiling_threshold are detected in overlapping tiles; 0 disables tiling
+    tiling_threshold = 0
+    tile_size = 1024 # The largest input size, so tiles are detected at full resolution
+    tile_overlap = 192
+    tile_batch_size = 4
+    tile_merge_threshold = 0.3 # Share of the smaller box covered by the other one
 
     def __init__(
         self,
-        model_path = '../models/comic_text_detector/comictextdetector.pt'
+        model_path = '../models/comic_text_detector/comictextdetector.pt',
+        backend = 'Torch', # Torch | ONNX
+        device = 'cpu',
+        input_sizes: List[ int ] = [ 1024 ],
+        dense_text_threshold: float = None,
+        tiling_threshold: int = 0,
+        tile_size: int = 0, # 0 uses the largest input size
+        tile_overlap: int = 192,
+        tile_batch_size: int = 4
     ):
-        self.text_detector = TextDetector(model_path, input_size=1024, device='cpu', act='leaky')
+        # Letterboxed to a multiple of 64
+        self.input_sizes = sorted({ max( 64, size // 64 * 64 ) for size in input_sizes }) or [ 1024 ]
 
+        if dense_text_threshold is not None:
+            self.dense_text_threshold = dense_text_threshold
 
-    def detect(self, image: np.ndarray) -> List[TextBlock]:
+        self.tiling_threshold = tiling_threshold
+        self.tile_size = max( 256, tile_size or self.input_sizes[-1] )
 
-        result: List[TextBlock] = []
+        if tiling_threshold and self.tile_size > self.input_sizes[-1]:
+            print(f'Text detection tiles of {self.tile_size} are downscaled to the largest input size, {self.input_sizes[-1]}')
+        self.tile_overlap = min( max( 0, tile_overlap ), self.tile_size // 2 )
+        self.tile_batch_size = max( 1, tile_batch_size )
+
+        if backend == 'ONNX':
+            device = 'cpu' # ONNX Runtime CPU sessions
+
+        base_detector = TextDetector(model_path, input_size=self.input_sizes[-1], device=device, act='leaky')
+
+        self.text_detectors = {}
+
+        for size in self.input_sizes:
+            text_detector = copy.copy( base_detector )
+            text_detector.input_size = ( size, size )
+
+            if backend == 'ONNX':
+                # The exported graphs have a fixed input size, so every size gets its own session
+                from .onnx_backend import use_onnx_text_detector
+                use_onnx_text_detector( text_detector )
+
+            self.text_detectors[ size ] = text_detector
+
+        default_size = 1024 if 1024 in self.text_detectors else self.input_sizes[-1]
+        self.text_detector = self.text_detectors[ default_size ]
+
+    def select_input_size( self, image: np.ndarray, text_density: float = None ) -> int:
+
+        # Smallest size the image fits in without being downscaled, so small captures aren't upscaled into a large letterbox
+        longest_side = max( image.shape[:2] )
+
+        size_idx = next(
+            ( idx for idx, size in enumerate( self.input_sizes ) if size >= longest_side ),
+            len( self.input_sizes ) - 1
+        )
+
+        if size_idx == len( self.input_sizes ) - 1:
+            return self.input_sizes[ size_idx ]
+
+        # Dense or small text needs more pixels per character
+        if text_density is None:
+            text_density = self.estimate_text_density( image )
+
+        if text_density > self.dense_text_threshold:
+            size_idx += 1
+
+        return self.input_sizes[ size_idx ]
+
+    def estimate_text_density( self, image: np.ndarray ) -> float:
 
-        mask, mask_refined, blk_list = self.text_detector(image, refine_mode=1, keep_undetected_mask=True)
+        # Share of edge pixels in a small thumbnail
+        scale = 256 / max( image.shape[:2] )
+        thumbnail = cv2.resize( image, None, fx= min( scale, 1 ), fy= min( scale, 1 ), interpolation= cv2.INTER_AREA )
 
+        if thumbnail.ndim == 3:
+            thumbnail = cv2.cvtColor( thumbnail, cv2.COLOR_RGB2GRAY )
+
+        edges = cv2.Canny( thumbnail, 100, 200 )
+
+        return float( np.count_nonzero( edges ) ) / edges.size
+
+    def warm_up( self ):
+        # The first run of each input shape is much slower than the following ones
+        for size in self.input_sizes:
+            self.detect( np.zeros( ( size, size, 3 ), dtype=np.uint8 ), input_size= size )
+
+        if self.tiling_threshold:
+            tile = np.zeros( ( self.tile_size, self.tile_size, 3 ), dtype=np.uint8 )
+            self.detect_tiles( [ tile ] * self.tile_batch_size, self.text_detectors[ self.tile_input_size() ] )
+
+    def detect(self, image: np.ndarray, input_size: int = None, text_density: float = None) -> List[TextBlock]:
+
+        if self.tiling_threshold and input_size is None and max( image.shape[:2] ) > self.tiling_threshold:
+            return self.detect_tiled( image )
+
+        if input_size not in self.text_detectors:
+            input_size = self.select_input_size( image, text_density )
+
+        text_detector = self.text_detectors[ input_size ]
+
+        mask, mask_refined, blk_list = text_detector(image, refine_mode=1, keep_undetected_mask=True)
+
+        result = self.to_text_blocks( blk_list )
+
+        # self.display_result( image, result )
+
+        return result
+
+    def to_text_blocks( self, blk_list ) -> List[TextBlock]:
+
+        result: List[TextBlock] = []
 
         for blk_idx, blk in enumerate(blk_list):
 
@@ -63,10 +177,227 @@ class ComicTextDetector:
 
             result.append(text_block)
 
-        # self.display_result( image, result )
-
         return result
 
+    # Tiled detection: small text keeps its size on 4K and multi-monitor captures,
+    # without a single huge input tensor
+
+    def detect_tiled( self, image: np.ndarray ) -> List[TextBlock]:
+
+        height, width = image.shape[:2]
+        text_detector = self.text_detectors[ self.tile_input_size() ]
+        tiles = self.tile_layout( width, height )
+
+        tile_blocks: List[ Tuple[ TextBlock, bool, int ] ] = []
+
+        for batch_start in range( 0, len(tiles), self.tile_batch_size ):
+            batch = tiles[ batch_start : batch_start + self.tile_batch_size ]
+
+            batch_results = self.detect_tiles(
+                [ image[ y : y + tile_height, x : x + tile_width ] for x, y, tile_width, tile_height in batch ],
+                text_detector
+            )
+
+            for tile_idx, ( tile, blocks ) in enumerate( zip( batch, batch_results ), batch_start ):
+                for block in blocks:
+                    # Cut by a tile edge inside the image; the neighbouring tile may see all of it
+                    truncated = self.touches_inner_edge( block, tile, width, height )
+                    self.offset_block( block, tile[0], tile[1] )
+                    tile_blocks.append( ( block, truncated, tile_idx ) )
+
+        return self.merge_tile_blocks( tile_blocks )
+
+    @torch.no_grad()
+    def detect_tiles( self, tiles: List[ np.ndarray ], text_detector: TextDetector ) -> List[ List[TextBlock] ]:
+
+        # TextDetector.__call__ for a batch: a single network run, then the post-processing of each tile.
+        # The refined mask isn't used, so it isn't computed.
+        input_size = text_detector.input_size
+        images_in = []
+        paddings = []
+
+        for tile in tiles:
+            img_in, _, dw, dh = preprocess_img( tile, input_size= input_size, device= text_detector.device, half= text_detector.half )
+            images_in.append( img_in )
+            paddings.append( ( dw, dh ) )
+
+        blks, masks, lines_maps = text_detector.net( torch.cat( images_in ) )
+        lines_batch, scores_batch = text_detector.seg_rep( input_size, lines_maps )
+
+        results = []
+
+        for idx, tile in enumerate( tiles ):
+            im_h, im_w = tile.shape[:2]
+            dw, dh = paddings[ idx ]
+            resize_ratio = ( im_w / ( input_size[0] - dw ), im_h / ( input_size[1] - dh ) )
+
+            tile_blks = postprocess_yolo( blks[ idx : idx + 1 ], text_detector.conf_thresh, text_detector.nms_thresh, resize_ratio )
+
+            mask = postprocess_mask( masks[ idx : idx + 1 ] )
+            mask = mask[ : mask.shape[0] - dh, : mask.shape[1] - dw ]
+            mask = cv2.resize( mask, ( im_w, im_h ), interpolation= cv2.INTER_LINEAR )
+
+            scores = scores_batch[ idx ]
+            lines = lines_batch[ idx ][ np.where( scores > 0.6 ) ]
+
+            if lines.size == 0:
+                lines = []
+            else:
+                lines = lines.astype( np.float64 )
+                lines[..., 0] *= resize_ratio[0]
+                lines[..., 1] *= resize_ratio[1]
+                lines = lines.astype( np.int32 )
+
+            results.append( self.to_text_blocks( group_output( tile_blks, lines, im_w, im_h, mask ) ) )
+
+        return results
+
+    def tile_input_size( self ) -> int:
+        # Smallest input size that keeps tiles at full resolution, otherwise the largest one
+        return next( ( size for size in self.input_sizes if size >= self.tile_size ), self.input_sizes[-1] )
+
+    def tile_layout( self, width: int, height: int ) -> List[ Tuple[ int, int, int, int ] ]: # x, y, width, height
+
+        def tile_starts( length: int ) -> List[ int ]:
+            if length <= self.tile_size:
+                return [ 0 ]
+            starts = list( range( 0, length - self.tile_size, self.tile_size - self.tile_overlap ) )
+            return starts + [ length - self.tile_size ]
+
+        tile_width = min( self.tile_size, width )
+        tile_height = min( self.tile_size, height )
+
+        return [
+            ( x, y, tile_width, tile_height )
+            for y in tile_starts( height )
+            for x in tile_starts( width )
+        ]
+
+    def touches_inner_edge( self, block: TextBlock, tile: Tuple[ int, int, int, int ], width: int, height: int, margin: int = 4 ) -> bool:
+
+        x, y, tile_width, tile_height = tile
+        x1, y1, x2, y2 = self.points_rect( block.coordinates )
+
+        return (
+            ( x > 0 and x1 <= margin ) or
+            ( y > 0 and y1 <= margin ) or
+            ( x + tile_width < width and x2 >= tile_width - margin ) or
+            ( y + tile_height < height and y2 >= tile_height - margin )
+        )
+
+    def offset_block( self, block: TextBlock, dx: int, dy: int ):
+        block.coordinates = [ [ point[0] + dx, point[1] + dy ] for point in block.coordinates ]
+        for line in block.lines:
+            line.coordinates = [ [ point[0] + dx, point[1] + dy ] for point in line.coordinates ]
+
+    def merge_tile_blocks( self, tile_blocks: List[ Tuple[ TextBlock, bool, int ] ] ) -> List[TextBlock]:
+
+        # NMS over the tiles: complete blocks first, then larger ones. A block from another tile that overlaps
+        # a kept one (the same block, seen whole or cut by a tile edge) is merged into it.
+        tile_blocks = sorted(
+            tile_blocks,
+            key= lambda item: ( item[1], -self.rect_area( self.points_rect( item[0].coordinates ) ) )
+        )
+
+        merged: List[TextBlock] = []
+        merged_tiles: List[ set ] = [] # Tiles each kept block was seen in
+
+        for block, _, tile_idx in tile_blocks:
+
+            rect = self.points_rect( block.coordinates )
+            kept_idx = next(
+                (
+                    idx for idx, kept in enumerate( merged )
+                    if tile_idx not in merged_tiles[ idx ] and
+                        self.overlap_ratio( rect, self.points_rect( kept.coordinates ) ) > self.tile_merge_threshold
+                ),
+                None
+            )
+
+            if kept_idx is None:
+                merged.append( block )
+                merged_tiles.append({ tile_idx })
+                continue
+
+            kept_block = merged[ kept_idx ]
+            merged_tiles[ kept_idx ].add( tile_idx )
+
+            kept_rect = self.points_rect( kept_block.coordinates )
+            union_rect = self.union_rect( rect, kept_rect )
+
+            if union_rect != kept_rect:
+                kept_block.coordinates = self.rect_points( union_rect )
+
+            kept_block.lines = self.merge_lines( kept_block.lines + block.lines, kept_block.is_vertical )
+
+        # Top to bottom; vertical (manga) text right to left
+        vertical = sum( block.is_vertical for block in merged ) > len(merged) / 2
+        merged.sort(
+            key= lambda block: (
+                self.points_rect( block.coordinates )[1],
+                -self.points_rect( block.coordinates )[2] if vertical else self.points_rect( block.coordinates )[0]
+            )
+        )
+
+        return merged
+
+    def merge_lines( self, lines: List[TextLine], is_vertical: bool ) -> List[TextLine]:
+
+        # The same line seen by two tiles is kept once, joined if each tile only saw part of it
+        merged: List[TextLine] = []
+
+        for line in sorted( lines, key= lambda line: -self.rect_area( self.points_rect( line.coordinates ) ) ):
+
+            rect = self.points_rect( line.coordinates )
+            kept_line = next(
+                (
+                    kept for kept in merged
+                    if self.overlap_ratio( rect, self.points_rect( kept.coordinates ) ) > self.tile_merge_threshold
+                ),
+                None
+            )
+
+            if kept_line is None:
+                merged.append( line )
+                continue
+
+            kept_rect = self.points_rect( kept_line.coordinates )
+            union_rect = self.union_rect( rect, kept_rect )
+
+            if union_rect != kept_rect:
+                kept_line.coordinates = self.rect_points( union_rect )
+
+        # Reading order: vertical lines right to left, horizontal ones top to bottom
+        if is_vertical:
+            merged.sort( key= lambda line: -self.points_rect( line.coordinates )[2] )
+        else:
+            merged.sort( key= lambda line: self.points_rect( line.coordinates )[1] )
+
+        return merged
+
+    def points_rect( self, points ) -> Tuple[ int, int, int, int ]: # x1, y1, x2, y2
+        xs = [ int( point[0] ) for point in points ]
+        ys = [ int( point[1] ) for point in points ]
+        return min(xs), min(ys), max(xs), max(ys)
+
+    def rect_points( self, rect: Tuple[ int, int, int, int ] ) -> List[ List[ int ] ]: # top left, top right, bottom right, bottom left
+        x1, y1, x2, y2 = rect
+        return [ [ x1, y1 ], [ x2, y1 ], [ x2, y2 ], [ x1, y2 ] ]
+
+    def rect_area( self, rect: Tuple[ int, int, int, int ] ) -> int:
+        return max( 0, rect[2] - rect[0] ) * max( 0, rect[3] - rect[1] )
+
+    def union_rect( self, rect_a: Tuple[ int, int, int, int ], rect_b: Tuple[ int, int, int, int ] ) -> Tuple[ int, int, int, int ]:
+        return min( rect_a[0], rect_b[0] ), min( rect_a[1], rect_b[1] ), max( rect_a[2], rect_b[2] ), max( rect_a[3], rect_b[3] )
+
+    def overlap_ratio( self, rect_a: Tuple[ int, int, int, int ], rect_b: Tuple[ int, int, int, int ] ) -> float:
+        intersection = self.rect_area((
+            max( rect_a[0], rect_b[0] ), max( rect_a[1], rect_b[1] ),
+            min( rect_a[2], rect_b[2] ), min( rect_a[3], rect_b[3] )
+        ))
+        smaller_area = min( self.rect_area( rect_a ), self.rect_area( rect_b ) )
+        return intersection / smaller_area if smaller_area else 0
+
     def rect_to_box_points(self, rect, angle):
         x, y, w, h = rect
 
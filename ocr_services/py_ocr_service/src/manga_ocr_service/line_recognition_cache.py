@@ -0,0 +1,110 @@
+import sys
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict
+import cv2
+import numpy as np
+from PIL import Image
+from frame_input.frame_input import to_grayscale
+
+CACHE_MODES = ( 'exact', 'perceptual' )
+
+
+class LineRecognitionCache:
+
+    # LRU of recognized line crops, keyed by a hash of the grayscale crop.
+    # "exact" matches identical pixels, "perceptual" matches crops with the same
+    # difference hash, which tolerates scaling and compression noise.
+
+    hash_size = ( 32, 8 ) # Columns, rows; along the line and across it
+
+    def __init__( self, max_entries: int = 2048, max_bytes: int = 8 * 1024 * 1024, mode: str = 'exact' ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.mode = mode if mode in CACHE_MODES else 'exact'
+        self.entries: OrderedDict[ bytes, str ] = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def key( self, line_image: Image.Image | np.ndarray ) -> bytes:
+
+        gray = to_grayscale( line_image )
+
+        if self.mode == 'perceptual':
+            return self.perceptual_key( gray )
+
+        digest = hashlib.blake2b( digest_size= 16 )
+        digest.update( np.array( gray.shape, dtype=np.int32 ).tobytes() )
+        digest.update( np.ascontiguousarray( gray ).data )
+        return digest.digest()
+
+    def perceptual_key( self, gray: np.ndarray ) -> bytes:
+
+        height, width = gray.shape
+        is_vertical = height > width
+
+        # Vertical lines are hashed along their length as well
+        if is_vertical:
+            gray = gray.T
+            height, width = width, height
+
+        columns, rows = self.hash_size
+        resized = cv2.resize( gray, ( columns + 1, rows ), interpolation= cv2.INTER_AREA )
+        gradient = resized[ :, 1: ] > resized[ :, :-1 ]
+
+        # Lines with the same gradients but a different number of characters differ in length
+        aspect_bucket = int( round( width / max( 1, height ) ) )
+
+        return bytes([ is_vertical, min( aspect_bucket, 255 ) ]) + np.packbits( gradient ).tobytes()
+
+    def get( self, key: bytes ) -> str | None:
+
+        with self.lock:
+            content = self.entries.get( key )
+
+            if content is None:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end( key )
+            self.hits += 1
+            return content
+
+    def put( self, key: bytes, content: str ):
+
+        entry_bytes = self.entry_size( key, content )
+
+        if entry_bytes > self.max_bytes:
+            return
+
+        with self.lock:
+            previous = self.entries.pop( key, None )
+            if previous is not None:
+                self.bytes -= self.entry_size( key, previous )
+
+            self.entries[ key ] = content
+            self.bytes += entry_bytes
+
+            while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+                oldest_key, oldest_content = self.entries.popitem( last=False )
+                self.bytes -= self.entry_size( oldest_key, oldest_content )
+
+    def clear( self ):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats( self ) -> Dict[ str, int ]:
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'bytes': self.bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+    def entry_size( self, key: bytes, content: str ) -> int:
+        return sys.getsizeof( key ) + sys.getsizeof( content )
@@ -3,24 +3,39 @@ import torch
 from manga_ocr import MangaOcr
 import cv2
 import numpy as np
-from typing import List, Dict
+from typing import Callable, ContextManager, List, Dict, Iterator
+from contextlib import nullcontext
 from ocr_service_pb2 import Result, Box, Vertex, TextLine, TextRecognitionModel, HardwareAccelerationOption, RecognizeDefaultResponse
+from ocr_service_pb2 import DetectResponse, DetectionResult, RawImage
 from PIL import Image
 from .comic_text_detector import ComicTextDetector
-from huggingface_hub import snapshot_download, scan_cache_dir
+from .line_recognition_cache import LineRecognitionCache
+from .scroll_estimator import ScrollEstimator
+from .partial_recognition_store import PartialRecognition, PartialRecognitionStore, LineKey
+from .speculative_recognizer import SpeculativeRecognizer, SPECULATIVE_ORDERS
+from .recognition_workers import RecognitionWorkerPool, recognize_batch, load_manga_ocr, to_line_grayscale
+from .onnx_backend import is_onnx_runtime_available, ONNX_INSTALL_COMMAND
+from .quantization import QUANTIZED_VARIANT, MODEL_VARIANTS, quantized_model_path
+from .model_catalog import ModelCatalog
+from huggingface_hub import snapshot_download
 import os
 from pathlib import Path
 import platform
+import sys
+import multiprocessing
+import threading
+from service_settings import get_int_setting, get_float_setting, get_str_setting, get_bool_setting
+from request_scheduler import SchedulerError
 
 torch.set_num_threads( os.cpu_count() )
 
-class PartialRecognition:
-    image: np.ndarray
-    partial_response: RecognizeDefaultResponse
+class RecentRecognition:
+    response: RecognizeDefaultResponse
+    thumbnail: np.ndarray | None # Grayscale, for scroll estimation
 
-    def __init__( self, image: np.ndarray, partial_response: RecognizeDefaultResponse ):
-        self.image = image
-        self.partial_response = partial_response
+    def __init__( self, response: RecognizeDefaultResponse, thumbnail: np.ndarray | None = None ):
+        self.response = response
+        self.thumbnail = thumbnail
 
 class MangaOcrService:
 
@@ -29,26 +44,174 @@ class MangaOcrService:
     recognition_model_id: str = 'kha-white/manga-ocr-base'
     embedded_model_path = '../models/manga_ocr/'
     custom_model_path = None
-
-    partial_recognitions: Dict[ str, PartialRecognition ] = {}
+    model_path: str = None # custom_model_path, or embedded_model_path without MODELS_PATH
+    model_catalog: ModelCatalog = None
+    recognition_batch_size: int = get_int_setting( 'MANGA_OCR_BATCH_SIZE', 8 )
+    backend: str = get_str_setting( 'MANGA_OCR_BACKEND', 'Torch' ) # Torch | ONNX (CPU)
+    model_variant: str = '' # '' (fp32) | 'int8-experimental'; chosen with InstallModel
+    line_cache: LineRecognitionCache | None = None
+
+    # Detector input sizes to choose from per image; multiples of 64
+    detector_input_sizes: List[ int ] = [
+        int( size ) for size in get_str_setting( 'COMIC_TEXT_DETECTOR_INPUT_SIZES', '512,768,1024' ).split(',') if size.strip().isdigit()
+    ]
+    detector_device: str = get_str_setting( 'COMIC_TEXT_DETECTOR_DEVICE', 'auto' ) # auto | cpu | cuda | mps
+
+    partial_recognitions = PartialRecognitionStore(
+        max_bytes= get_int_setting( 'MANGA_OCR_PARTIAL_MAX_BYTES', 64 * 1024 * 1024 ),
+        max_age_seconds= get_float_setting( 'MANGA_OCR_PARTIAL_MAX_AGE', 300 )
+    )
+    recent_recognitions: Dict[ str, RecentRecognition ] = {} # Fully recognized, reusable as references
+    region_padding = 8
+    scroll_estimator = ScrollEstimator()
+
+    # Recognizes detection_only results in the background, before RecognizeSelective asks for them
+    speculative_recognition: bool = get_bool_setting( 'MANGA_OCR_SPECULATIVE_RECOGNITION', False )
+    speculative_order: str = get_str_setting( 'MANGA_OCR_SPECULATIVE_ORDER', 'reading_order' )
+    speculative_recognizer: SpeculativeRecognizer = None
+    engine_slot: Callable[ [], ContextManager[ None ] ] = nullcontext # Set by the Service to its scheduler
+
+    # Linux only; 0 recognizes in the service process
+    recognition_workers: int = get_int_setting( 'MANGA_OCR_WORKERS', 0 )
+    worker_pool: RecognitionWorkerPool = None
+
+    state: str = 'NOT_LOADED' # NOT_LOADED | LOADING | WARMING_UP | READY | FAILED
+    load_error: str = ''
 
     def __init__(self) -> None:
-        self.is_model_downloaded()
+        self.model_catalog = ModelCatalog(
+            self.recognition_model_id,
+            self.get_custom_model_path(),
+            self.embedded_model_path
+        )
+        self.model_variant = self.read_model_variant()
+        self.init_lock = threading.Lock()
+        self.ready = threading.Event()
+
+        line_cache_entries = get_int_setting( 'MANGA_OCR_LINE_CACHE_ENTRIES', 2048 )
+
+        if line_cache_entries > 0:
+            self.line_cache = LineRecognitionCache(
+                max_entries= line_cache_entries,
+                max_bytes= get_int_setting( 'MANGA_OCR_LINE_CACHE_BYTES', 8 * 1024 * 1024 ),
+                mode= get_str_setting( 'MANGA_OCR_LINE_CACHE_MODE', 'exact' )
+            )
+
+        if self.speculative_order not in SPECULATIVE_ORDERS:
+            print(f'Invalid value for MANGA_OCR_SPECULATIVE_ORDER: {self.speculative_order}')
+            self.speculative_order = 'reading_order'
+
+        self.speculative_recognizer = SpeculativeRecognizer( self.recognize_speculatively )
+
+        if self.backend == 'ONNX' and not is_onnx_runtime_available():
+            print(f'ONNX Runtime is not installed ({ONNX_INSTALL_COMMAND}), using Torch')
+            self.backend = 'Torch'
+
+        if (
+            self.recognition_workers > 0 and
+            sys.platform.startswith('linux') and
+            multiprocessing.current_process().name == 'MainProcess'
+        ):
+            self.worker_pool = RecognitionWorkerPool(
+                self.recognition_workers,
+                *self.recognizer_args()
+            )
 
     def init( self ):
 
-        custom_model_exists = self.custom_model_exists()
+        if not self.custom_model_exists():
+            self.download_model()
+
+        # With worker processes, the model is only needed in them
+        if not self.worker_pool:
+            self.manga_ocr = load_manga_ocr( *self.recognizer_args() )
+
+        self.comic_text_detector = ComicTextDetector(
+            backend= self.backend,
+            device= self.select_detector_device(),
+            input_sizes= self.detector_input_sizes,
+            dense_text_threshold= get_float_setting( 'COMIC_TEXT_DETECTOR_DENSE_TEXT', 0.12 ),
+            # 4K and multi-monitor captures are detected in overlapping tiles, by default of the largest input size
+            tiling_threshold= get_int_setting( 'COMIC_TEXT_DETECTOR_TILING_THRESHOLD', 2560 ),
+            tile_size= get_int_setting( 'COMIC_TEXT_DETECTOR_TILE_SIZE', 0 ),
+            tile_overlap= get_int_setting( 'COMIC_TEXT_DETECTOR_TILE_OVERLAP', 192 ),
+            tile_batch_size= get_int_setting( 'COMIC_TEXT_DETECTOR_TILE_BATCH_SIZE', 4 )
+        )
 
-        if not custom_model_exists:
-            custom_model_exists = self.download_model()
+    def recognizer_args( self ) -> tuple:
+        # Arguments of load_manga_ocr
+        return (
+            self.get_recognition_model(),
+            self.backend,
+            self.model_variant,
+            quantized_model_path( self.get_custom_model_path() )
+        )
 
-        if custom_model_exists and self.custom_model_path:
-            self.manga_ocr = MangaOcr( self.custom_model_path )
-        
+    def ensure_initialized( self, warm_up: bool = False ):
+
+        # Requests arriving while the models load (or warm up) wait for them instead of loading them again
+        if self.ready.is_set():
+            return
+
+        with self.init_lock:
+
+            if self.ready.is_set():
+                return
+
+            try:
+                self.state = 'LOADING'
+                self.init()
+
+                if warm_up:
+                    self.state = 'WARMING_UP'
+                    self.warm_up()
+
+            except Exception as error:
+                self.state = 'FAILED'
+                self.load_error = str(error)
+                raise
+
+            self.state = 'READY'
+            self.load_error = ''
+            self.ready.set()
+
+    def warm_up( self ):
+
+        # The first torch execution of each shape is much slower than the following ones
+        self.comic_text_detector.warm_up()
+
+        line_image = np.full( ( 160, 32 ), 255, dtype=np.uint8 )
+
+        if self.worker_pool:
+            self.worker_pool.recognize( [ [ line_image ] ] * self.worker_pool.workers )
         else:
-            self.manga_ocr = MangaOcr( self.recognition_model_id )
+            # Bypasses the line cache
+            self.recognize_batch( [ line_image ] )
+            self.recognize_batch( [ line_image, line_image ] )
+
+    def select_detector_device( self ) -> str:
+
+        if self.detector_device != 'auto':
+            return self.detector_device
+
+        # The first installed Torch accelerator that is usable on this machine
+        for option in self.get_hardware_acceleration_options():
+
+            if option.backend != 'Torch' or not option.installed:
+                continue
+
+            if option.compute_platform in ( 'CUDA', 'ROCm' ) and torch.cuda.is_available():
+                return 'cuda' # ROCm builds use the cuda device too
 
-        self.comic_text_detector = ComicTextDetector()
+            if option.compute_platform == 'MPS' and torch.backends.mps.is_available():
+                return 'mps'
+
+        return 'cpu'
+
+    def get_recognition_model( self ) -> str:
+        if self.custom_model_exists() and self.custom_model_path:
+            return self.custom_model_path
+        return self.recognition_model_id
 
     def download_model( self ) -> bool:
         if self.custom_model_exists():
@@ -65,67 +228,62 @@ class MangaOcrService:
             print(error)
             return False
 
+        finally:
+            self.model_catalog.invalidate()
+
     def is_model_downloaded( self ):
 
         try:
             # Verify if model is available
-            custom_model_exists = self.custom_model_exists()
-            embedded_model_exists = self.embedded_model_exists()
-            cached_model_exists = self.cached_model_exists()
-
-            # print(f'embedded_model_exists: {embedded_model_exists}')
-            # print(f'cached_model_exists: {cached_model_exists}')
-
-            return custom_model_exists or embedded_model_exists or cached_model_exists
+            return self.model_catalog.is_model_downloaded()
         
         except Exception as error:
             print(error)
             
         return False
-
-        
     
     def embedded_model_exists(self):
-        return os.path.exists( self.embedded_model_path+'pytorch_model.bin' )
+        return self.model_catalog.embedded_model_exists()
 
     def cached_model_exists( self ):
-        cache_info = scan_cache_dir()
-        cached_models = [repo.repo_id for repo in cache_info.repos]
-
-        return self.recognition_model_id in cached_models
+        return self.model_catalog.cached_model_exists()
     
     def custom_model_exists(self):
-        bin_path = str( Path(self.get_custom_model_path()) / 'pytorch_model.bin' )
-        return os.path.exists( bin_path )
+        return self.model_catalog.custom_model_exists()
     
     def get_custom_model_path(self) -> str:
+
+        # MODELS_PATH doesn't change while the service runs
+        if self.model_path:
+            return self.model_path
+
         try:
             MODELS_PATH = os.environ['MODELS_PATH']
             self.custom_model_path = str( Path(MODELS_PATH) / 'manga_ocr' )
-            return self.custom_model_path
+            self.model_path = self.custom_model_path
 
         except KeyError:
             print("Env variable MODELS_PATH is not set.")
-            
-        return self.embedded_model_path
+            self.model_path = self.embedded_model_path
+
+        return self.model_path
 
     # OCR pipeline ( detect -> crop -> recognize )
     def recognize(
         self,
-        image: Image.Image,
+        image: Image.Image | np.ndarray,
         request_id: str,
         boxes: List[ Box ] = [],
         detection_only: bool = False # skip recognition and hold data
     ) -> RecognizeDefaultResponse:
         
-        if not self.manga_ocr:
-            self.init()
+        self.ensure_initialized()
     
         if detection_only:
             pass # self.remove_old_recognitions()
 
 
-        arr_image = np.array( image )
+        arr_image = self.image_to_array( image )
 
         text_blocks: List[ Result ] = []
 
@@ -133,142 +291,729 @@ class MangaOcrService:
             text_blocks = self.detect( arr_image )
 
             if not detection_only:
-                for block_idx, block in enumerate(text_blocks):
-                    # print(f'\nProcessing text block {block_idx+1} of {len(text_blocks)}')
-                    
-                    for line_idx, line in enumerate( block.text_lines ):
-                        line_image = self.crop_image( arr_image, line.box )
-                        line.content = self.manga_ocr( line_image )
+                lines = [ line for block in text_blocks for line in block.text_lines ]
+                self.recognize_text_lines( arr_image, lines )
 
+                for block in text_blocks:
                     block.recognition_state = "RECOGNIZED"
 
         else:
-            for block_idx, box in enumerate(boxes):
-                # print(f'\nProcessing text block {box_idx+1} of {len(boxes)}')
-                line_image = self.crop_image( arr_image, box )
+            text_blocks = self.boxes_to_results( boxes )
 
-                line = TextLine(
-                    box=box,
-                    content=self.manga_ocr( line_image )
-                )
+            lines = [ block.text_lines[0] for block in text_blocks ]
+            self.recognize_text_lines( arr_image, lines )
 
-                text_blocks.append(
-                    Result(
-                        box=box,
-                        text_lines=[line],
-                        recognition_state= "RECOGNIZED"
-                    )
-                )
+            for block in text_blocks:
+                block.recognition_state = "RECOGNIZED"
         
         response = RecognizeDefaultResponse(
                 context_resolution= {
-                    'width': image.width,
-                    'height': image.height
+                    'width': arr_image.shape[1],
+                    'height': arr_image.shape[0]
                 },
                 id= request_id,
                 results= text_blocks
             )
         
         if detection_only:
-            self.add_partial_recognition(
+            self.partial_recognitions.add(
                 PartialRecognition(
-                    image= arr_image,
-                    partial_response= response
+                    partial_response= response,
+                    line_images= self.crop_pending_lines( arr_image, response.results )
                 )
             )
+        elif len(boxes) == 0:
+            self.add_recent_response( response, arr_image )
+
+        return response
+
+    # Detects and recognizes again only inside the changed regions,
+    # reusing the results of the reference request everywhere else
+    def recognize_regions(
+        self,
+        image: Image.Image | np.ndarray,
+        request_id: str,
+        reference_request_id: str,
+        changed_regions: List[ Box ] = []
+    ) -> RecognizeDefaultResponse:
+
+        arr_image = self.image_to_array( image )
+        height, width = arr_image.shape[:2]
+
+        reference = self.get_reference( reference_request_id, width, height )
+
+        if not reference:
+            return self.recognize( image, request_id )
+
+        regions = [ self.box_to_rect( box ) for box in changed_regions ]
+
+        return self.recognize_with_reference( arr_image, request_id, list( reference.response.results ), regions )
+
+    # For scrolling content: shifts the reference results by the estimated scroll
+    # and only detects and recognizes the newly exposed strips
+    def recognize_scrolled(
+        self,
+        image: Image.Image | np.ndarray,
+        request_id: str,
+        reference_request_id: str
+    ) -> RecognizeDefaultResponse:
+
+        arr_image = self.image_to_array( image )
+        height, width = arr_image.shape[:2]
+
+        reference = self.get_reference( reference_request_id, width, height )
+
+        if not reference or reference.thumbnail is None:
+            return self.recognize( image, request_id )
+
+        thumbnail = self.scroll_estimator.thumbnail( arr_image )
+        estimate = self.scroll_estimator.estimate( reference.thumbnail, thumbnail, ( width, height ) )
+
+        if estimate is None:
+            return self.recognize( image, request_id )
+
+        ( dx, dy ), changed_rects = estimate
+
+        shifted_blocks: List[ Result ] = []
+
+        # What changed besides scrolling, like new dialogue in a box that stayed in place, is detected again
+        regions: List[ tuple ] = list( changed_rects )
+
+        for block in reference.response.results:
+            shifted_block = Result()
+            shifted_block.CopyFrom( block )
+            self.offset_result( shifted_block, dx, dy )
+
+            left, top, right, bottom = self.box_to_rect( shifted_block.box )
+
+            if right <= 0 or bottom <= 0 or left >= width or top >= height:
+                continue # Scrolled out
+
+            if left < 0 or top < 0 or right > width or bottom > height:
+                # Partially visible, its visible part is detected again
+                regions.append( ( max( 0, left ), max( 0, top ), min( width, right ), min( height, bottom ) ) )
+                continue
+
+            shifted_blocks.append( shifted_block )
+
+        # Newly exposed strips
+        if dy > 0:
+            regions.append( ( 0, 0, width, dy ) )
+        elif dy < 0:
+            regions.append( ( 0, height + dy, width, height ) )
+
+        if dx > 0:
+            regions.append( ( 0, 0, dx, height ) )
+        elif dx < 0:
+            regions.append( ( width + dx, 0, width, height ) )
+
+        return self.recognize_with_reference( arr_image, request_id, shifted_blocks, regions, thumbnail )
+
+    def recognize_with_reference(
+        self,
+        arr_image: np.ndarray,
+        request_id: str,
+        reference_blocks: List[ Result ],
+        regions: List[ tuple ],
+        thumbnail: np.ndarray | None = None
+    ) -> RecognizeDefaultResponse:
+
+        self.ensure_initialized()
+
+        height, width = arr_image.shape[:2]
+
+        regions = [ self.pad_rect( region, self.region_padding, width, height ) for region in regions ]
+
+        # A block touched by a region is detected again as a whole, so regions grow to cover it
+        while True:
+            regions = self.merge_overlapping_rects( regions )
+            kept_blocks: List[ Result ] = []
+            grown = False
+
+            for block in reference_blocks:
+                block_rect = self.box_to_rect( block.box )
+
+                for region_idx, region in enumerate( regions ):
+                    if not self.rects_intersect( block_rect, region ):
+                        continue
+
+                    union = self.union_rect( region, block_rect )
+                    if union != region:
+                        regions[ region_idx ] = union
+                        grown = True
+                    break
+
+                else:
+                    kept_blocks.append( block )
+
+            if not grown:
+                break
+
+        new_blocks: List[ Result ] = []
+
+        for left, top, right, bottom in regions:
+            for block in self.detect( arr_image[ top:bottom, left:right ] ):
+                self.offset_result( block, left, top )
+                block.recognition_state = "RECOGNIZED"
+                new_blocks.append( block )
+
+        self.recognize_text_lines(
+            arr_image,
+            [ line for block in new_blocks for line in block.text_lines ]
+        )
+
+        response = RecognizeDefaultResponse(
+            context_resolution= {
+                'width': width,
+                'height': height
+            },
+            id= request_id,
+            results= kept_blocks + new_blocks
+        )
+
+        for block_idx, block in enumerate( response.results ):
+            block.id = str(block_idx)
+
+        if thumbnail is None:
+            self.add_recent_response( response, arr_image )
+        else:
+            self.add_recent_recognition( RecentRecognition( response, thumbnail ) )
 
         return response
+
+    def get_reference( self, reference_request_id: str, width: int, height: int ) -> RecentRecognition | None:
+
+        reference = self.recent_recognitions.get( reference_request_id )
+
+        if (
+            not reference or
+            reference.response.context_resolution.width != width or
+            reference.response.context_resolution.height != height
+        ):
+            return None
+
+        return reference
     
+    # Yields the detection result first, then every block as soon as its lines are recognized
+    def recognize_stream(
+        self,
+        image: Image.Image | np.ndarray,
+        request_id: str,
+        boxes: List[ Box ] = []
+    ) -> Iterator[ RecognizeDefaultResponse ]:
+
+        self.ensure_initialized()
+
+        arr_image = self.image_to_array( image )
+
+        context_resolution = {
+            'width': arr_image.shape[1],
+            'height': arr_image.shape[0]
+        }
+
+        if len(boxes) == 0:
+            text_blocks = self.detect( arr_image )
+        else:
+            text_blocks = self.boxes_to_results( boxes )
+
+        yield RecognizeDefaultResponse(
+            context_resolution= context_resolution,
+            id= request_id,
+            results= text_blocks
+        )
+
+        for block in text_blocks:
+
+            self.recognize_text_lines( arr_image, block.text_lines )
+            block.recognition_state = "RECOGNIZED"
+
+            yield RecognizeDefaultResponse(
+                context_resolution= context_resolution,
+                id= request_id,
+                results= [ block ]
+            )
+
+        if len(boxes) == 0:
+            self.add_recent_response(
+                RecognizeDefaultResponse(
+                    context_resolution= context_resolution,
+                    id= request_id,
+                    results= text_blocks
+                ),
+                arr_image
+            )
+
+    # Detection only, for recognizing elsewhere; crop_format '' skips the crops
+    def detect_blocks(
+        self,
+        image: Image.Image | np.ndarray,
+        request_id: str,
+        crop_format: str = '',
+        crop_quality: int = 90
+    ) -> DetectResponse:
+
+        self.ensure_initialized()
+
+        arr_image = self.image_to_array( image )
+
+        response = self.detection_response( arr_image, request_id )
+
+        if crop_format:
+            crops = self.crop_boxes( arr_image, [ result.box for result in response.results ] )
+
+            for result, crop in zip( response.results, crops ):
+                self.add_crop( result, crop, crop_format, crop_quality )
+
+        return response
+
+    # Yields the detection results first, then every block with its crop
+    def detect_stream(
+        self,
+        image: Image.Image | np.ndarray,
+        request_id: str,
+        crop_format: str = '',
+        crop_quality: int = 90
+    ) -> Iterator[ DetectResponse ]:
+
+        self.ensure_initialized()
+
+        arr_image = self.image_to_array( image )
+
+        response = self.detection_response( arr_image, request_id )
+
+        yield response
+
+        if not crop_format:
+            return
+
+        crops = self.crop_boxes( arr_image, [ result.box for result in response.results ] )
+
+        for result, crop in zip( response.results, crops ):
+
+            cropped_result = DetectionResult()
+            cropped_result.CopyFrom( result )
+            self.add_crop( cropped_result, crop, crop_format, crop_quality )
+
+            yield DetectResponse(
+                id= request_id,
+                results= [ cropped_result ],
+                context_resolution= response.context_resolution
+            )
+
+    def detection_response( self, image: np.ndarray, request_id: str ) -> DetectResponse:
+        return DetectResponse(
+            id= request_id,
+            results= [
+                DetectionResult(
+                    id= block.id,
+                    box= block.box,
+                    text_lines= block.text_lines,
+                    is_vertical= block.is_vertical
+                )
+                for block in self.detect( image )
+            ],
+            context_resolution= {
+                'width': image.shape[1],
+                'height': image.shape[0]
+            }
+        )
+
+    def add_crop( self, result: DetectionResult, crop: np.ndarray, crop_format: str, crop_quality: int = 90 ):
+
+        if crop_format == 'RAW':
+            result.raw_image.CopyFrom(
+                RawImage(
+                    data= crop.tobytes(),
+                    width= crop.shape[1],
+                    height= crop.shape[0],
+                    pixel_format= self.pixel_format( crop )
+                )
+            )
+            return
+
+        # OpenCV encodes much faster than PIL, especially PNG at a low compression level
+        if crop.ndim == 3:
+            crop = cv2.cvtColor( crop, cv2.COLOR_RGBA2BGRA if crop.shape[2] == 4 else cv2.COLOR_RGB2BGR )
+
+        if crop_format == 'JPEG':
+            if crop.ndim == 3 and crop.shape[2] == 4:
+                crop = cv2.cvtColor( crop, cv2.COLOR_BGRA2BGR )
+            _, encoded = cv2.imencode( '.jpg', crop, [ cv2.IMWRITE_JPEG_QUALITY, crop_quality ] )
+        else:
+            _, encoded = cv2.imencode( '.png', crop, [ cv2.IMWRITE_PNG_COMPRESSION, 1 ] )
+
+        result.image_bytes = encoded.tobytes()
+
+    def pixel_format( self, image: np.ndarray ) -> str:
+        if image.ndim == 2:
+            return 'GRAY'
+        return 'RGBA' if image.shape[2] == 4 else 'RGB'
+
     def recognize_selective(
         self,
         request_id: str,
-        image: Image.Image = None,
+        image: Image.Image | np.ndarray = None,
         result_ids: List[str] = []
     ) -> RecognizeDefaultResponse | None:
         
-        if not self.manga_ocr:
-            self.init()
+        self.ensure_initialized()
+
+        with self.partial_recognitions.updating( request_id ):
+            return self.recognize_selected_blocks( request_id, image, result_ids )
+
+    def recognize_selected_blocks(
+        self,
+        request_id: str,
+        image: Image.Image | np.ndarray = None,
+        result_ids: List[str] = []
+    ) -> RecognizeDefaultResponse | None:
 
         previous_recognition = self.partial_recognitions.get( request_id )
 
-        if not previous_recognition:
-            pass # self.previous_recognition.Clear()
-        
-        arr_image: np.ndarray = None
-        response: RecognizeDefaultResponse
+        response: RecognizeDefaultResponse = None
+        line_images: Dict[ LineKey, np.ndarray ] = {}
+        recognized_lines: Dict[ LineKey, str ] = {}
 
-        if image:
-            arr_image = np.array( image )
+        if image is not None:
+            arr_image = self.image_to_array( image )
             text_blocks = self.detect( arr_image )
 
             response = RecognizeDefaultResponse(
                 context_resolution= {
-                    'width': image.width,
-                    'height': image.height
+                    'width': arr_image.shape[1],
+                    'height': arr_image.shape[0]
                 },
                 id= request_id,
                 results= text_blocks
             )
 
-        if previous_recognition and not image:
+            line_images = self.crop_pending_lines( arr_image, response.results )
+
+        elif previous_recognition:
             response = previous_recognition.partial_response
-            arr_image = previous_recognition.image
+            line_images = previous_recognition.line_images
+            recognized_lines = previous_recognition.recognized_lines
+
+        if not response:
+            return None
 
         if result_ids and len(result_ids) > 0:
 
-            for block in response.results:
-                
-                if block.id not in result_ids or block.recognition_state == 'RECOGNIZED':
-                    continue
+            selected_blocks = [
+                block for block in response.results
+                if block.id in result_ids and block.recognition_state != 'RECOGNIZED'
+            ]
+
+            pending_lines = [
+                ( ( block.id, line_idx ), line )
+                for block in selected_blocks
+                for line_idx, line in enumerate( block.text_lines )
+                if not bool(line.content) and ( block.id, line_idx ) in line_images
+            ]
 
-                for line in block.text_lines:
+            # Lines the background recognition already got to
+            for key, line in pending_lines:
+                if key in recognized_lines:
+                    line.content = recognized_lines[ key ]
 
-                    if ( bool(line.content) ):
-                        continue
+            pending_lines = [ ( key, line ) for key, line in pending_lines if key not in recognized_lines ]
+
+            contents = self.recognize_line_images( [ line_images[ key ] for key, _ in pending_lines ] )
 
-                    line_image = self.crop_image( previous_recognition.image, line.box )
-                    line.content = self.manga_ocr( line_image )
-                
+            for ( _, line ), content in zip( pending_lines, contents ):
+                line.content = content
+
+            for block in selected_blocks:
                 block.recognition_state = 'RECOGNIZED'
-        
-        self.add_partial_recognition(
-                PartialRecognition(
-                    image= arr_image,
-                    partial_response= response
-                )
+
+        # Crops of recognized blocks aren't needed anymore
+        recognized_ids = { block.id for block in response.results if block.recognition_state == 'RECOGNIZED' }
+
+        self.partial_recognitions.add(
+            PartialRecognition(
+                partial_response= response,
+                line_images= {
+                    key: line_image for key, line_image in line_images.items()
+                    if key[0] not in recognized_ids
+                },
+                recognized_lines= {
+                    key: content for key, content in recognized_lines.items()
+                    if key[0] not in recognized_ids
+                }
             )
+        )
 
         return response
 
+    def crop_pending_lines( self, image: np.ndarray, results: List[ Result ] ) -> Dict[ LineKey, np.ndarray ]:
+
+        line_keys: List[ LineKey ] = []
+        boxes: List[ Box ] = []
+
+        for block in results:
+            if block.recognition_state == 'RECOGNIZED':
+                continue
+            for line_idx, line in enumerate( block.text_lines ):
+                if not bool(line.content):
+                    line_keys.append( ( block.id, line_idx ) )
+                    boxes.append( line.box )
+
+        # Grayscale, at a third of the size; always copied, as a contiguous slice would still be a view of the whole image
+        return {
+            line_key: line_image.copy()
+            for line_key, line_image in zip( line_keys, self.crop_lines( image, boxes ) )
+        }
+
+    def begin_request( self, source_id: str = '' ) -> int:
+        # Cancels the background recognition of older requests from the same source
+        return self.speculative_recognizer.begin( source_id )
+
+    def schedule_speculative_recognition(
+        self,
+        request_id: str,
+        source_id: str = '',
+        generation: int = 0,
+        priority_point: Vertex = None
+    ):
+        if not self.speculative_recognition:
+            return
+
+        self.speculative_recognizer.submit( source_id, generation, request_id, priority_point )
+
+    def recognize_speculatively( self, request_id: str, priority_point: Vertex | None, is_cancelled ):
+
+        recognition = self.partial_recognitions.get( request_id )
+
+        if not recognition:
+            return
+
+        blocks = self.speculative_block_order( recognition.partial_response.results, priority_point )
+
+        for block in blocks:
+
+            if is_cancelled():
+                return
+
+            try:
+                # Queued with the requests for the engine, so that it never runs more than its share at once
+                with self.engine_slot():
+
+                    if is_cancelled():
+                        return
+
+                    with self.partial_recognitions.updating( request_id ):
+                        self.recognize_pending_block( request_id, block )
+
+            except SchedulerError:
+                return # The queue is full of requests, which come first
+
+    def recognize_pending_block( self, request_id: str, block: Result ):
+
+        # RecognizeSelective replaces the stored recognition with what's still pending
+        recognition = self.partial_recognitions.get( request_id )
+
+        if not recognition:
+            return
+
+        keys = [
+            ( block.id, line_idx )
+            for line_idx in range( len(block.text_lines) )
+            if ( block.id, line_idx ) in recognition.line_images and
+                ( block.id, line_idx ) not in recognition.recognized_lines
+        ]
+
+        # Already recognized by RecognizeSelective
+        if not keys:
+            return
+
+        contents = self.recognize_line_images( [ recognition.line_images[ key ] for key in keys ] )
+
+        for key, content in zip( keys, contents ):
+            recognition.recognized_lines[ key ] = content
+
+    def speculative_block_order( self, blocks: List[ Result ], priority_point: Vertex = None ) -> List[ Result ]:
+
+        pending_blocks = [ block for block in blocks if block.recognition_state != 'RECOGNIZED' ]
+        rects = { block.id: self.box_to_rect( block.box ) for block in pending_blocks }
+
+        if self.speculative_order == 'size':
+            # Largest first
+            def priority( block: Result ):
+                left, top, right, bottom = rects[ block.id ]
+                return -( right - left ) * ( bottom - top )
+
+        elif self.speculative_order == 'hint' and priority_point:
+            # Closest to the point the client is interested in (e.g. the cursor) first
+            def priority( block: Result ):
+                left, top, right, bottom = rects[ block.id ]
+                dx = max( left - priority_point.x, 0, priority_point.x - right )
+                dy = max( top - priority_point.y, 0, priority_point.y - bottom )
+                return dx * dx + dy * dy
+
+        else:
+            # Vertical Japanese text reads right to left, then top to bottom
+            def priority( block: Result ):
+                left, top, right, bottom = rects[ block.id ]
+                return ( -right, top )
+
+        return sorted( pending_blocks, key= priority )
+
+    def get_memory_usage( self ) -> Dict[ str, Dict[ str, int ] ]:
+        return {
+            'partial_recognitions': self.partial_recognitions.memory_usage(),
+            'line_cache': self.line_cache.stats() if self.line_cache else {},
+        }
+
+    def image_to_array( self, image: Image.Image | np.ndarray ) -> np.ndarray:
+        if isinstance( image, np.ndarray ):
+            return image
+        return np.array( image )
+
     
-    def add_partial_recognition( self, recognition: PartialRecognition ):
+    def recognize_text_lines( self, image: np.ndarray, lines: List[ TextLine ] ):
+
+        if len(lines) == 0:
+            return
+
+        line_images = self.crop_lines( image, [ line.box for line in lines ] )
+
+        for line, content in zip( lines, self.recognize_line_images( line_images ) ):
+            line.content = content
+
+    def recognize_line_images( self, line_images: List[ np.ndarray ] ) -> List[ str ]:
 
-        id = recognition.partial_response.id
-        self.partial_recognitions[id] = recognition
+        contents: List[ str ] = [ '' ] * len(line_images)
+        cache_keys: List[ bytes ] = []
+        pending = range( len(line_images) )
 
-        if len(self.partial_recognitions) > 20:
-            oldest_key = next( iter(self.partial_recognitions) )
-            del self.partial_recognitions[ oldest_key ]
+        if self.line_cache:
+            cache_keys = [ self.line_cache.key( line_image ) for line_image in line_images ]
+            pending = []
 
-    def crop_image( self, image: np.ndarray, box: Box ) -> Image.Image:
+            for idx, cache_key in enumerate( cache_keys ):
+                cached_content = self.line_cache.get( cache_key )
+                if cached_content is None:
+                    pending.append( idx )
+                else:
+                    contents[idx] = cached_content
 
+        # Lines with a similar aspect ratio tend to have a similar number of characters,
+        # so grouping them keeps the decoder from padding short lines while long ones finish
+        order = sorted(
+            pending,
+            key= lambda idx: self.line_length_estimate( line_images[idx] )
+        )
+
+        batch_size = max( 1, self.recognition_batch_size )
+
+        if self.worker_pool:
+            # Smaller batches, so every worker gets a share of the page
+            batch_size = min( batch_size, max( 1, -( -len(order) // self.worker_pool.workers ) ) )
+
+        batches = [
+            order[ batch_start : batch_start + batch_size ]
+            for batch_start in range( 0, len(order), batch_size )
+        ]
+
+        if self.worker_pool:
+            batches_contents = self.worker_pool.recognize(
+                [ [ line_images[idx] for idx in batch_indices ] for batch_indices in batches ]
+            )
+        else:
+            batches_contents = (
+                self.recognize_batch( [ line_images[idx] for idx in batch_indices ] )
+                for batch_indices in batches
+            )
+
+        for batch_indices, batch_contents in zip( batches, batches_contents ):
+
+            for idx, content in zip( batch_indices, batch_contents ):
+                contents[idx] = content
+
+                if self.line_cache:
+                    self.line_cache.put( cache_keys[idx], content )
+
+        return contents
+
+    def recognize_batch( self, line_images: List[ np.ndarray ] ) -> List[ str ]:
+        return recognize_batch( self.manga_ocr, line_images )
+
+    def line_length_estimate( self, line_image: np.ndarray ) -> float:
+        height, width = line_image.shape[:2]
+        return max( width, height ) / max( 1, min( width, height ) )
+
+    def add_recent_response( self, response: RecognizeDefaultResponse, image: np.ndarray ):
+        self.add_recent_recognition(
+            RecentRecognition( response, self.scroll_estimator.thumbnail( image ) )
+        )
+
+    # Registers a response reused for an identical frame under its new id
+    def add_reused_response( self, response: RecognizeDefaultResponse, original_request_id: str ):
+        original = self.recent_recognitions.get( original_request_id )
+        self.add_recent_recognition(
+            RecentRecognition( response, original.thumbnail if original else None )
+        )
+
+    def add_recent_recognition( self, recognition: RecentRecognition ):
+
+        id = recognition.response.id
+        self.recent_recognitions[id] = recognition
+
+        if len(self.recent_recognitions) > 20:
+            oldest_key = next( iter(self.recent_recognitions) )
+            del self.recent_recognitions[ oldest_key ]
+
+    def crop_lines( self, image: np.ndarray, boxes: List[ Box ] ) -> List[ np.ndarray ]:
+        # Grayscale, which is all the recognizer uses, converted like MangaOcr does
+        return [ to_line_grayscale( line_image ) for line_image in self.crop_boxes( image, boxes ) ]
+
+    def crop_boxes( self, image: np.ndarray, boxes: List[ Box ] ) -> List[ np.ndarray ]:
+
+        if len(boxes) == 0:
+            return []
+
+        # top left, top right, bottom right, bottom left
         points = np.array(
             [
-                [ box.top_left.x, box.top_left.y ],
-                [ box.top_right.x, box.top_right.y ],
-                [ box.bottom_right.x, box.bottom_right.y ],
-                [ box.bottom_left.x, box.bottom_left.y ]
+                [
+                    [ box.top_left.x, box.top_left.y ],
+                    [ box.top_right.x, box.top_right.y ],
+                    [ box.bottom_right.x, box.bottom_right.y ],
+                    [ box.bottom_left.x, box.bottom_left.y ]
+                ]
+                for box in boxes
             ],
-            dtype=np.float32
+            dtype=np.int32
         )
 
-        # Get the bounding box for the region of interest
-        rect = cv2.boundingRect( points )
-        x, y, w, h = rect
+        # Bounding boxes of all the regions, like cv2.boundingRect
+        left = points[ :, :, 0 ].min( axis=1 )
+        top = points[ :, :, 1 ].min( axis=1 )
+        width = points[ :, :, 0 ].max( axis=1 ) - left + 1
+        height = points[ :, :, 1 ].max( axis=1 ) - top + 1
+
+        # Most boxes are axis-aligned and inside the image: those are slices, without copying.
+        # Only rotated boxes (and ones crossing the image border) are warped.
+        is_sliceable = (
+            ( points[ :, 0, 1 ] == points[ :, 1, 1 ] ) & ( points[ :, 3, 1 ] == points[ :, 2, 1 ] ) &
+            ( points[ :, 0, 0 ] == points[ :, 3, 0 ] ) & ( points[ :, 1, 0 ] == points[ :, 2, 0 ] ) &
+            ( points[ :, 0, 0 ] < points[ :, 1, 0 ] ) & ( points[ :, 0, 1 ] < points[ :, 3, 1 ] ) &
+            ( left >= 0 ) & ( top >= 0 ) &
+            ( left + width <= image.shape[1] ) & ( top + height <= image.shape[0] )
+        )
+
+        return [
+            image[ top[idx] : top[idx] + height[idx], left[idx] : left[idx] + width[idx] ]
+            if is_sliceable[idx] else
+            self.warp_region( image, points[idx], int( width[idx] ), int( height[idx] ) )
+            for idx in range( len(boxes) )
+        ]
+
+    def warp_region( self, image: np.ndarray, points: np.ndarray, w: int, h: int ) -> np.ndarray:
 
         # Perspective transform to extract the region of interest
         perspective_matrix = cv2.getPerspectiveTransform(
-            points,
+            points.astype( np.float32 ),
             np.array(
                 [
                     [0, 0],
@@ -280,18 +1025,8 @@ class MangaOcrService:
             )
         )
 
-        result = cv2.warpPerspective( image, perspective_matrix, (w, h) )
-    
-        # cv2.imshow('result', result)
-        # cv2.waitKey(0)
-        # cv2.destroyAllWindows()
+        return cv2.warpPerspective( image, perspective_matrix, (w, h) )
 
-        return self.cv_mat_to_pil_image(result)
-
-    def cv_mat_to_pil_image( self, image ) -> Image.Image:
-        return Image.fromarray(
-                   cv2.cvtColor( image, cv2.COLOR_BGR2RGB )
-                )
     
     def detect(
         self,
@@ -325,8 +1060,75 @@ class MangaOcrService:
         return text_blocks
 
     def update_settings( self, cpu_threads ):
+        # Worker processes get their share of the threads when they start
         torch.set_num_threads( cpu_threads or os.cpu_count() )
 
+    def boxes_to_results( self, boxes: List[ Box ] ) -> List[ Result ]:
+        return [
+            Result(
+                box= box,
+                text_lines= [ TextLine( box=box, content='' ) ],
+                id= str(box_idx),
+                recognition_state= "DETECTED"
+            )
+            for box_idx, box in enumerate(boxes)
+        ]
+
+    # Rects are ( left, top, right, bottom )
+    def box_to_rect( self, box: Box ) -> tuple[int, int, int, int]:
+        vertices = [ box.top_left, box.top_right, box.bottom_right, box.bottom_left ]
+        return (
+            min( vertex.x for vertex in vertices ),
+            min( vertex.y for vertex in vertices ),
+            max( vertex.x for vertex in vertices ),
+            max( vertex.y for vertex in vertices )
+        )
+
+    def pad_rect( self, rect: tuple, padding: int, width: int, height: int ) -> tuple[int, int, int, int]:
+        left, top, right, bottom = rect
+        return (
+            max( 0, left - padding ),
+            max( 0, top - padding ),
+            min( width, right + padding ),
+            min( height, bottom + padding )
+        )
+
+    def rects_intersect( self, rect_a: tuple, rect_b: tuple ) -> bool:
+        return (
+            rect_a[0] < rect_b[2] and rect_b[0] < rect_a[2] and
+            rect_a[1] < rect_b[3] and rect_b[1] < rect_a[3]
+        )
+
+    def union_rect( self, rect_a: tuple, rect_b: tuple ) -> tuple[int, int, int, int]:
+        return (
+            min( rect_a[0], rect_b[0] ),
+            min( rect_a[1], rect_b[1] ),
+            max( rect_a[2], rect_b[2] ),
+            max( rect_a[3], rect_b[3] )
+        )
+
+    def merge_overlapping_rects( self, rects: List[ tuple ] ) -> List[ tuple ]:
+        merged: List[ tuple ] = []
+
+        for rect in rects:
+            # Merging can make a rect reach others that were already merged, so start over with it
+            idx = 0
+            while idx < len(merged):
+                if self.rects_intersect( merged[idx], rect ):
+                    rect = self.union_rect( merged.pop(idx), rect )
+                    idx = 0
+                else:
+                    idx += 1
+            merged.append( rect )
+
+        return merged
+
+    def offset_result( self, result: Result, dx: int, dy: int ):
+        for box in [ result.box ] + [ line.box for line in result.text_lines ]:
+            for vertex in ( box.top_left, box.top_right, box.bottom_right, box.bottom_left ):
+                vertex.x += dx
+                vertex.y += dy
+
     def coordinates_to_box( self, coordinates: List ) -> Box:
         points = [ [int(x), int(y)] for x, y in coordinates ]
         return Box(
@@ -342,10 +1144,55 @@ class MangaOcrService:
             language_codes = ['ja-JP'],
             is_installed = self.is_model_downloaded()
         )
-        return [ model ]
+        quantized_model = TextRecognitionModel(
+            name = f'{self.recognition_model_id}:{QUANTIZED_VARIANT}',
+            language_codes = ['ja-JP'],
+            is_installed = self.model_catalog.quantized_model_exists()
+        )
+        return [ model, quantized_model ]
     
     def install_model(self, name: str) -> bool:
-        return self.download_model()
+
+        # "<model id>:int8-experimental" installs and selects the quantized variant, "<model id>" the original one
+        _, _, variant = name.partition(':')
+
+        if variant not in MODEL_VARIANTS:
+            print(f'Unknown model variant: {variant}')
+            return False
+
+        if not self.download_model():
+            return False
+
+        self.model_variant = variant
+        self.save_model_variant( variant )
+
+        if self.worker_pool:
+            print('The recognition workers switch models when the service restarts')
+
+        elif self.comic_text_detector:
+            # Already initialized; quantizes the model too if it isn't cached yet
+            self.manga_ocr = load_manga_ocr( *self.recognizer_args() )
+
+        elif variant == QUANTIZED_VARIANT and not self.model_catalog.quantized_model_exists():
+            # Quantized now rather than on the first recognition
+            load_manga_ocr( *self.recognizer_args() )
+
+        self.model_catalog.invalidate()
+
+        return True
+
+    def read_model_variant( self ) -> str:
+        try:
+            variant = ( Path( self.get_custom_model_path() ) / 'model_variant' ).read_text().strip()
+            return variant if variant in MODEL_VARIANTS else ''
+        except OSError:
+            return ''
+
+    def save_model_variant( self, variant: str ):
+        try:
+            ( Path( self.get_custom_model_path() ) / 'model_variant' ).write_text( variant )
+        except OSError as error:
+            print(error)
     
     def get_hardware_acceleration_options(self) -> List[HardwareAccelerationOption]:
 
@@ -413,6 +1260,14 @@ class MangaOcrService:
             option['installed'] = is_installed
             option['install_command'] = base_command +' '+ option['install_command']
 
+        # Selected with MANGA_OCR_BACKEND=ONNX once installed
+        onnx_option = HardwareAccelerationOption(
+            backend= 'ONNX',
+            compute_platform= 'CPU',
+            installed= is_onnx_runtime_available(),
+            install_command= ONNX_INSTALL_COMMAND,
+        )
+
         if os_platform == 'linux':
             return [
                 HardwareAccelerationOption(
@@ -422,7 +1277,7 @@ class MangaOcrService:
                     installed= bool( option.get('installed') ),
                     install_command= base_command +' '+ option['install_command'],
                 ) for option in linux_opts_dict
-            ]
+            ] + [ onnx_option ]
         
         if os_platform == 'windows':
             return [
@@ -433,7 +1288,7 @@ class MangaOcrService:
                     installed= bool( option.get('installed') ),
                     install_command= option['install_command'],
                 ) for option in linux_opts_dict if option['compute_platform'] != 'ROCm'
-            ]
+            ] + [ onnx_option ]
         
         if os_platform == 'darwin':
             return [
@@ -444,7 +1299,7 @@ class MangaOcrService:
                     installed= bool( option.get('installed')),
                     install_command= base_command +' '+ option['install_command'],
                 ) for option in mac_opts_dict
-            ]
+            ] + [ onnx_option ]
         
         
         return []
@@ -0,0 +1,86 @@
+import threading
+from pathlib import Path
+from typing import Dict, Tuple
+from huggingface_hub import scan_cache_dir
+from huggingface_hub.constants import HF_HUB_CACHE
+from .quantization import quantized_model_path
+
+# Which recognition models are installed, indexed once and answered from memory.
+# The index is rebuilt after an install or download, or when one of the model directories changes.
+
+
+class ModelCatalog:
+
+    def __init__( self, model_id: str, custom_model_path: str, embedded_model_path: str ):
+        self.model_id = model_id
+        self.custom_model_path = Path( custom_model_path )
+        self.embedded_model_path = Path( embedded_model_path )
+        self.hf_cache_path = Path( HF_HUB_CACHE )
+        self.lock = threading.Lock()
+        self.directory_mtimes: Tuple[ float | None, ... ] | None = None
+        self.installed: Dict[ str, bool ] = {}
+
+    def invalidate( self ):
+        with self.lock:
+            self.directory_mtimes = None
+
+    def custom_model_exists( self ) -> bool:
+        return self.index()['custom']
+
+    def embedded_model_exists( self ) -> bool:
+        return self.index()['embedded']
+
+    def cached_model_exists( self ) -> bool:
+        return self.index()['cached']
+
+    def quantized_model_exists( self ) -> bool:
+        return self.index()['quantized']
+
+    def is_model_downloaded( self ) -> bool:
+        installed = self.index()
+        return installed['custom'] or installed['embedded'] or installed['cached']
+
+    def index( self ) -> Dict[ str, bool ]:
+
+        # Taken before scanning, so changes made during a scan are picked up by the next call
+        directory_mtimes = self.get_directory_mtimes()
+
+        with self.lock:
+            if directory_mtimes != self.directory_mtimes:
+                self.installed = self.scan()
+                self.directory_mtimes = directory_mtimes
+
+            return self.installed
+
+    def scan( self ) -> Dict[ str, bool ]:
+        return {
+            'custom': ( self.custom_model_path / 'pytorch_model.bin' ).exists(),
+            'embedded': ( self.embedded_model_path / 'pytorch_model.bin' ).exists(),
+            'cached': self.scan_hf_cache(),
+            'quantized': quantized_model_path( self.custom_model_path ).exists(),
+        }
+
+    def scan_hf_cache( self ) -> bool:
+
+        if not self.hf_cache_path.is_dir():
+            return False
+
+        try:
+            cache_info = scan_cache_dir( self.hf_cache_path )
+            return self.model_id in [ repo.repo_id for repo in cache_info.repos ]
+
+        except Exception as error:
+            print(error)
+            return False
+
+    def get_directory_mtimes( self ) -> Tuple[ float | None, ... ]:
+
+        mtimes = []
+
+        for directory in ( self.custom_model_path, self.embedded_model_path, self.hf_cache_path ):
+            try:
+                mtimes.append( directory.stat().st_mtime )
+            except OSError:
+                mtimes.append( None )
+
+        return tuple( mtimes )
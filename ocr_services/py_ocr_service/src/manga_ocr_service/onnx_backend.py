@@ -0,0 +1,123 @@
+import os
+import importlib.util
+from pathlib import Path
+from typing import Tuple
+import torch
+from manga_ocr import MangaOcr
+from transformers import ViTImageProcessor, AutoTokenizer
+
+# ONNX Runtime CPU inference for the recognizer and the detector.
+# Graphs are exported from the torch models once and cached under MODELS_PATH.
+
+ONNX_INSTALL_COMMAND = 'pip install onnxruntime optimum[onnxruntime]'
+
+
+def is_onnx_runtime_available() -> bool:
+    return (
+        importlib.util.find_spec('onnxruntime') is not None and
+        importlib.util.find_spec('optimum') is not None
+    )
+
+def get_onnx_models_path() -> Path:
+    return Path( os.environ.get( 'MODELS_PATH', '../models' ) ) / 'onnx'
+
+
+class OnnxMangaOcr( MangaOcr ):
+
+    # Same interface as MangaOcr, with the encoder and the decoder (and its KV cache) in ONNX Runtime
+
+    def __init__( self, pretrained_model_name_or_path: str, onnx_model_path: str | Path = None ):
+        from optimum.onnxruntime import ORTModelForVision2Seq
+
+        onnx_model_path = Path(
+            onnx_model_path or get_onnx_models_path() / Path( pretrained_model_name_or_path ).name
+        )
+
+        self.processor = ViTImageProcessor.from_pretrained( pretrained_model_name_or_path )
+        self.tokenizer = AutoTokenizer.from_pretrained( pretrained_model_name_or_path, tokenizer_type= 'bert-japanese' )
+
+        if ( onnx_model_path / 'config.json' ).exists():
+            self.model = ORTModelForVision2Seq.from_pretrained(
+                onnx_model_path,
+                use_cache= True,
+                provider= 'CPUExecutionProvider'
+            )
+            return
+
+        print(f'Exporting {pretrained_model_name_or_path} to ONNX...')
+
+        self.model = ORTModelForVision2Seq.from_pretrained(
+            pretrained_model_name_or_path,
+            export= True,
+            use_cache= True,
+            provider= 'CPUExecutionProvider'
+        )
+        self.model.save_pretrained( onnx_model_path )
+
+
+class OnnxTextDetNet:
+
+    # Drop-in for TextDetector.net; takes and returns tensors like TextDetBase
+
+    def __init__( self, model_path: str | Path ):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = torch.get_num_threads()
+
+        self.session = onnxruntime.InferenceSession(
+            str( model_path ),
+            sess_options= options,
+            providers= [ 'CPUExecutionProvider' ]
+        )
+
+    def __call__( self, img_in: torch.Tensor ) -> Tuple[ torch.Tensor, torch.Tensor, torch.Tensor ]:
+
+        blks, mask, lines_map = self.session.run(
+            None,
+            { 'images': img_in.detach().cpu().numpy() }
+        )
+
+        return torch.from_numpy( blks ), torch.from_numpy( mask ), torch.from_numpy( lines_map )
+
+
+def export_text_detector( net: torch.nn.Module, input_size: Tuple[int, int], model_path: Path ):
+    from comic_text_detector.models.yolov5.yolo import Detect
+
+    print(f'Exporting comic-text-detector to ONNX ({input_size[0]}x{input_size[1]})...')
+
+    for module in net.modules():
+        if isinstance( module, Detect ):
+            module.inplace = False
+            module.onnx_dynamic = False
+
+    model_path.parent.mkdir( parents= True, exist_ok= True )
+
+    # Written next to the final path first, so an interrupted export is not mistaken for a graph
+    partial_path = model_path.with_suffix('.partial')
+
+    torch.onnx.export(
+        net,
+        torch.zeros( ( 1, 3, input_size[1], input_size[0] ) ),
+        str( partial_path ),
+        opset_version= 14,
+        input_names= [ 'images' ],
+        output_names= [ 'blk', 'seg', 'det' ],
+        # Batches of tiles share a graph
+        dynamic_axes= { 'images': { 0: 'batch' }, 'blk': { 0: 'batch' }, 'seg': { 0: 'batch' }, 'det': { 0: 'batch' } }
+    )
+
+    os.replace( partial_path, model_path )
+
+def use_onnx_text_detector( text_detector ):
+
+    # Swaps the torch network of a comic_text_detector TextDetector for an ONNX Runtime session
+    width, height = text_detector.input_size
+    model_path = get_onnx_models_path() / 'comic_text_detector' / f'comictextdetector_{width}x{height}.onnx'
+
+    if not model_path.exists():
+        with torch.no_grad():
+            export_text_detector( text_detector.net.eval(), ( width, height ), model_path )
+
+    text_detector.net = OnnxTextDetNet( model_path )
@@ -0,0 +1,127 @@
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterator, Tuple
+import numpy as np
+from PIL import Image
+from ocr_service_pb2 import RecognizeDefaultResponse
+
+LineKey = Tuple[ str, int ] # Result id, line index
+
+
+class PartialRecognition:
+
+    # Detection results waiting for RecognizeSelective.
+    # Only the crops of the lines still to be recognized are kept, not the whole frame.
+
+    partial_response: RecognizeDefaultResponse
+    line_images: Dict[ LineKey, Image.Image | np.ndarray ]
+    recognized_lines: Dict[ LineKey, str ] # Recognized ahead of time, in the background
+    created_at: float
+    nbytes: int
+
+    def __init__(
+        self,
+        partial_response: RecognizeDefaultResponse,
+        line_images: Dict[ LineKey, Image.Image | np.ndarray ] = {},
+        recognized_lines: Dict[ LineKey, str ] = {}
+    ):
+        self.partial_response = partial_response
+        self.line_images = dict( line_images )
+        self.recognized_lines = dict( recognized_lines )
+        self.created_at = time.monotonic()
+        self.nbytes = sum( image_nbytes( line_image ) for line_image in self.line_images.values() )
+
+
+def image_nbytes( image: Image.Image | np.ndarray ) -> int:
+    if isinstance( image, np.ndarray ):
+        return image.nbytes
+    return image.width * image.height * len( image.getbands() )
+
+
+class UpdateLock:
+
+    __slots__ = ( 'lock', 'users' )
+
+    def __init__( self ):
+        self.lock = threading.Lock()
+        self.users = 0
+
+
+class PartialRecognitionStore:
+
+    # Bounded by entry count, total crop bytes and entry age; oldest entries go first
+
+    def __init__( self, max_entries: int = 20, max_bytes: int = 64 * 1024 * 1024, max_age_seconds: float = 300 ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.recognitions: OrderedDict[ str, PartialRecognition ] = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.update_locks: Dict[ str, UpdateLock ] = {}
+
+    def add( self, recognition: PartialRecognition ):
+
+        id = recognition.partial_response.id
+
+        with self.lock:
+            self.remove( id )
+
+            self.recognitions[ id ] = recognition
+            self.bytes += recognition.nbytes
+
+            self.evict()
+
+    @contextmanager
+    def updating( self, id: str ) -> Iterator[ None ]:
+
+        # RecognizeSelective and the background recognition both read a recognition, recognize
+        # some of its lines and write it back; one at a time, so neither redoes or overwrites the other
+        with self.lock:
+            update_lock = self.update_locks.setdefault( id, UpdateLock() )
+            update_lock.users += 1
+
+        try:
+            with update_lock.lock:
+                yield
+        finally:
+            with self.lock:
+                update_lock.users -= 1
+                if update_lock.users == 0:
+                    del self.update_locks[ id ]
+
+    def get( self, id: str ) -> PartialRecognition | None:
+
+        with self.lock:
+            self.evict()
+            return self.recognitions.get( id )
+
+    def evict( self ):
+
+        expiration_time = time.monotonic() - self.max_age_seconds
+
+        while self.recognitions:
+            oldest_id, oldest = next( iter( self.recognitions.items() ) )
+
+            if (
+                len(self.recognitions) <= self.max_entries and
+                self.bytes <= self.max_bytes and
+                oldest.created_at >= expiration_time
+            ):
+                break
+
+            self.remove( oldest_id )
+
+    def remove( self, id: str ):
+        recognition = self.recognitions.pop( id, None )
+        if recognition:
+            self.bytes -= recognition.nbytes
+
+    def memory_usage( self ) -> Dict[ str, int ]:
+        with self.lock:
+            return {
+                'entries': len(self.recognitions),
+                'bytes': self.bytes,
+            }
@@ -0,0 +1,44 @@
+import os
+from pathlib import Path
+import torch
+
+# INT8 variant of the recognition model: dynamic quantization of the linear layers,
+# which hold most of the encoder and decoder weights. CPU only.
+# Experimental, and only used when installed as such, until its accuracy and latency against
+# the original model are measured (benchmarks/quantization_benchmark.py).
+
+QUANTIZED_VARIANT = 'int8-experimental'
+MODEL_VARIANTS = ( '', QUANTIZED_VARIANT ) # '' is the original fp32 model
+
+
+def quantized_model_path( model_dir: str | Path ) -> Path:
+    return Path( model_dir ) / 'manga_ocr_int8.pt'
+
+def quantize_model( model: torch.nn.Module ) -> torch.nn.Module:
+    return torch.ao.quantization.quantize_dynamic(
+        model.cpu().eval(),
+        { torch.nn.Linear },
+        dtype= torch.qint8
+    )
+
+def load_quantized_model( model: torch.nn.Module, cache_path: Path ) -> torch.nn.Module:
+
+    # The cache only holds the quantized weights, loaded into the model rebuilt by quantize_model.
+    # Never unpickled as a whole model: the models directory is writable by the user.
+    if cache_path.exists():
+        try:
+            quantized_model = quantize_model( model )
+            quantized_model.load_state_dict( torch.load( cache_path, weights_only= True ) )
+            return quantized_model
+        except Exception as error:
+            # Saved by a different torch or transformers version, or as a whole model by an older release
+            print(error)
+
+    quantized_model = quantize_model( model )
+
+    cache_path.parent.mkdir( parents= True, exist_ok= True )
+    partial_path = cache_path.with_suffix('.partial')
+    torch.save( quantized_model.state_dict(), partial_path )
+    os.replace( partial_path, cache_path )
+
+    return quantized_model
@@ -0,0 +1,137 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+from pathlib import Path
+import numpy as np
+import torch
+from manga_ocr import MangaOcr
+from manga_ocr.ocr import post_process
+from PIL import Image
+from .quantization import QUANTIZED_VARIANT, load_quantized_model
+
+worker_manga_ocr: MangaOcr = None # Model of the current worker process
+
+
+@torch.inference_mode()
+def recognize_batch( manga_ocr: MangaOcr, line_images: List[ np.ndarray | Image.Image ] ) -> List[ str ]:
+
+    pixel_values = preprocess_line_images( manga_ocr.processor, line_images )
+
+    token_ids = manga_ocr.model.generate(
+        pixel_values.to( manga_ocr.model.device ),
+        max_length= 300
+    ).cpu()
+
+    texts = manga_ocr.tokenizer.batch_decode( token_ids, skip_special_tokens=True )
+
+    return [ post_process( text ) for text in texts ]
+
+
+def preprocess_line_images( processor, line_images: List[ np.ndarray | Image.Image ] ) -> torch.Tensor:
+
+    # MangaOcr.__call__'s preprocessing (grayscale, then the ViTImageProcessor resize, rescale and normalization)
+    # on grayscale arrays, for the whole batch at once and without the RGB round trip.
+    # Gives the processor's pixel values exactly; checked by benchmarks/preprocessing_parity_benchmark.py
+    width, height = processor.size['width'], processor.size['height']
+
+    resized = np.stack([
+        resize_line_image( to_line_grayscale( line_image ), width, height, processor.resample )
+        for line_image in line_images
+    ])
+
+    mean = np.array( processor.image_mean, dtype=np.float32 )[ None, :, None, None ]
+    std = np.array( processor.image_std, dtype=np.float32 )[ None, :, None, None ]
+
+    # Rescaled in float64 like the processor, and the grayscale channel repeated for the 3 input channels
+    rescaled = ( resized * processor.rescale_factor ).astype( np.float32 )
+    pixel_values = ( rescaled[ :, None ] - mean ) / std
+
+    return torch.from_numpy( np.ascontiguousarray( pixel_values, dtype=np.float32 ) )
+
+def to_line_grayscale( line_image: np.ndarray | Image.Image ) -> np.ndarray:
+
+    # PIL's conversion, as MangaOcr does; OpenCV's weights are a level off on some colors.
+    # Done on each crop rather than on the whole image, so it stays cheap.
+    if isinstance( line_image, Image.Image ):
+        return np.asarray( line_image.convert('L') )
+
+    if line_image.ndim == 2:
+        return line_image
+
+    # The same fixed point weights and rounding as PIL, without a PIL image (alpha is ignored)
+    rgb = line_image[ ..., :3 ].astype( np.uint32 )
+    gray = ( rgb[ ..., 0 ] * 19595 + rgb[ ..., 1 ] * 38470 + rgb[ ..., 2 ] * 7471 + 0x8000 ) >> 16
+
+    return gray.astype( np.uint8 )
+
+def resize_line_image( gray: np.ndarray, width: int, height: int, resample: int ) -> np.ndarray:
+    # With PIL, like the processor: OpenCV has no exact equivalent of its antialiased filters,
+    # and lines are almost always shrunk along one axis. Cheap on a single uint8 channel.
+    return np.asarray( Image.fromarray( gray ).resize( ( width, height ), resample= resample ) )
+
+
+def load_manga_ocr(
+    model_name_or_path: str,
+    backend: str = 'Torch',
+    variant: str = '',
+    quantized_model_path: Path = None
+) -> MangaOcr:
+
+    # The INT8 variant is a torch model; ONNX Runtime uses the original weights
+    if backend == 'ONNX':
+        from .onnx_backend import OnnxMangaOcr
+        return OnnxMangaOcr( model_name_or_path )
+
+    manga_ocr = MangaOcr( model_name_or_path )
+
+    if variant == QUANTIZED_VARIANT:
+        manga_ocr.model = load_quantized_model( manga_ocr.model, quantized_model_path )
+
+    return manga_ocr
+
+
+def init_worker( torch_threads: int, *recognizer_args ):
+    global worker_manga_ocr
+    torch.set_num_threads( torch_threads )
+    worker_manga_ocr = load_manga_ocr( *recognizer_args )
+
+def recognize_in_worker( line_images: List[ np.ndarray ] ) -> List[ str ]:
+    return recognize_batch( worker_manga_ocr, line_images )
+
+def worker_ready() -> bool:
+    return worker_manga_ocr is not None
+
+
+class RecognitionWorkerPool:
+
+    # Worker processes with a model each, recognizing batches of line crops in parallel.
+    # The torch threads are split between them, so they don't compete for the same cores.
+
+    def __init__( self, workers: int, *recognizer_args ):
+        # recognizer_args are the arguments of load_manga_ocr
+        self.workers = workers
+
+        self.executor = ProcessPoolExecutor(
+            max_workers= workers,
+            # Forked while the service is still single threaded; spawn would need freeze_support in packaged builds
+            mp_context= multiprocessing.get_context('fork'),
+            initializer= init_worker,
+            initargs= ( max( 1, ( os.cpu_count() or 1 ) // workers ), *recognizer_args )
+        )
+
+        # Forked workers are all started by the first submission, so this happens now and not
+        # later, once the gRPC threads are running. Models load in the background.
+        self.executor.submit( worker_ready )
+
+    def recognize( self, batches: List[ List[ np.ndarray ] ] ) -> List[ List[ str ] ]:
+
+        futures = [
+            self.executor.submit( recognize_in_worker, batch )
+            for batch in batches
+        ]
+
+        return [ future.result() for future in futures ]
+
+    def shutdown( self ):
+        self.executor.shutdown( cancel_futures= True )
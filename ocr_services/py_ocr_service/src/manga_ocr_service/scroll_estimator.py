@@ -0,0 +1,137 @@
+from typing import Dict, List, Tuple
+import cv2
+import numpy as np
+from frame_input.frame_input import resize_to_grayscale
+
+
+class ScrollEstimator:
+
+    # Estimates how far the content of a frame moved since a previous frame,
+    # using phase correlation on small grayscale thumbnails, and which parts of
+    # the overlapping content changed besides moving (like new dialogue in the same box)
+
+    thumbnail_size = 512 # Long side
+    min_confidence = 0.2 # Phase correlation peak
+    tile_size = 16 # Thumbnail pixels
+    pixel_difference = 40 # 0-255; smaller differences are resampling noise
+    min_tile_changed_fraction = 0.02 # Of the pixels of a tile, for the tile to count as changed
+    max_changed_tiles_fraction = 0.5 # Of the overlap's tiles; above this it isn't a scroll
+
+    def __init__( self ):
+        self.windows: Dict[ Tuple[int, int], np.ndarray ] = {}
+
+    def thumbnail( self, image: np.ndarray ) -> np.ndarray:
+
+        height, width = image.shape[:2]
+        scale = min( 1, self.thumbnail_size / max( width, height ) )
+        size = ( max( 1, round( width * scale ) ), max( 1, round( height * scale ) ) )
+
+        return resize_to_grayscale( image, size )
+
+    def estimate(
+        self,
+        previous: np.ndarray,
+        current: np.ndarray,
+        frame_size: Tuple[int, int] # width, height
+    ) -> Tuple[ Tuple[int, int], List[ Tuple[int, int, int, int] ] ] | None:
+
+        # Returns the ( dx, dy ) shift in frame pixels with the rects ( left, top, right, bottom ), in frame pixels,
+        # that changed within the overlap, or None when the frames aren't a translation of each other
+        if previous.shape != current.shape:
+            return None
+
+        height, width = current.shape
+
+        ( shift_x, shift_y ), confidence = cv2.phaseCorrelate(
+            previous.astype( np.float32 ),
+            current.astype( np.float32 ),
+            self.window( ( width, height ) )
+        )
+
+        if confidence < self.min_confidence:
+            return None
+
+        dx = int( round(shift_x) )
+        dy = int( round(shift_y) )
+
+        if abs(dx) >= width or abs(dy) >= height:
+            return None
+
+        # The peak only says where the best match is, not that the rest of the frame matches too.
+        # The previous thumbnail is moved by the subpixel shift, so glyph edges line up and only real changes remain.
+        aligned = cv2.warpAffine(
+            previous,
+            np.float32([ [ 1, 0, shift_x ], [ 0, 1, shift_y ] ]),
+            ( width, height ),
+            flags= cv2.INTER_LINEAR
+        )
+
+        # Overlap in current thumbnail pixels, without the interpolated border
+        left = max( 0, dx ) + 1
+        top = max( 0, dy ) + 1
+        right = width + min( 0, dx ) - 1
+        bottom = height + min( 0, dy ) - 1
+
+        if right <= left or bottom <= top:
+            return None
+
+        # Slightly blurred, as thin strokes alias differently at each subpixel position of the thumbnail
+        difference = cv2.absdiff(
+            cv2.GaussianBlur( aligned[ top:bottom, left:right ], ( 3, 3 ), 0 ),
+            cv2.GaussianBlur( current[ top:bottom, left:right ], ( 3, 3 ), 0 )
+        )
+
+        changed_tiles = self.changed_tiles( difference )
+
+        if changed_tiles.mean() > self.max_changed_tiles_fraction:
+            return None
+
+        frame_width, frame_height = frame_size
+        scale_x = frame_width / width
+        scale_y = frame_height / height
+
+        changed_rects: List[ Tuple[int, int, int, int] ] = []
+
+        for row, column in zip( *np.nonzero( changed_tiles ) ):
+            tile_left = left + column * self.tile_size
+            tile_top = top + row * self.tile_size
+            tile_right = min( right, tile_left + self.tile_size )
+            tile_bottom = min( bottom, tile_top + self.tile_size )
+
+            changed_rects.append((
+                int( tile_left * scale_x ),
+                int( tile_top * scale_y ),
+                min( frame_width, int( np.ceil( tile_right * scale_x ) ) ),
+                min( frame_height, int( np.ceil( tile_bottom * scale_y ) ) )
+            ))
+
+        shift = (
+            int( round( shift_x * scale_x ) ),
+            int( round( shift_y * scale_y ) )
+        )
+
+        return shift, changed_rects
+
+    def changed_tiles( self, difference: np.ndarray ) -> np.ndarray:
+
+        # Boolean grid of the tiles where enough pixels differ
+        height, width = difference.shape
+        rows = -( -height // self.tile_size )
+        columns = -( -width // self.tile_size )
+
+        changed = np.zeros( ( rows * self.tile_size, columns * self.tile_size ), dtype=np.float32 )
+        changed[ :height, :width ] = difference > self.pixel_difference
+
+        covered = np.zeros_like( changed )
+        covered[ :height, :width ] = 1
+
+        tile_shape = ( rows, self.tile_size, columns, self.tile_size )
+        changed_pixels = changed.reshape( tile_shape ).sum( axis=( 1, 3 ) )
+        tile_pixels = covered.reshape( tile_shape ).sum( axis=( 1, 3 ) )
+
+        return changed_pixels > tile_pixels * self.min_tile_changed_fraction
+
+    def window( self, size: Tuple[int, int] ) -> np.ndarray:
+        if size not in self.windows:
+            self.windows[ size ] = cv2.createHanningWindow( size, cv2.CV_32F )
+        return self.windows[ size ]
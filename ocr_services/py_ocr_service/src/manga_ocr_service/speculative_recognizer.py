@@ -0,0 +1,91 @@
+import time
+import queue
+import threading
+from collections import OrderedDict
+from typing import Callable, Tuple
+from ocr_service_pb2 import Vertex
+
+SPECULATIVE_ORDERS = ( 'reading_order', 'size', 'hint' )
+
+
+class SpeculativeRecognizer:
+
+    # Runs the recognition of detection_only responses on a background thread, one job at a time.
+    # Every request of a source starts a new generation, which cancels the jobs of the older ones.
+    # Requests without a source_id are never cancelled, as they can come from unrelated clients.
+    # Sources are dropped, least recently used first, above max_sources or after max_age_seconds.
+
+    def __init__(
+        self,
+        work: Callable[ [ str, Vertex | None, Callable[ [], bool ] ], None ],
+        max_sources: int = 64,
+        max_age_seconds: float = 300
+    ):
+        self.work = work # request_id, priority_point, is_cancelled
+        self.max_sources = max_sources
+        self.max_age_seconds = max_age_seconds
+        self.generations: OrderedDict[ str, Tuple[ int, float ] ] = OrderedDict() # source_id -> generation, last seen
+        self.jobs: queue.Queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread: threading.Thread = None
+
+    def begin( self, source_id: str ) -> int:
+
+        if not source_id:
+            return 0
+
+        with self.lock:
+            generation, _ = self.generations.pop( source_id, ( 0, 0 ) )
+            self.generations[ source_id ] = ( generation + 1, time.monotonic() )
+            self.evict()
+            return generation + 1
+
+    def is_current( self, source_id: str, generation: int ) -> bool:
+
+        if not source_id:
+            return True
+
+        with self.lock:
+            current, _ = self.generations.get( source_id, ( None, 0 ) )
+            return current == generation
+
+    def evict( self ):
+
+        # Called with the lock held
+        expiration_time = time.monotonic() - self.max_age_seconds
+
+        while self.generations:
+            _, ( _, last_seen ) = next( iter( self.generations.items() ) )
+
+            if len(self.generations) <= self.max_sources and last_seen >= expiration_time:
+                break
+
+            self.generations.popitem( last= False )
+
+    def submit( self, source_id: str, generation: int, request_id: str, priority_point: Vertex = None ):
+
+        # A newer request may have arrived while this one was being answered
+        if not self.is_current( source_id, generation ):
+            return
+
+        with self.lock:
+            if not self.thread:
+                self.thread = threading.Thread( target= self.run, daemon= True )
+                self.thread.start()
+
+        self.jobs.put( ( source_id, generation, request_id, priority_point ) )
+
+    def run( self ):
+
+        while True:
+            source_id, generation, request_id, priority_point = self.jobs.get()
+
+            is_cancelled = lambda: not self.is_current( source_id, generation )
+
+            if is_cancelled():
+                continue
+
+            try:
+                self.work( request_id, priority_point, is_cancelled )
+            except Exception as error:
+                print(error)
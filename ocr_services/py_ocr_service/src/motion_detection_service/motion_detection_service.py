@@ -1,22 +1,241 @@
-from typing import List, Dict
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import List, Dict, Iterator, Set, Tuple
 from PIL import Image
 import cv2
 import numpy as np
-from ocr_service_pb2 import MotionDetectionResponse
+from ocr_service_pb2 import MotionDetectionResponse, Box, Vertex
+from frame_input.frame_input import resize_to_grayscale
+from service_settings import get_int_setting, get_float_setting
+
+BACKGROUND_MODES = ( 'median', 'running_average' )
+
+
+def sorting_network( size: int ) -> List[ Tuple[int, int] ]:
+    # Batcher's odd-even merge sort, valid for any size
+    comparators = []
+    p = 1
+    while p < size:
+        k = p
+        while k >= 1:
+            for j in range( k % p, size - k, 2 * k ):
+                for i in range( min( k, size - j - k ) ):
+                    if ( i + j ) // ( 2 * p ) == ( i + j + k ) // ( 2 * p ):
+                        comparators.append( ( i + j, i + j + k ) )
+            k //= 2
+        p *= 2
+    return comparators
+
+def median_network( size: int ) -> List[ Tuple[int, int] ]:
+    # Keeps only the comparators that can affect the middle position(s)
+    needed = { ( size - 1 ) // 2, size // 2 }
+    comparators = []
+    for low, high in reversed( sorting_network( size ) ):
+        if low in needed or high in needed:
+            comparators.append( ( low, high ) )
+            needed.update( ( low, high ) )
+    comparators.reverse()
+    return comparators
+
+
+class MedianScratch:
+
+    # Working buffers of the median, shared by the streams of a service instead of held by each stream.
+    # A set is taken by one median at a time, so concurrent medians get their own sets,
+    # and the idle ones are kept for the shapes the streams still use. Counted in the streams budget.
+
+    def __init__( self ):
+        self.lock = threading.Lock()
+        self.idle: Dict[ Tuple[int, int], List[ Tuple[ np.ndarray, np.ndarray, np.ndarray ] ] ] = {}
+        self.nbytes = 0 # Idle and taken sets
+
+    @contextmanager
+    def take( self, shape: Tuple[int, int], count: int ) -> Iterator[ Tuple[ np.ndarray, np.ndarray, np.ndarray ] ]: # sorted frames, swap plane, middle sum
+
+        buffers = None
+
+        with self.lock:
+            idle = self.idle.get( shape, [] )
+
+            while idle and buffers is None:
+                buffers = idle.pop()
+
+                # Too short for this stream
+                if len( buffers[0] ) < count:
+                    self.nbytes -= self.size( buffers )
+                    buffers = None
+
+        if buffers is None:
+            buffers = (
+                np.empty( ( count, *shape ), dtype=np.uint8 ),
+                np.empty( shape, dtype=np.uint8 ),
+                np.empty( shape, dtype=np.uint16 )
+            )
+            with self.lock:
+                self.nbytes += self.size( buffers )
+
+        try:
+            yield buffers
+        finally:
+            with self.lock:
+                self.idle.setdefault( shape, [] ).append( buffers )
+
+    def retain( self, shapes: Set[ Tuple[int, int] ] ):
+
+        # Drops the idle sets of the other shapes
+        with self.lock:
+            for shape in list( self.idle ):
+                if shape not in shapes:
+                    self.nbytes -= sum( self.size( buffers ) for buffers in self.idle.pop( shape ) )
+
+    @staticmethod
+    def size( buffers: Tuple[ np.ndarray, ... ] ) -> int:
+        return sum( array.nbytes for array in buffers )
+
+
+class BackgroundModel:
+
+    # The state of a stream: preallocated ring buffer with its latest frames and when it was last used.
+    # "median" sorts the buffered frames pixel-wise with a min/max network,
+    # "running_average" keeps an exponential average and has no ring.
+
+    __slots__ = (
+        'shape', 'mode', 'length', 'frames', 'count', 'next_index', 'background', 'accumulator', 'last_seen'
+    )
+
+    median_networks: Dict[ int, List[ Tuple[int, int] ] ] = {}
+
+    def __init__( self, shape: Tuple[int, int], length: int, mode: str = 'median' ):
+        self.shape = shape
+        self.mode = mode
+        self.length = length
+        self.frames: np.ndarray = None
+        self.count = 0
+        self.next_index = 0
+        self.background = np.empty( shape, dtype=np.uint8 )
+        self.accumulator: np.ndarray = None
+        self.last_seen = time.monotonic()
+
+        if mode != 'running_average':
+            self.frames = np.empty( ( length, *shape ), dtype=np.uint8 )
+
+    @property
+    def nbytes( self ) -> int:
+        return sum(
+            array.nbytes
+            for array in ( self.frames, self.background, self.accumulator )
+            if array is not None
+        )
+
+    def add( self, frame: np.ndarray ):
+
+        if self.mode == 'running_average':
+            if self.accumulator is None:
+                self.accumulator = frame.astype( np.float32 )
+            else:
+                cv2.accumulateWeighted( frame, self.accumulator, 1 / self.length )
+
+        else:
+            self.frames[ self.next_index ] = frame
+            self.next_index = ( self.next_index + 1 ) % self.length
+
+        self.count = min( self.count + 1, self.length )
+
+    def estimate( self, scratch: MedianScratch ) -> np.ndarray:
+
+        if self.mode == 'running_average':
+            return cv2.convertScaleAbs( self.accumulator, dst= self.background )
+
+        with scratch.take( self.shape, self.length ) as buffers:
+            return self.median( *buffers )
+
+    def median( self, sorted_frames: np.ndarray, swap_plane: np.ndarray, middle_sum: np.ndarray ) -> np.ndarray:
+
+        # Until the ring wraps around the filled slots are the first "count" ones
+        if self.count == 1:
+            return self.frames[0]
+
+        planes = sorted_frames[ :self.count ]
+        np.copyto( planes, self.frames[ :self.count ] )
+
+        for low, high in self.getMedianNetwork( self.count ):
+            np.minimum( planes[low], planes[high], out= swap_plane )
+            np.maximum( planes[low], planes[high], out= planes[high] )
+            np.copyto( planes[low], swap_plane )
+
+        middle = self.count // 2
+
+        # Copied out, as the scratch buffers are reused by the next stream
+        if self.count % 2:
+            np.copyto( self.background, planes[ middle ] )
+            return self.background
+
+        # Same rounding as np.median( ... ).astype( np.uint8 )
+        np.add( planes[ middle - 1 ], planes[ middle ], out= middle_sum, dtype= np.uint16 )
+        np.right_shift( middle_sum, 1, out= middle_sum )
+        np.copyto( self.background, middle_sum, casting= 'unsafe' )
+
+        return self.background
+
+    def resize( self, length: int ):
+
+        if length == self.length:
+            return
+
+        if self.frames is None:
+            self.length = length
+            return
+
+        # Keep the most recent frames, oldest first
+        kept = min( self.count, length )
+        order = [ ( self.next_index - kept + idx ) % self.length for idx in range( kept ) ]
+
+        frames = np.empty( ( length, *self.shape ), dtype=np.uint8 )
+        frames[ :kept ] = self.frames[ order ]
+
+        self.frames = frames
+        self.length = length
+        self.count = kept
+        self.next_index = kept % length
+
+    @classmethod
+    def getMedianNetwork( cls, size: int ) -> List[ Tuple[int, int] ]:
+        if size not in cls.median_networks:
+            cls.median_networks[ size ] = median_network( size )
+        return cls.median_networks[ size ]
+
 
 class MotionDetectionService:
 
-    streams: Dict[ str, List[any] ] = {} # List[ Matlike ]
     scaling_factor = 0.9
 
+    # Changed regions
+    region_dilation_size = 15 # Joins nearby changed pixels, like the glyphs of a text box
+    region_min_area = 16
+    max_changed_regions = 16 # Above this, a single region covering every change is returned
+
+    def __init__( self ):
+        # Least recently used first. Streams that stop sending frames are dropped after a while,
+        # and the oldest ones as well while all of them together take more than the budget.
+        self.streams: OrderedDict[ str, BackgroundModel ] = OrderedDict()
+        self.streams_lock = threading.Lock()
+        self.stream_idle_seconds = get_float_setting( 'MOTION_STREAM_IDLE_SECONDS', 300 )
+        self.streams_max_bytes = get_int_setting( 'MOTION_STREAMS_MEMORY_MB', 256 ) * 1024 * 1024
+        self.median_scratch = MedianScratch()
+
     def detect(
         self,
         stream_id: str,
-        frame: Image.Image,
+        frame: Image.Image | np.ndarray,
         threshold_min: int = 127,
         threshold_max: int = 255,
         stream_length: int = 5,
-        clear_previous_frames= False
+        clear_previous_frames= False,
+        background_mode: str = 'median',
+        pixel_format: str = 'RGB',
+        return_changed_regions: bool = False
     ) -> MotionDetectionResponse :
         
         result = MotionDetectionResponse(
@@ -27,23 +246,24 @@ class MotionDetectionService:
         if clear_previous_frames:
             self.deleteStream( stream_id )
 
-        next_frame = self.preprocessFrame( frame )
+        if background_mode not in BACKGROUND_MODES:
+            background_mode = 'median'
+
+        stream_length = max( 1, stream_length )
+
+        next_frame = self.preprocessFrame( frame, pixel_format )
 
         stream = self.getStream( stream_id )
 
-        if len(stream) and next_frame.shape != self.getStreamShape( stream_id ):
+        if stream and ( next_frame.shape != stream.shape or background_mode != stream.mode ):
             self.deleteStream( stream_id )
             return result
 
-        if not stream or not len(stream):
-            self.updateStream( stream_id, next_frame )
+        if not stream:
+            self.updateStream( stream_id, next_frame, stream_length, background_mode )
             return result
 
-        background_frame = self.medianImage( stream )
-
-        # if background_frame.shape != next_frame.shape:
-        #     self.deleteStream( stream_id )
-        #     return result
+        background_frame = stream.estimate( self.median_scratch )
 
         frame_difference = self.frameDiff( background_frame, next_frame )
 
@@ -56,55 +276,148 @@ class MotionDetectionService:
         #cv2.imshow("Previous", prev_frame)
         #cv2.imshow("Next", next_frame)
 
-        self.updateStream( stream_id, next_frame )
-
-        while len(stream) > stream_length:
-            stream.pop(0)
+        self.updateStream( stream_id, next_frame, stream_length, background_mode )
 
         result.frame_diff_sum = frame_difference.sum()
         result.frame_threshold_non_zero_count = cv2.countNonZero(frame_th)
 
+        if return_changed_regions:
+            result.changed_regions.extend(
+                self.changedRegions( frame_difference, threshold_min, self.frameSize( frame ) )
+            )
+
         return result # cv2.countNonZero(frame_th) # frame_th.sum() #frame_difference.sum()
 
-    def preprocessFrame( self, frame: Image.Image ): # Matlike
+    def preprocessFrame( self, frame: Image.Image | np.ndarray, pixel_format: str = 'RGB' ): # Matlike
+
+        width, height = self.frameSize( frame )
 
-        frame = cv2.resize(
-            np.array(frame),
-            None,
-            fx= self.scaling_factor,
-            fy= self.scaling_factor,
-            interpolation= cv2.INTER_AREA
+        return resize_to_grayscale(
+            frame,
+            ( round( width * self.scaling_factor ), round( height * self.scaling_factor ) ),
+            pixel_format
         )
-    
-        return cv2.cvtColor( frame, cv2.COLOR_RGB2GRAY )
+
+    def changedRegions(
+        self,
+        frame_difference: np.ndarray,
+        threshold_min: int,
+        frame_size: tuple[int, int] # width, height
+    ) -> List[ Box ]:
+
+        # Independent of threshold_max, which can be 0 when the client only reads frame_diff_sum
+        mask = cv2.compare( frame_difference, threshold_min, cv2.CMP_GT )
+
+        mask = cv2.dilate(
+            mask,
+            cv2.getStructuringElement( cv2.MORPH_RECT, ( self.region_dilation_size, self.region_dilation_size ) )
+        )
+
+        count, _, stats, _ = cv2.connectedComponentsWithStats( mask, connectivity= 8 )
+
+        # Label 0 is the unchanged background
+        rects = [
+            stats[ label, :4 ]
+            for label in range( 1, count )
+            if stats[ label, cv2.CC_STAT_AREA ] >= self.region_min_area
+        ]
+
+        if len(rects) > self.max_changed_regions:
+            x0 = min( rect[0] for rect in rects )
+            y0 = min( rect[1] for rect in rects )
+            x1 = max( rect[0] + rect[2] for rect in rects )
+            y1 = max( rect[1] + rect[3] for rect in rects )
+            rects = [ ( x0, y0, x1 - x0, y1 - y0 ) ]
+
+        # Back to the coordinates of the frame the client sent
+        width, height = frame_size
+        scale_x = width / frame_difference.shape[1]
+        scale_y = height / frame_difference.shape[0]
+
+        regions: List[ Box ] = []
+
+        for x, y, w, h in rects:
+            left = max( 0, int( x * scale_x ) )
+            top = max( 0, int( y * scale_y ) )
+            right = min( width, int( np.ceil( ( x + w ) * scale_x ) ) )
+            bottom = min( height, int( np.ceil( ( y + h ) * scale_y ) ) )
+
+            regions.append(
+                Box(
+                    top_left= Vertex( x=left, y=top ),
+                    top_right= Vertex( x=right, y=top ),
+                    bottom_right= Vertex( x=right, y=bottom ),
+                    bottom_left= Vertex( x=left, y=bottom )
+                )
+            )
+
+        return regions
+
+    def frameSize( self, frame: Image.Image | np.ndarray ) -> tuple[int, int]: # width, height
+        if isinstance( frame, Image.Image ):
+            return frame.size
+        return frame.shape[1], frame.shape[0]
 
     def frameDiff( self, prev_frame, next_frame ):
         return cv2.absdiff( prev_frame, next_frame )
     
-    def medianImage( self, images ):
-        stacked_images = np.stack( images, axis=0 )
-        return np.median( stacked_images, axis=0 ).astype(np.uint8)
-    
-    def getStream(self, stream_id: str) -> List[ any ] :
-        if not self.streamExists(stream_id):
-            return []
-        return self.streams[stream_id]
+    def getStream(self, stream_id: str) -> BackgroundModel | None :
+        with self.streams_lock:
+            return self.streams.get( stream_id )
     
-    def updateStream(self, stream_id: str, new_frame):
-        if not self.streamExists( stream_id ):
-            self.streams[stream_id] = [ new_frame ]
-            return
-        self.streams[stream_id].append( new_frame )
+    def updateStream(self, stream_id: str, new_frame, stream_length: int = 5, background_mode: str = 'median'):
+
+        with self.streams_lock:
+            stream = self.streams.get( stream_id )
+
+            if not stream:
+                stream = BackgroundModel( new_frame.shape, stream_length, background_mode )
+                self.streams[stream_id] = stream
+
+            stream.last_seen = time.monotonic()
+            self.streams.move_to_end( stream_id )
+
+            self.evictStreams()
+
+        stream.resize( stream_length )
+        stream.add( new_frame )
+
+    def evictStreams( self ):
+
+        # Called with the lock held; the stream in use, which is the most recent one, is kept
+        expiration_time = time.monotonic() - self.stream_idle_seconds
+        streams_bytes = self.streamsBytes()
+
+        while len(self.streams) > 1:
+            oldest_id, oldest = next( iter( self.streams.items() ) )
+
+            if oldest.last_seen >= expiration_time and streams_bytes <= self.streams_max_bytes:
+                break
+
+            del self.streams[ oldest_id ]
+            self.median_scratch.retain( { stream.shape for stream in self.streams.values() } )
+            streams_bytes = self.streamsBytes()
+
+    def streamsBytes( self ) -> int:
+        # Called with the lock held
+        return sum( stream.nbytes for stream in self.streams.values() ) + self.median_scratch.nbytes
 
     def deleteStream(self, stream_id):
-        if not self.streamExists( stream_id ):
-            return
-        del self.streams[stream_id]
-        # self.streams[stream_id] = []
+        with self.streams_lock:
+            self.streams.pop( stream_id, None )
+            self.median_scratch.retain( { stream.shape for stream in self.streams.values() } )
+
+    def memoryUsage( self ) -> Dict[ str, int ]:
+        with self.streams_lock:
+            return {
+                'streams': len(self.streams),
+                'bytes': self.streamsBytes(),
+            }
 
     def streamExists(self, stream_id: str) -> bool:
-        return stream_id in self.streams
+        with self.streams_lock:
+            return stream_id in self.streams
     
     def getStreamShape(self, stream_id: str) -> tuple[int, int]: # height, width
         stream = self.getStream( stream_id )
-        return stream[0].shape
\ No newline at end of file
+        return stream.shape
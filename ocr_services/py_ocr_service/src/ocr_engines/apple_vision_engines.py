@@ -0,0 +1,45 @@
+from typing import List
+import numpy as np
+from PIL import Image
+from concurrent.futures import ProcessPoolExecutor
+from ocr_service_pb2 import RecognizeDefaultResponse
+from .ocr_engine import OcrEngine, results_response, to_pil_image
+
+# macOS only; the Vision and VisionKit bindings are imported when the engine is first used
+
+
+class AppleVisionEngine( OcrEngine ):
+
+    def __init__( self ):
+        from apple_vision_service.apple_vision_service import AppleVisionService
+
+        self.service = AppleVisionService()
+
+    def recognize( self, image: Image.Image | np.ndarray, request ) -> RecognizeDefaultResponse:
+        results = self.service.recognize(
+            to_pil_image( image ),
+            request.language_code
+        )
+        return results_response( image, request.id, results )
+
+    def get_supported_languages( self ) -> List[ str ]:
+        return self.service.getSupportedLanguages()
+
+
+class AppleVisionKitEngine( OcrEngine ):
+
+    def __init__( self, executor: ProcessPoolExecutor = None ):
+        from apple_vision_service.apple_vision_kit_service import AppleVisionKitService
+
+        self.service = AppleVisionKitService( executor )
+        self.service.init_bundle()
+
+    def recognize( self, image: Image.Image | np.ndarray, request ) -> RecognizeDefaultResponse:
+        results = self.service.recognize(
+            to_pil_image( image ),
+            request.language_code
+        )
+        return results_response( image, request.id, results )
+
+    def get_supported_languages( self ) -> List[ str ]:
+        return self.service.get_supported_languages()
@@ -0,0 +1,93 @@
+import threading
+from typing import Callable, Dict, List
+from .ocr_engine import OcrEngine
+
+
+class EngineRegistry:
+
+    # Engines are registered by name with a factory, and only imported and constructed
+    # on first use or when preloaded, so the server can start listening right away
+
+    def __init__( self, on_load: Callable[ [ str, OcrEngine ], None ] = None ):
+        self.on_load = on_load
+        self.factories: Dict[ str, Callable[ [], OcrEngine ] ] = {}
+        self.engines: Dict[ str, OcrEngine ] = {}
+        self.errors: Dict[ str, str ] = {}
+        self.locks: Dict[ str, threading.Lock ] = {}
+
+    def register( self, name: str, factory: Callable[ [], OcrEngine ] ):
+        self.factories[ name ] = factory
+        self.locks[ name ] = threading.Lock()
+
+    def names( self ) -> List[ str ]:
+        return list( self.factories )
+
+    def get( self, name: str ) -> OcrEngine:
+
+        engine = self.engines.get( name )
+
+        if engine:
+            return engine
+
+        if name not in self.factories:
+            raise ValueError(f'{name} is not supported')
+
+        # Other requests for the same engine wait for it to be constructed
+        with self.locks[ name ]:
+
+            if name in self.engines:
+                return self.engines[ name ]
+
+            if name in self.errors:
+                raise ValueError(f'{name} is not available: {self.errors[ name ]}')
+
+            try:
+                engine = self.factories[ name ]()
+            except Exception as error:
+                # Usually a missing dependency; not retried on every request
+                self.errors[ name ] = str(error)
+                raise ValueError(f'{name} is not available: {error}')
+
+            if self.on_load:
+                self.on_load( name, engine )
+
+            self.engines[ name ] = engine
+
+        return engine
+
+    def get_loaded( self, name: str ) -> OcrEngine | None:
+        return self.engines.get( name )
+
+    def preload( self, names: List[ str ] ):
+        for name in names:
+            try:
+                self.get( name )
+            except ValueError as error:
+                print(error)
+
+    def state( self, name: str ) -> str:
+
+        if name in self.engines:
+            return self.engines[ name ].state
+
+        if name in self.errors:
+            return 'FAILED'
+
+        if self.locks[ name ].locked():
+            return 'LOADING'
+
+        return 'NOT_LOADED'
+
+    def load_error( self, name: str ) -> str:
+
+        if name in self.engines:
+            return self.engines[ name ].load_error
+
+        return self.errors.get( name, '' )
+
+    def memory_usage( self, name: str ) -> Dict[ str, int ]:
+
+        if name in self.engines:
+            return self.engines[ name ].get_memory_usage()
+
+        return {}
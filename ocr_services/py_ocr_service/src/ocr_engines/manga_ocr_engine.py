@@ -0,0 +1,139 @@
+from typing import Callable, ContextManager, Dict, Iterator, List
+import numpy as np
+from PIL import Image
+from ocr_service_pb2 import RecognizeDefaultResponse, DetectResponse, TextRecognitionModel, HardwareAccelerationOption
+from .ocr_engine import OcrEngine
+
+
+class MangaOcrEngine( OcrEngine ):
+
+    incremental_results = True
+
+    def __init__( self ):
+        # Imports torch, transformers and the detector; only done when MangaOCR is first used
+        from manga_ocr_service.manga_ocr_service import MangaOcrService
+
+        self.service = MangaOcrService()
+
+        # One request per worker process
+        if self.service.worker_pool:
+            self.max_concurrency = self.service.worker_pool.workers
+
+    @property
+    def state( self ) -> str:
+        return self.service.state
+
+    @property
+    def load_error( self ) -> str:
+        return self.service.load_error
+
+    def warm_up( self ):
+
+        # Loading would download the model first
+        if not self.service.model_catalog.custom_model_exists():
+            print('MangaOCR model is not installed, skipping the warm-up')
+            return
+
+        self.service.ensure_initialized( warm_up= True )
+
+    def recognize( self, image: Image.Image | np.ndarray, request ) -> RecognizeDefaultResponse:
+
+        if request.reference_request_id and request.reuse_scrolled_results:
+            return self.service.recognize_scrolled(
+                image= image,
+                request_id= request.id,
+                reference_request_id= request.reference_request_id,
+            )
+
+        if request.reference_request_id:
+            return self.service.recognize_regions(
+                image= image,
+                request_id= request.id,
+                reference_request_id= request.reference_request_id,
+                changed_regions= request.changed_regions,
+            )
+
+        return self.service.recognize(
+            image= image,
+            request_id= request.id,
+            boxes= request.boxes,
+            detection_only= request.detection_only,
+        )
+
+    def recognize_stream( self, image: Image.Image | np.ndarray, request ) -> Iterator[ RecognizeDefaultResponse ]:
+        yield from self.service.recognize_stream(
+            image= image,
+            request_id= request.id,
+            boxes= request.boxes,
+        )
+
+    def recognize_selective( self, image: Image.Image | None, request ) -> RecognizeDefaultResponse | None:
+        return self.service.recognize_selective(
+            image= image,
+            request_id= request.id,
+            result_ids= request.result_ids
+        )
+
+    def detect( self, image: Image.Image | np.ndarray, request ) -> DetectResponse:
+        return self.service.detect_blocks(
+            image= image,
+            request_id= request.id,
+            crop_format= self.crop_format( request ),
+            crop_quality= request.crop_quality or 90
+        )
+
+    def detect_stream( self, image: Image.Image | np.ndarray, request ) -> Iterator[ DetectResponse ]:
+        yield from self.service.detect_stream(
+            image= image,
+            request_id= request.id,
+            crop_format= self.crop_format( request ),
+            crop_quality= request.crop_quality or 90
+        )
+
+    def crop_format( self, request ) -> str:
+        if not request.crop_image:
+            return ''
+        return request.crop_format.upper() or 'PNG'
+
+    def use_scheduler( self, schedule: Callable[ [], ContextManager[ None ] ] ):
+        self.service.engine_slot = schedule
+
+    def begin_request( self, request ) -> Callable[ [], None ] | None:
+
+        # Cancels the background work of older requests from the same source
+        generation = self.service.begin_request( request.source_id )
+
+        if not request.detection_only:
+            return None
+
+        priority_point = request.priority_point if request.HasField('priority_point') else None
+
+        return lambda: self.service.schedule_speculative_recognition(
+            request_id= request.id,
+            source_id= request.source_id,
+            generation= generation,
+            priority_point= priority_point
+        )
+
+    def reuse_response( self, response: RecognizeDefaultResponse, original_request_id: str ):
+        # Keeps the new id usable as a reference for partial recognitions
+        self.service.add_reused_response( response, original_request_id )
+
+    def get_supported_languages( self ) -> List[ str ]:
+        return [ 'ja-JP' ]
+
+    def get_supported_models( self ) -> List[ TextRecognitionModel ]:
+        return self.service.get_supported_models()
+
+    def install_model( self, name: str ) -> bool:
+        return self.service.install_model( name )
+
+    def get_hardware_acceleration_options( self ) -> List[ HardwareAccelerationOption ]:
+        return self.service.get_hardware_acceleration_options()
+
+    def get_memory_usage( self ) -> Dict[ str, int ]:
+        return {
+            cache: usage['bytes']
+            for cache, usage in self.service.get_memory_usage().items()
+            if 'bytes' in usage
+        }
@@ -0,0 +1,95 @@
+from abc import ABC, abstractmethod
+from typing import Callable, ContextManager, Dict, Iterator, List
+import numpy as np
+from PIL import Image
+from ocr_service_pb2 import Result, RecognizeDefaultResponse, DetectResponse, TextRecognitionModel, HardwareAccelerationOption
+
+
+class OcrEngine( ABC ):
+
+    # What the Service needs from an OCR engine, whatever the service behind it.
+    # Engines implement recognize, and override what else they support;
+    # the rest answers like an unsupported feature.
+
+    incremental_results = False # recognize_stream yields partial responses
+    max_concurrency: int | None = None # Requests run at once; None uses the scheduler default
+
+    @property
+    def state( self ) -> str: # NOT_LOADED | LOADING | WARMING_UP | READY | FAILED
+        return 'READY'
+
+    @property
+    def load_error( self ) -> str:
+        return ''
+
+    def warm_up( self ):
+        pass
+
+    @abstractmethod
+    def recognize( self, image: Image.Image | np.ndarray, request ) -> RecognizeDefaultResponse:
+        ...
+
+    def recognize_stream( self, image: Image.Image | np.ndarray, request ) -> Iterator[ RecognizeDefaultResponse ]:
+        yield self.recognize( image, request )
+
+    def recognize_selective( self, image: Image.Image | None, request ) -> RecognizeDefaultResponse | None:
+        print(f'{request.ocr_engine} does not support selective recognition')
+        return None
+
+    def detect( self, image: Image.Image | np.ndarray, request ) -> DetectResponse:
+        raise ValueError(f'{request.ocr_engine} does not support detection only')
+
+    def detect_stream( self, image: Image.Image | np.ndarray, request ) -> Iterator[ DetectResponse ]:
+        yield self.detect( image, request )
+
+    def use_scheduler( self, schedule: Callable[ [], ContextManager[ None ] ] ):
+        # Background work enters schedule() for each step, to be queued with the engine's requests
+        pass
+
+    def begin_request( self, request ) -> Callable[ [], None ] | None:
+        # Called when a recognition request arrives; returns work to start once its response is sent
+        return None
+
+    def reuse_response( self, response: RecognizeDefaultResponse, original_request_id: str ):
+        # A cached response was sent again, under a new request id
+        pass
+
+    def get_supported_languages( self ) -> List[ str ]:
+        return []
+
+    def get_supported_models( self ) -> List[ TextRecognitionModel ]:
+        return []
+
+    def install_model( self, name: str ) -> bool:
+        return False
+
+    def get_hardware_acceleration_options( self ) -> List[ HardwareAccelerationOption ]:
+        return []
+
+    def get_memory_usage( self ) -> Dict[ str, int ]:
+        # Bytes held by each of the engine's caches
+        return {}
+
+
+def image_size( image: Image.Image | np.ndarray ) -> tuple[int, int]: # width, height
+    if isinstance( image, np.ndarray ):
+        return image.shape[1], image.shape[0]
+    return image.width, image.height
+
+def to_pil_image( image: Image.Image | np.ndarray ) -> Image.Image:
+    if isinstance( image, np.ndarray ):
+        return Image.fromarray( image )
+    return image
+
+def results_response( image: Image.Image | np.ndarray, request_id: str, results: List[ Result ] ) -> RecognizeDefaultResponse:
+
+    width, height = image_size( image )
+
+    return RecognizeDefaultResponse(
+        context_resolution={
+            'width': width,
+            'height': height
+        },
+        id=request_id,
+        results=results
+    )
@@ -8,10 +8,10 @@ except Exception as error:
     print(error)
 
 import threading
+import asyncio
 from concurrent import futures
 import logging
 import grpc
-from ocr_service_pb2 import Result
 import ocr_service_pb2 as service_pb
 import ocr_service_pb2_grpc as service_grpc
 import time
@@ -19,55 +19,80 @@ from multiprocessing import freeze_support
 
 IS_MAC_OS = sys.platform == 'darwin'
 
-try:
-    from manga_ocr_service.manga_ocr_service import MangaOcrService
-except ImportError:
-    print('MangaOcrService ImportError')
-    pass
-
-if IS_MAC_OS:
-    from apple_vision_service.apple_vision_service import AppleVisionService
-    from apple_vision_service.apple_vision_kit_service import AppleVisionKitService
-
 from motion_detection_service.motion_detection_service import MotionDetectionService
+from frame_input.frame_input import FramePool, InvalidFrameError, raw_image_to_array
+from frame_input.shared_memory_frames import SharedMemoryFrameReader
+from frame_input.frame_fingerprint import FrameResponseCache
+from service_settings import get_int_setting, get_float_setting, get_bool_setting, get_str_setting
+from request_scheduler import RequestScheduler, SchedulerError, SupersededError
+from ocr_engines.ocr_engine import OcrEngine
+from ocr_engines.engine_registry import EngineRegistry
+from ocr_engines.manga_ocr_engine import MangaOcrEngine
+from ocr_engines.apple_vision_engines import AppleVisionEngine, AppleVisionKitEngine
 
 import base64
 from io import BytesIO
 from PIL import Image
 import numpy as np
-from typing import List
-from concurrent.futures import ProcessPoolExecutor
+import cv2
+from typing import Callable, Dict, List
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 
 
 class Service( service_grpc.OCRServiceServicer ):
 
     server = None
-    processing = False
     keep_alive_timeout_seconds = 60
 
-    manga_ocr_service = None
-    apple_vision_service = None
-    apple_vision_kit_service = None
+    engines: EngineRegistry = None
     motion_detection_service = MotionDetectionService()
-
-    if 'torch' in sys.modules:
-        manga_ocr_service = MangaOcrService()
-
-    def __init__(self, server, executor: ProcessPoolExecutor = None, keep_alive_timeout_seconds = 60 ):
-        self.server = server
+    frame_pool = FramePool(
+        max_bytes= get_int_setting( 'FRAME_POOL_MEMORY_MB', 128 ) * 1024 * 1024
+    )
+    shared_memory_frames = SharedMemoryFrameReader()
+    scheduler = RequestScheduler(
+        max_concurrency= get_int_setting( 'ENGINE_MAX_CONCURRENCY', 1 ),
+        max_queue_size= get_int_setting( 'ENGINE_QUEUE_SIZE', 8 )
+    )
+    frame_response_cache = FrameResponseCache(
+        max_frames= get_int_setting( 'FRAME_CACHE_SIZE', 4 ),
+        tolerance= get_float_setting( 'FRAME_CACHE_TOLERANCE', 0 )
+    )
+
+    def __init__(self, server = None, executor: ProcessPoolExecutor = None, keep_alive_timeout_seconds = 60 ):
+        self.server = server # Set by serve() once the engines are preloaded
         self.last_rpc_time = time.time()
         self.keep_alive_timeout_seconds = keep_alive_timeout_seconds
         self.executor = executor
 
+        # Engines are imported and constructed on first use, so the server starts listening right away
+        self.engines = EngineRegistry( on_load= self.onEngineLoaded )
+        self.engines.register( 'MangaOCR', MangaOcrEngine )
+
         if IS_MAC_OS:
-            self.apple_vision_service = AppleVisionService()
-            self.apple_vision_kit_service = AppleVisionKitService( executor )
-            self.apple_vision_kit_service.init_bundle()
+            self.engines.register( 'AppleVision', AppleVisionEngine )
+            self.engines.register( 'AppleVisionKit', lambda: AppleVisionKitEngine( executor ) )
+
+    def onEngineLoaded( self, name: str, engine: OcrEngine ):
+        if engine.max_concurrency:
+            self.scheduler.set_max_concurrency( name, engine.max_concurrency )
+
+        engine.use_scheduler( lambda: self.scheduler.schedule( name ) )
+
+    def preloadEngines( self ):
+
+        names = [ name.strip() for name in get_str_setting( 'PRELOAD_ENGINES', '' ).split(',') if name.strip() ]
+
+        # Worker processes have to be forked before the server threads exist
+        if get_int_setting( 'MANGA_OCR_WORKERS', 0 ) > 0 and 'MangaOCR' not in names:
+            names.append( 'MangaOCR' )
+
+        self.engines.preload( names )
 
     def timeout_check(self):
         while True:
             time.sleep(5)
-            if not self.processing and time.time() - self.last_rpc_time > self.keep_alive_timeout_seconds:
+            if not self.scheduler.is_busy() and time.time() - self.last_rpc_time > self.keep_alive_timeout_seconds:
                 break # Terminate the server
         self.server.stop(0)
 
@@ -80,74 +105,209 @@ class Service( service_grpc.OCRServiceServicer ):
 
         return service_pb.KeepAliveResponse()
 
+    def warmUp( self ):
+
+        # Opt-in: only engines that are already loaded (PRELOAD_ENGINES) are warmed up,
+        # so it never imports an engine the user hasn't picked
+        if not get_bool_setting( 'WARM_UP', False ):
+            return
+
+        for name in get_str_setting( 'WARM_UP_ENGINES', 'MangaOCR' ).split(','):
+
+            engine = self.engines.get_loaded( name.strip() )
+            if not engine:
+                continue
+
+            try:
+                # Requests for the engine wait for it to be ready, without holding a scheduler slot meanwhile
+                engine.warm_up()
+            except Exception as error:
+                print(error)
+
+    def GetReadiness( self, request: service_pb.GetReadinessRequest, context ):
+        self.last_rpc_time = time.time()
+
+        engines: List[ service_pb.EngineReadiness ] = [
+            service_pb.EngineReadiness(
+                ocr_engine= name,
+                state= self.engines.state( name ),
+                error= self.engines.load_error( name ),
+                memory_bytes= self.engines.memory_usage( name )
+            )
+            for name in self.engines.names()
+        ]
+
+        if request.ocr_engine:
+            engines = [ engine for engine in engines if engine.ocr_engine == request.ocr_engine ]
+
+        return service_pb.GetReadinessResponse(
+            ready= all( engine.state == 'READY' for engine in engines ),
+            engines= engines
+        )
+
     def RecognizeBase64( self, request: service_pb.RecognizeBase64Request, context ):
         self.last_rpc_time = time.time()
 
-        image = self.base64ToPILImage(request.base64_image )
+        self.speculativeRecognition( request, context )
 
-        return self.HandleRecognizeRequest( image, request )
+        try:
+            return self.recognizeBase64( request )
+        except SchedulerError as error:
+            self.abortRequest( context, error )
     
     def RecognizeBytes( self, request: service_pb.RecognizeBytesRequest, context ):
         self.last_rpc_time = time.time()
 
-        image = self.bytesToPILImage( request.image_bytes )
+        self.speculativeRecognition( request, context )
 
-        return self.HandleRecognizeRequest( image, request )
+        try:
+            return self.recognizeBytes( request )
+        except ( SchedulerError, InvalidFrameError ) as error:
+            self.abortRequest( context, error )
         
     
-    def HandleRecognizeRequest( self, image: Image.Image, request: service_pb.RecognizeBase64Request ) -> service_pb.RecognizeDefaultResponse :
+    def RecognizeStream( self, request: service_pb.RecognizeBytesRequest, context ):
+        self.last_rpc_time = time.time()
+
+        self.speculativeRecognition( request, context )
+
+        try:
+            yield from self.recognizeStream( request )
+        except ( SchedulerError, InvalidFrameError ) as error:
+            self.abortRequest( context, error )
 
-        self.processing = True
+    # The request handling behind the RPCs, shared with AsyncService; scheduler errors are raised to the caller
+
+    def recognizeBase64( self, request: service_pb.RecognizeBase64Request ) -> service_pb.RecognizeDefaultResponse:
+        return self.HandleRecognizeRequest( self.base64ToPILImage( request.base64_image ), request )
+
+    def recognizeBytes( self, request: service_pb.RecognizeBytesRequest ) -> service_pb.RecognizeDefaultResponse:
+
+        image = self.requestImage( request )
+
+        try:
+            return self.HandleRecognizeRequest( image, request )
+        finally:
+            self.releaseImage( image )
+
+    def recognizeStream( self, request: service_pb.RecognizeBytesRequest ):
+
+        image = self.requestImage( request )
+
+        try:
+            yield from self.HandleRecognizeStreamRequest( image, request )
+        finally:
+            self.releaseImage( image )
 
-        results: List[Result] = []
+    def HandleRecognizeStreamRequest( self, image: Image.Image | np.ndarray, request: service_pb.RecognizeBytesRequest ):
+
+        try:
+            engine = self.engines.get( request.ocr_engine )
+        except ValueError as error:
+            print(error)
+            engine = None
+
+        if not engine or not engine.incremental_results:
+            # Engines without incremental results answer with a single complete response
+            yield self.HandleRecognizeRequest( image, request )
+            return
+
+        with self.scheduler.schedule( request.ocr_engine, request.source_id ):
+            try:
+                yield from engine.recognize_stream( image, request )
+
+            except Exception as error:
+                print(error)
+
+    def abortRequest( self, context, error: SchedulerError | InvalidFrameError ):
+
+        if isinstance( error, InvalidFrameError ):
+            context.abort( grpc.StatusCode.INVALID_ARGUMENT, str(error) )
+
+        if isinstance( error, SupersededError ):
+            context.abort( grpc.StatusCode.ABORTED, str(error) )
+
+        context.abort( grpc.StatusCode.RESOURCE_EXHAUSTED, str(error) )
+
+    def speculativeRecognition( self, request: service_pb.RecognizeBytesRequest, context ):
+
+        try:
+            background_work = self.engines.get( request.ocr_engine ).begin_request( request )
+        except Exception as error:
+            print(error)
+            return
+
+        # Starts once the response has been sent
+        if background_work:
+            context.add_callback( background_work )
+
+    def HandleRecognizeRequest( self, image: Image.Image | np.ndarray, request: service_pb.RecognizeBase64Request ) -> service_pb.RecognizeDefaultResponse :
+
+        # Frames matching a recent one get the same results without running the engine
+        cache_key = f'{request.ocr_engine}:{request.language_code}'
+        fingerprint = None
+
+        if self.frame_response_cache.max_frames > 0 and not request.boxes and not request.detection_only:
+            fingerprint = self.frame_response_cache.fingerprint( image )
+            cached_response = self.frame_response_cache.get( cache_key, fingerprint )
+
+            if cached_response:
+                return self.reuseResponse( cached_response, request )
 
         response = None
+        recognized = False
 
         try:
-            match request.ocr_engine:
-                case 'MangaOCR':
-                    response = self.manga_ocr_service.recognize(
-                        image= image,
-                        request_id= request.id,
-                        boxes= request.boxes,
-                        detection_only= request.detection_only,
-                    )
-
-                case 'AppleVision':
-                    results = self.apple_vision_service.recognize(
-                        image,
-                        request.language_code
-                    )
-                
-                case 'AppleVisionKit':
-                    results = self.apple_vision_kit_service.recognize(
-                        image,
-                        request.language_code
-                    )
-                    
-                case _:
-                    print(f'{request.ocr_engine} is not supported')
+            engine = self.engines.get( request.ocr_engine )
+
+            with self.scheduler.schedule( request.ocr_engine, request.source_id ):
+                response = engine.recognize( image, request )
+
+            recognized = True
+
+        except SchedulerError:
+            raise
 
         except Exception as error:
             print(error)
 
-        self.processing = False
+        if not response:
+            width, height = self.imageSize( image )
 
-        if response:
-            return response
+            response = service_pb.RecognizeDefaultResponse(
+                context_resolution={
+                    'width': width,
+                    'height': height
+                },
+                id=request.id,
+                results=[]
+            )
 
-        return service_pb.RecognizeDefaultResponse(
-            context_resolution={
-                'width': image.width,
-                'height': image.height
-            },
-            id=request.id,
-            results=results
-        )
+        if fingerprint and recognized:
+            self.frame_response_cache.put( cache_key, fingerprint, response )
+
+        return response
+
+    def reuseResponse( self, cached_response: service_pb.RecognizeDefaultResponse, request ) -> service_pb.RecognizeDefaultResponse:
+
+        response = service_pb.RecognizeDefaultResponse()
+        response.CopyFrom( cached_response )
+        response.id = request.id
+
+        engine = self.engines.get_loaded( request.ocr_engine )
+        if engine:
+            engine.reuse_response( response, cached_response.id )
+
+        return response
     
     def RecognizeSelective(self, request: service_pb.RecognizeSelectiveRequest, context):
 
-        self.processing = True
+        try:
+            return self.recognizeSelective( request )
+        except SchedulerError as error:
+            self.abortRequest( context, error )
+
+    def recognizeSelective( self, request: service_pb.RecognizeSelectiveRequest ) -> service_pb.RecognizeDefaultResponse:
 
         image: Image = None
 
@@ -160,22 +320,17 @@ class Service( service_grpc.OCRServiceServicer ):
         response = None
 
         try:
-            match request.ocr_engine:
-                case 'MangaOCR':
-                    response = self.manga_ocr_service.recognize_selective(
-                        image= image,
-                        request_id= request.id,
-                        result_ids= request.result_ids
-                    )
-                    
-                case _:
-                    print(f'{request.ocr_engine} is not supported')
+            engine = self.engines.get( request.ocr_engine )
+
+            with self.scheduler.schedule( request.ocr_engine ):
+                response = engine.recognize_selective( image, request )
+
+        except SchedulerError:
+            raise
 
         except Exception as error:
             print(error)
 
-        self.processing = False
-
         if response:
             return response
 
@@ -189,24 +344,87 @@ class Service( service_grpc.OCRServiceServicer ):
         )
 
     
-    def GetSupportedLanguages(self, request: service_pb.GetSupportedLanguagesRequest, context):
+    def Detect( self, request: service_pb.DetectRequest, context ):
         self.last_rpc_time = time.time()
 
-        language_codes: List[ str ] = []
+        try:
+            return self.detectText( request )
+        except ( SchedulerError, InvalidFrameError ) as error:
+            self.abortRequest( context, error )
+
+    def DetectStream( self, request: service_pb.DetectRequest, context ):
+        self.last_rpc_time = time.time()
+
+        try:
+            yield from self.detectTextStream( request )
+        except ( SchedulerError, InvalidFrameError ) as error:
+            self.abortRequest( context, error )
+
+    def detectText( self, request: service_pb.DetectRequest ) -> service_pb.DetectResponse:
+
+        image = self.requestImage( request )
+
+        try:
+            engine = self.engines.get( request.ocr_engine )
+
+            with self.scheduler.schedule( request.ocr_engine ):
+                return engine.detect( image, request )
+
+        except SchedulerError:
+            raise
+
+        except Exception as error:
+            print(error)
+
+        finally:
+            self.releaseImage( image )
+
+        return self.emptyDetectResponse( image, request )
+
+    def detectTextStream( self, request: service_pb.DetectRequest ):
+
+        image = self.requestImage( request )
+
+        try:
+            engine = self.engines.get( request.ocr_engine )
+
+            with self.scheduler.schedule( request.ocr_engine ):
+                yield from engine.detect_stream( image, request )
+                return
+
+        except SchedulerError:
+            raise
+
+        except Exception as error:
+            print(error)
+
+        finally:
+            self.releaseImage( image )
+
+        yield self.emptyDetectResponse( image, request )
+
+    def emptyDetectResponse( self, image: Image.Image | np.ndarray, request: service_pb.DetectRequest ) -> service_pb.DetectResponse:
 
-        match request.ocr_engine:
-            case 'MangaOCR':
-                language_codes.append( 'ja-JP' )
+        width, height = self.imageSize( image )
 
-            case 'AppleVision':
-                language_codes = self.apple_vision_service.getSupportedLanguages()
-            
-            case 'AppleVisionKit':
-                language_codes = self.apple_vision_kit_service.get_supported_languages()
-                
-            case _:
-                print(f'{request.ocr_engine} is not supported')
+        return service_pb.DetectResponse(
+            id= request.id,
+            results= [],
+            context_resolution={
+                'width': width,
+                'height': height
+            }
+        )
+
+    def GetSupportedLanguages(self, request: service_pb.GetSupportedLanguagesRequest, context):
+        self.last_rpc_time = time.time()
 
+        language_codes: List[ str ] = []
+
+        try:
+            language_codes = self.engines.get( request.ocr_engine ).get_supported_languages()
+        except Exception as error:
+            print(error)
 
         return service_pb.GetSupportedLanguagesResponse(
             language_codes= language_codes
@@ -217,19 +435,10 @@ class Service( service_grpc.OCRServiceServicer ):
 
         models = []
 
-        match request.ocr_engine:
-            case 'MangaOCR':
-                models = self.manga_ocr_service.get_supported_models()
-
-            case 'AppleVision':
-                pass # models = self.apple_vision_service.get_supported_models()
-            
-            case 'AppleVisionKit':
-                pass # models = self.apple_vision_kit_service.get_supported_models()
-                
-            case _:
-                print(f'{request.ocr_engine} is not supported')
-
+        try:
+            models = self.engines.get( request.ocr_engine ).get_supported_models()
+        except Exception as error:
+            print(error)
 
         return service_pb.GetSupportedModelsResponse(
             models = models
@@ -240,19 +449,13 @@ class Service( service_grpc.OCRServiceServicer ):
 
         success = False
 
-        match request.ocr_engine:
-            case 'MangaOCR':
-                success = self.manga_ocr_service.install_model( request.model_name )
-
-            case 'AppleVision':
-                pass # models = self.apple_vision_service.install_model()
-            
-            case 'AppleVisionKit':
-                pass # models = self.apple_vision_kit_service.install_model()
-                
-            case _:
-                print(f'{request.ocr_engine} is not supported')
-
+        try:
+            success = self.engines.get( request.ocr_engine ).install_model( request.model_name )
+        except Exception as error:
+            print(error)
+        finally:
+            # Responses cached with the previous model are stale
+            self.frame_response_cache.clear()
 
         return service_pb.InstallModelResponse(
             success = success
@@ -263,19 +466,10 @@ class Service( service_grpc.OCRServiceServicer ):
 
         options = []
 
-        match request.ocr_engine:
-            case 'MangaOCR':
-                options = self.manga_ocr_service.get_hardware_acceleration_options()
-
-            case 'AppleVision':
-                pass # options = self.apple_vision_service.get_hardware_acceleration_options()
-            
-            case 'AppleVisionKit':
-                pass # models = self.apple_vision_kit_service.get_hardware_acceleration_options()
-                
-            case _:
-                print(f'{request.ocr_engine} is not supported')
-
+        try:
+            options = self.engines.get( request.ocr_engine ).get_hardware_acceleration_options()
+        except Exception as error:
+            print(error)
 
         return service_pb.GetHardwareAccelerationOptionsResponse(
             options= options
@@ -283,17 +477,148 @@ class Service( service_grpc.OCRServiceServicer ):
 
 
     def MotionDetection(self, request: service_pb.MotionDetectionRequest, context):
-        
-        result = self.motion_detection_service.detect(
-            request.stream_id,
-            frame= self.bytesToPILImage( request.frame ),
-            threshold_min= request.threshold_min,
-            threshold_max= request.threshold_max,
-            stream_length= request.stream_length,
-        )
 
-        return result
+        try:
+            return self.motionDetection( request )
+        except InvalidFrameError as error:
+            self.abortRequest( context, error )
+
+    def motionDetection( self, request: service_pb.MotionDetectionRequest ) -> service_pb.MotionDetectionResponse:
+
+        if request.close_stream:
+            self.motion_detection_service.deleteStream( request.stream_id )
+            return service_pb.MotionDetectionResponse()
+
+        def detect( frame: np.ndarray | None, pixel_format: str ) -> service_pb.MotionDetectionResponse:
+
+            if frame is None:
+                frame = self.bytesToPILImage( request.frame )
+                pixel_format = 'RGB'
+
+            return self.motion_detection_service.detect(
+                request.stream_id,
+                frame= frame,
+                threshold_min= request.threshold_min,
+                threshold_max= request.threshold_max,
+                stream_length= request.stream_length,
+                background_mode= request.background_mode,
+                pixel_format= pixel_format,
+                return_changed_regions= request.return_changed_regions,
+            )
+
+        return self.withUncompressedFrame( request, 'raw_frame', detect )
     
+    def MotionDetectionStream(self, request_iterator, context):
+
+        parameters = service_pb.MotionDetectionStreamParameters()
+
+        try:
+            for request in request_iterator:
+                self.last_rpc_time = time.time()
+
+                if request.WhichOneof('payload') in ( 'parameters', 'close' ):
+                    parameters = self.motionStreamMessage( parameters, request )
+                    continue
+
+                yield self.detectMotion( parameters, request )
+
+        except InvalidFrameError as error:
+            self.abortRequest( context, error )
+
+        finally:
+            # The stream state belongs to this call, also when it's cancelled
+            self.motion_detection_service.deleteStream( parameters.stream_id )
+
+    def motionStreamMessage(
+        self,
+        parameters: service_pb.MotionDetectionStreamParameters,
+        request: service_pb.MotionDetectionStreamRequest
+    ) -> service_pb.MotionDetectionStreamParameters:
+
+        # Parameters or close; returns the parameters for the following frames
+
+        if request.HasField('parameters'):
+            # The previous stream isn't used anymore once the call switches to another one
+            if request.parameters.stream_id != parameters.stream_id:
+                self.motion_detection_service.deleteStream( parameters.stream_id )
+            return request.parameters
+
+        if request.close:
+            self.motion_detection_service.deleteStream( parameters.stream_id )
+
+        return parameters
+
+    def detectMotion(
+        self,
+        parameters: service_pb.MotionDetectionStreamParameters,
+        request: service_pb.MotionDetectionStreamRequest
+    ) -> service_pb.MotionDetectionResponse:
+
+        def detect( frame: np.ndarray | None, pixel_format: str ) -> service_pb.MotionDetectionResponse:
+
+            if frame is None:
+                frame = self.bytesToGrayscaleArray( request.frame )
+                pixel_format = 'GRAY'
+
+            return self.motion_detection_service.detect(
+                parameters.stream_id,
+                frame= frame,
+                pixel_format= pixel_format,
+                threshold_min= parameters.threshold_min,
+                threshold_max= parameters.threshold_max,
+                stream_length= parameters.stream_length,
+                background_mode= parameters.background_mode,
+                return_changed_regions= parameters.return_changed_regions,
+            )
+
+        return self.withUncompressedFrame( request, 'raw_frame', detect )
+    
+    def requestImage( self, request: service_pb.RecognizeBytesRequest ) -> Image.Image | np.ndarray:
+
+        # Only non-RGB formats are converted, into a pooled buffer.
+        # Shared memory frames are always copied: the client reuses the slot while the request
+        # may still wait in the scheduler queue, or be fingerprinted for the response cache.
+        is_shared_memory = request.HasField('shared_memory_frame')
+
+        def to_rgb( image: np.ndarray | None, pixel_format: str ) -> np.ndarray | None:
+            if image is None:
+                return None
+            return self.frame_pool.to_rgb( image, pixel_format, copy= is_shared_memory )
+
+        image = self.withUncompressedFrame( request, 'raw_image', to_rgb )
+
+        if image is not None:
+            return image
+
+        return self.bytesToPILImage( request.image_bytes )
+
+    def withUncompressedFrame( self, request, raw_image_field: str, use: Callable[ [ np.ndarray | None, str ], object ] ):
+
+        # Calls "use" with the frame and its pixel format, or with None and '' when the request has none.
+        # Both are wrapped as NumPy views, without decoding or copying. Shared memory views are only valid
+        # while the client doesn't reuse the slot, and are released when "use" returns, so it can't keep them.
+        if request.HasField( raw_image_field ):
+            raw_image = getattr( request, raw_image_field )
+            return use( raw_image_to_array( raw_image ), raw_image.pixel_format or 'BGRA' )
+
+        if request.HasField('shared_memory_frame'):
+            shared_frame = request.shared_memory_frame
+            return self.shared_memory_frames.read(
+                shared_frame,
+                lambda frame: use( frame, shared_frame.pixel_format or 'BGRA' )
+            )
+
+        return use( None, '' )
+
+    def releaseImage( self, image: Image.Image | np.ndarray ):
+        if isinstance( image, np.ndarray ):
+            self.frame_pool.release( image )
+
+    def imageSize( self, image: Image.Image | np.ndarray ) -> tuple[int, int]: # width, height
+        if isinstance( image, np.ndarray ):
+            return image.shape[1], image.shape[0]
+        return image.width, image.height
+
     def base64ToPILImage( self, base64_data: str ) -> Image.Image:
         image_data = base64.b64decode( base64_data )
         return Image.open( BytesIO(image_data) )
@@ -302,21 +627,301 @@ class Service( service_grpc.OCRServiceServicer ):
         buffer = BytesIO(bytes_data)
         return Image.open(buffer)
 
+    def bytesToGrayscaleArray( self, bytes_data: bytes ) -> np.ndarray:
+        # Decodes straight to a single channel, skipping the RGB buffer and color conversion
+        return cv2.imdecode(
+            np.frombuffer( bytes_data, dtype=np.uint8 ),
+            cv2.IMREAD_GRAYSCALE
+        )
+
+
+class AsyncService( Service ):
+
+    # Handlers for the grpc.aio server (ASYNC_SERVER). They run as coroutines on a single event loop,
+    # and the blocking work goes to executors: one per engine, with a thread for every request its
+    # scheduler queue can hold, and separate ones for motion detection and engine queries.
+    # Cheap RPCs and motion streams don't wait for a free server thread behind long recognitions.
+
+    def __init__( self, server = None, executor: ProcessPoolExecutor = None, keep_alive_timeout_seconds = 60 ):
+        self.engine_executors: Dict[ str, ThreadPoolExecutor ] = {}
+
+        super().__init__( server, executor, keep_alive_timeout_seconds )
+
+        # Engine loading, model queries and installs
+        self.control_executor = ThreadPoolExecutor( max_workers= 4, thread_name_prefix= 'control' )
+
+        self.motion_executor = ThreadPoolExecutor(
+            max_workers= get_int_setting( 'MOTION_DETECTION_WORKERS', 4 ),
+            thread_name_prefix= 'motion'
+        )
+
+        self.background_tasks = set()
+
+    def onEngineLoaded( self, name: str, engine: OcrEngine ):
+        super().onEngineLoaded( name, engine )
+
+        # A thread for each request the scheduler holds, plus one so that the requests beyond its queue
+        # reach it right away (and are rejected, or supersede an older frame) instead of waiting for a thread
+        self.engine_executors[ name ] = ThreadPoolExecutor(
+            max_workers= self.scheduler.capacity( name ) + 1,
+            thread_name_prefix= name
+        )
+
+    async def engineExecutor( self, name: str ) -> Executor:
+
+        if not self.engines.get_loaded( name ):
+            try:
+                await self.runIn( self.control_executor, self.engines.get, name )
+            except ValueError:
+                # Unknown or unavailable; the request handling reports it and answers with an empty response
+                return self.control_executor
+
+        return self.engine_executors[ name ]
+
+    async def runIn( self, executor: Executor, function: Callable, *args ):
+        return await asyncio.get_running_loop().run_in_executor( executor, function, *args )
+
+    async def streamIn( self, executor: Executor, generator_function: Callable, *args ):
+
+        # The generator runs in a single executor thread, so its scheduler slot is entered and left there.
+        # Its items are handed over to the event loop as they are produced.
+        loop = asyncio.get_running_loop()
+        items = asyncio.Queue()
+        cancelled = threading.Event()
+        end = object()
+
+        def produce():
+            try:
+                for item in generator_function( *args ):
+                    if cancelled.is_set():
+                        break # Closes the generator, releasing its image and scheduler slot
+                    loop.call_soon_threadsafe( items.put_nowait, item )
+
+            except Exception as error:
+                loop.call_soon_threadsafe( items.put_nowait, error )
+
+            finally:
+                loop.call_soon_threadsafe( items.put_nowait, end )
+
+        producer = loop.run_in_executor( executor, produce )
+
+        try:
+            while ( item := await items.get() ) is not end:
+                if isinstance( item, Exception ):
+                    raise item
+                yield item
+
+        finally:
+            cancelled.set()
+
+        await producer
+
+    def stopServer( self ):
+        # stop() cancels the running RPCs, this one included, so it's not awaited here
+        task = asyncio.create_task( self.server.stop(0) )
+        self.background_tasks.add( task )
+        task.add_done_callback( self.background_tasks.discard )
+
+    def shutdownExecutors( self ):
+        for executor in [ self.control_executor, self.motion_executor, *self.engine_executors.values() ]:
+            executor.shutdown( wait= False, cancel_futures= True )
+
+    async def abortRequestAsync( self, context: grpc.aio.ServicerContext, error: SchedulerError | InvalidFrameError ):
+
+        if isinstance( error, InvalidFrameError ):
+            await context.abort( grpc.StatusCode.INVALID_ARGUMENT, str(error) )
+
+        if isinstance( error, SupersededError ):
+            await context.abort( grpc.StatusCode.ABORTED, str(error) )
+
+        await context.abort( grpc.StatusCode.RESOURCE_EXHAUSTED, str(error) )
+
+    def speculativeRecognition( self, request: service_pb.RecognizeBytesRequest, context: grpc.aio.ServicerContext ):
+
+        try:
+            background_work = self.engines.get( request.ocr_engine ).begin_request( request )
+        except Exception as error:
+            print(error)
+            return
+
+        # Starts once the RPC is done
+        if background_work:
+            context.add_done_callback( lambda _: background_work() )
+
+    async def KeepAlive( self, request: service_pb.KeepAliveRequest, context ):
+        self.last_rpc_time = time.time()
+
+        self.keep_alive_timeout_seconds = request.timeout_seconds
+        if not request.keep_alive:
+            self.stopServer()
+
+        return service_pb.KeepAliveResponse()
+
+    async def GetReadiness( self, request: service_pb.GetReadinessRequest, context ):
+        return super().GetReadiness( request, context )
+
+    async def RecognizeBase64( self, request: service_pb.RecognizeBase64Request, context ):
+        return await self.recognizeAsync( self.recognizeBase64, request, context )
+
+    async def RecognizeBytes( self, request: service_pb.RecognizeBytesRequest, context ):
+        return await self.recognizeAsync( self.recognizeBytes, request, context )
+
+    async def recognizeAsync( self, handler: Callable, request: service_pb.RecognizeBytesRequest, context ):
+        self.last_rpc_time = time.time()
+
+        executor = await self.engineExecutor( request.ocr_engine )
+
+        self.speculativeRecognition( request, context )
+
+        try:
+            return await self.runIn( executor, handler, request )
+        except ( SchedulerError, InvalidFrameError ) as error:
+            await self.abortRequestAsync( context, error )
+
+    async def RecognizeStream( self, request: service_pb.RecognizeBytesRequest, context ):
+        self.last_rpc_time = time.time()
+
+        executor = await self.engineExecutor( request.ocr_engine )
+
+        self.speculativeRecognition( request, context )
+
+        try:
+            async for response in self.streamIn( executor, self.recognizeStream, request ):
+                yield response
+        except ( SchedulerError, InvalidFrameError ) as error:
+            await self.abortRequestAsync( context, error )
+
+    async def RecognizeSelective( self, request: service_pb.RecognizeSelectiveRequest, context ):
+
+        executor = await self.engineExecutor( request.ocr_engine )
+
+        try:
+            return await self.runIn( executor, self.recognizeSelective, request )
+        except SchedulerError as error:
+            await self.abortRequestAsync( context, error )
+
+    async def Detect( self, request: service_pb.DetectRequest, context ):
+        self.last_rpc_time = time.time()
+
+        executor = await self.engineExecutor( request.ocr_engine )
+
+        try:
+            return await self.runIn( executor, self.detectText, request )
+        except ( SchedulerError, InvalidFrameError ) as error:
+            await self.abortRequestAsync( context, error )
+
+    async def DetectStream( self, request: service_pb.DetectRequest, context ):
+        self.last_rpc_time = time.time()
+
+        executor = await self.engineExecutor( request.ocr_engine )
+
+        try:
+            async for response in self.streamIn( executor, self.detectTextStream, request ):
+                yield response
+        except ( SchedulerError, InvalidFrameError ) as error:
+            await self.abortRequestAsync( context, error )
+
+    # Engine queries may load the engine, download or scan models
+
+    async def GetSupportedLanguages( self, request: service_pb.GetSupportedLanguagesRequest, context ):
+        return await self.runIn( self.control_executor, super().GetSupportedLanguages, request, context )
+
+    async def GetSupportedModels( self, request: service_pb.GetSupportedModelsRequest, context ):
+        return await self.runIn( self.control_executor, super().GetSupportedModels, request, context )
+
+    async def InstallModel( self, request: service_pb.InstallModelRequest, context ):
+        return await self.runIn( self.control_executor, super().InstallModel, request, context )
+
+    async def GetHardwareAccelerationOptions( self, request: service_pb.GetHardwareAccelerationOptionsRequest, context ):
+        return await self.runIn( self.control_executor, super().GetHardwareAccelerationOptions, request, context )
+
+    async def MotionDetection( self, request: service_pb.MotionDetectionRequest, context ):
+        try:
+            return await self.runIn( self.motion_executor, self.motionDetection, request )
+        except InvalidFrameError as error:
+            await self.abortRequestAsync( context, error )
+
+    async def MotionDetectionStream( self, request_iterator, context ):
+
+        # No thread is held between frames; each one is processed in order on the motion executor
+        parameters = service_pb.MotionDetectionStreamParameters()
+
+        try:
+            async for request in request_iterator:
+                self.last_rpc_time = time.time()
+
+                if request.WhichOneof('payload') in ( 'parameters', 'close' ):
+                    parameters = self.motionStreamMessage( parameters, request )
+                    continue
+
+                yield await self.runIn( self.motion_executor, self.detectMotion, parameters, request )
+
+        except InvalidFrameError as error:
+            await self.abortRequestAsync( context, error )
+
+        finally:
+            # The stream state belongs to this call, also when it's cancelled
+            self.motion_detection_service.deleteStream( parameters.stream_id )
+
+
+def print_server_info( port: str ):
+
+    server_data = { "server_address": f"0.0.0.0:{port}" }
+
+    server_info = f'[INFO-JSON]:{server_data}'
+    print( server_info.replace("'", '"') )
+
+
+async def serve_async( servicer: AsyncService, port: str ):
+
+    server = grpc.aio.server()
+
+    servicer.server = server
+    service_grpc.add_OCRServiceServicer_to_server( servicer, server )
+
+    server.add_insecure_port("[::]:" + port)
+    await server.start()
+
+    print_server_info( port )
+
+    # Loads the models now rather than on the first request
+    warm_up_thread = threading.Thread( target= servicer.warmUp, daemon= True )
+    warm_up_thread.start()
+
+    await server.wait_for_termination()
+
+    servicer.shutdownExecutors()
+    servicer.shared_memory_frames.close()
+
 
 def serve( port: str = '23456', executor: ProcessPoolExecutor = None ):
 
+    is_async_server = get_bool_setting( 'ASYNC_SERVER', False )
+
+    servicer = AsyncService( executor= executor ) if is_async_server else Service( executor= executor )
+
+    # Only the engines that must be ready before the server starts; others load on first use.
+    # Done before the gRPC server and the event loop are created, while the service is still single threaded,
+    # as this is when the recognition worker processes are forked.
+    servicer.preloadEngines()
+
+    if is_async_server:
+        asyncio.run( serve_async( servicer, port ) )
+        return
+
     server = grpc.server( futures.ThreadPoolExecutor( max_workers=10 ) )
 
-    servicer = Service( server, executor )
+    servicer.server = server
     service_grpc.add_OCRServiceServicer_to_server( servicer, server )
 
     server.add_insecure_port("[::]:" + port)
     server.start()
 
-    server_data = { "server_address": f"0.0.0.0:{port}" }
+    print_server_info( port )
 
-    server_info = f'[INFO-JSON]:{server_data}'
-    print( server_info.replace("'", '"') )
+    # Loads the models now rather than on the first request
+    warm_up_thread = threading.Thread( target= servicer.warmUp, daemon= True )
+    warm_up_thread.start()
 
     # Start the timeout check in a new thread
     # timeout_thread = threading.Thread(target=servicer.timeout_check)
@@ -324,6 +929,8 @@ def serve( port: str = '23456', executor: ProcessPoolExecutor = None ):
 
     server.wait_for_termination()
 
+    servicer.shared_memory_frames.close()
+
 
 if __name__ == "__main__":
     # freeze_support()
@@ -0,0 +1,122 @@
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterator
+from service_settings import get_int_setting
+
+
+class SchedulerError(Exception):
+    pass
+
+class QueueFullError(SchedulerError):
+    pass
+
+class SupersededError(SchedulerError):
+    pass
+
+
+class RequestTicket:
+
+    def __init__( self, source_id: str ):
+        self.source_id = source_id
+        self.superseded = False
+
+
+class EngineQueue:
+
+    def __init__( self, max_concurrency: int, max_queue_size: int ):
+        self.max_concurrency = max( 1, max_concurrency )
+        self.max_queue_size = max_queue_size
+        self.running = 0
+        self.waiting: Deque[ RequestTicket ] = deque()
+
+
+class RequestScheduler:
+
+    # Admits requests to each engine in arrival order, at most max_concurrency at a time.
+    # Requests that would wait behind a full queue are rejected, and a waiting frame
+    # is dropped as soon as a newer one from the same source arrives.
+
+    def __init__( self, max_concurrency: int = 1, max_queue_size: int = 8 ):
+        self.max_concurrency = max_concurrency
+        self.max_queue_size = max_queue_size
+        self.engine_max_concurrency: Dict[ str, int ] = {}
+        self.queues: Dict[ str, EngineQueue ] = {}
+        self.condition = threading.Condition()
+
+    @contextmanager
+    def schedule( self, engine: str, source_id: str = '' ) -> Iterator[ None ]:
+
+        queue = self.admit( engine, source_id )
+
+        try:
+            yield
+        finally:
+            with self.condition:
+                queue.running -= 1
+                self.condition.notify_all()
+
+    def admit( self, engine: str, source_id: str = '' ) -> EngineQueue:
+
+        with self.condition:
+
+            queue = self.get_queue( engine )
+
+            # Latest frame wins; requests without a source are never coalesced
+            if source_id:
+                for ticket in list( queue.waiting ):
+                    if ticket.source_id == source_id:
+                        ticket.superseded = True
+                        queue.waiting.remove( ticket )
+                        self.condition.notify_all()
+
+            if queue.running >= queue.max_concurrency and len(queue.waiting) >= queue.max_queue_size:
+                raise QueueFullError(f'{engine} queue is full')
+
+            ticket = RequestTicket( source_id )
+            queue.waiting.append( ticket )
+
+            while True:
+
+                if ticket.superseded:
+                    raise SupersededError(f'{engine} request superseded by a newer frame from {source_id}')
+
+                if queue.waiting[0] is ticket and queue.running < queue.max_concurrency:
+                    queue.waiting.popleft()
+                    queue.running += 1
+                    # The next one in line may fit as well
+                    self.condition.notify_all()
+                    return queue
+
+                self.condition.wait()
+
+    def get_queue( self, engine: str ) -> EngineQueue:
+
+        if engine not in self.queues:
+            self.queues[ engine ] = EngineQueue(
+                max_concurrency= get_int_setting(
+                    f'{engine.upper()}_MAX_CONCURRENCY',
+                    self.engine_max_concurrency.get( engine, self.max_concurrency )
+                ),
+                max_queue_size= get_int_setting( f'{engine.upper()}_QUEUE_SIZE', self.max_queue_size )
+            )
+
+        return self.queues[ engine ]
+
+    def set_max_concurrency( self, engine: str, max_concurrency: int ):
+        # Default for engines that can run more than one request at a time; applies to new queues
+        with self.condition:
+            self.engine_max_concurrency[ engine ] = max_concurrency
+
+    def capacity( self, engine: str ) -> int:
+        # Requests the engine holds at once, running or waiting
+        with self.condition:
+            queue = self.get_queue( engine )
+            return queue.max_concurrency + queue.max_queue_size
+
+    def is_busy( self ) -> bool:
+        with self.condition:
+            return any(
+                queue.running > 0 or len(queue.waiting) > 0
+                for queue in self.queues.values()
+            )
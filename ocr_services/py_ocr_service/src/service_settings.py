@@ -0,0 +1,38 @@
+import os
+
+# Tuning knobs are read from environment variables, like MODELS_PATH and CUSTOM_MODULES_PATH
+
+def get_str_setting( name: str, default: str ) -> str:
+    return os.environ.get( name, default )
+
+def get_int_setting( name: str, default: int ) -> int:
+    try:
+        return int( os.environ[name] )
+
+    except KeyError:
+        pass
+
+    except ValueError:
+        print(f'Invalid value for {name}: {os.environ[name]}')
+
+    return default
+
+def get_float_setting( name: str, default: float ) -> float:
+    try:
+        return float( os.environ[name] )
+
+    except KeyError:
+        pass
+
+    except ValueError:
+        print(f'Invalid value for {name}: {os.environ[name]}')
+
+    return default
+
+def get_bool_setting( name: str, default: bool ) -> bool:
+    value = os.environ.get( name )
+
+    if value is None:
+        return default
+
+    return value.strip().lower() in ( '1', 'true', 'yes', 'on' )
@@ -0,0 +1,70 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str( Path(__file__).resolve().parent.parent / 'src' ))
+
+import numpy as np
+from PIL import Image
+from ocr_service_pb2 import RecognizeDefaultResponse
+from frame_input.frame_fingerprint import FrameResponseCache
+
+# Run "gen_grpc_service" first, then: python -m pytest tests
+
+
+def make_frame( seed: int = 0 ) -> np.ndarray:
+    return np.random.default_rng( seed ).integers( 0, 256, ( 720, 1280, 3 ), dtype=np.uint8 )
+
+
+def test_exact_cache_matches_identical_frames_only():
+    cache = FrameResponseCache( max_frames= 4 )
+    frame = make_frame()
+    response = RecognizeDefaultResponse( id= 'a' )
+
+    cache.put( 'MangaOCR', cache.fingerprint( frame ), response )
+
+    assert cache.get( 'MangaOCR', cache.fingerprint( frame.copy() ) ) is response
+
+    changed = frame.copy()
+    changed[ 0, 0, 0 ] ^= 1
+    assert cache.get( 'MangaOCR', cache.fingerprint( changed ) ) is None
+
+
+def test_tolerant_cache_matches_similar_frames():
+    cache = FrameResponseCache( max_frames= 4, tolerance= 2 )
+    frame = make_frame()
+    response = RecognizeDefaultResponse( id= 'a' )
+
+    cache.put( 'MangaOCR', cache.fingerprint( frame ), response )
+
+    # Compression noise
+    noise = np.random.default_rng(1).integers( -2, 3, frame.shape )
+    noisy = ( frame.astype( np.int16 ) + noise ).clip( 0, 255 ).astype( np.uint8 )
+
+    assert cache.get( 'MangaOCR', cache.fingerprint( noisy ) ) is response
+    assert cache.get( 'MangaOCR', cache.fingerprint( Image.fromarray( frame ) ) ) is response
+
+
+def test_tolerant_cache_rejects_different_frames():
+    cache = FrameResponseCache( max_frames= 4, tolerance= 2 )
+    frame = make_frame()
+
+    cache.put( 'MangaOCR', cache.fingerprint( frame ), RecognizeDefaultResponse( id= 'a' ) )
+
+    assert cache.get( 'MangaOCR', cache.fingerprint( make_frame( seed= 1 ) ) ) is None
+    assert cache.get( 'MangaOCR', cache.fingerprint( frame[ :360 ] ) ) is None
+    assert cache.get( 'AppleVision', cache.fingerprint( frame ) ) is None
+
+
+def test_clear_drops_cached_and_in_flight_responses():
+    cache = FrameResponseCache( max_frames= 4 )
+    frame = make_frame()
+
+    cache.put( 'MangaOCR', cache.fingerprint( frame ), RecognizeDefaultResponse( id= 'a' ) )
+    in_flight = cache.fingerprint( frame )
+
+    cache.clear()
+    assert cache.get( 'MangaOCR', cache.fingerprint( frame ) ) is None
+
+    # Recognized with the previous model, answered after the clear
+    cache.put( 'MangaOCR', in_flight, RecognizeDefaultResponse( id= 'b' ) )
+    assert cache.get( 'MangaOCR', cache.fingerprint( frame ) ) is None